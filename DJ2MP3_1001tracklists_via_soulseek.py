@@ -1,12 +1,19 @@
 import os
 import sys
 import argparse
-import subprocess
 import re
 import requests
 from bs4 import BeautifulSoup
-import shutil
 import time
+import codecs
+from html.parser import HTMLParser
+
+from audio_analysis import analyze_directory, analysis_cache_path
+from query_planner import download_with_query_plan
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+import io_scheduler
+from job_plan import plan_cached_source
 
 def sanitize_filename(name):
     # Replace all problematic characters (including slashes, backslashes, and whitespace at ends) with underscores
@@ -30,120 +37,263 @@ def extract_tracklist_title(soup):
     
     return "Unknown Tracklist"
 
-def fetch_1001tracklists_tracks(url):
-    """
-    Scrape tracks from a 1001tracklists URL.
-    Returns a list of "Artist Track" strings.
-    """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+def parse_track_value(track_text):
+    """Turn the text of a 'trackValue' span into 'Artist Title', or None."""
+    # Fix common spacing issues in 1001tracklists data
+    track_text = re.sub(r'&', ' & ', track_text)  # Fix "&" to " & "
+    track_text = re.sub(r'-', ' - ', track_text)  # Fix "-" to " - "
+    track_text = re.sub(r'\s+', ' ', track_text)  # Fix multiple spaces
+    track_text = track_text.strip()
     
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        tracks = []
-        
-        # Extract tracklist title
-        tracklist_title = extract_tracklist_title(soup)
+    # Parse the track text to extract artist and title
+    # Pattern: "Artist - Title" or "Artist & Artist - Title (Remix info)"
+    if ' - ' in track_text:
+        # Remove common extra info that might interfere
+        clean_text = re.sub(r'\(.*?\)', '', track_text)  # Remove remix info in parentheses
+        clean_text = re.sub(r'\[.*?\]', '', clean_text)  # Remove label info in brackets
+        clean_text = clean_text.strip()
         
-        print(f"Page title: {tracklist_title}")
-        
-        # Method 1: Look for 1001tracklists track items specifically
-        # Based on actual HTML structure analysis
-        track_items = soup.find_all('div', class_='tlpItem')
+        parts = clean_text.split(' - ', 1)
+        if len(parts) == 2:
+            artist = parts[0].strip()
+            title = parts[1].strip()
+            
+            if len(artist) > 0 and len(title) > 0:
+                return f'{artist} {title}'
+    return None
+
+def parse_text_line(line):
+    """Heuristically turn a plain text line of the page into 'Artist Title', or None."""
+    line = line.strip()
+    # Look for lines that match track pattern
+    if ' - ' in line and 5 < len(line) < 200:
+        # Skip non-track lines
+        if any(skip in line.lower() for skip in [
+            'download', 'subscribe', 'comment', 'share', 'upload',
+            'genre:', 'bpm:', 'key:', 'tracklist', 'playlist',
+            'http', 'www', '.com', 'follow', 'like', '1001'
+        ]):
+            return None
         
-        for item in track_items:
-            # Look for the track value span
-            track_value_span = item.find('span', class_='trackValue')
-            if track_value_span:
-                # Extract all text and clean it up
-                track_text = track_value_span.get_text(strip=True)
+        # Check if it looks like a track (simple heuristic)
+        if re.match(r'^[\w\s&.,-]+ - [\w\s&.,-]+$', line):
+            parts = line.split(' - ', 1)
+            if len(parts) == 2:
+                artist, title = parts
+                artist = artist.strip()
+                title = title.strip()
                 
-                # Fix common spacing issues in 1001tracklists data
-                track_text = re.sub(r'&', ' & ', track_text)  # Fix "&" to " & "
-                track_text = re.sub(r'-', ' - ', track_text)  # Fix "-" to " - "
-                track_text = re.sub(r'\s+', ' ', track_text)  # Fix multiple spaces
-                track_text = track_text.strip()
+                if (len(artist) > 0 and len(title) > 0 and 
+                    len(artist) < 100 and len(title) < 100):
+                    return f'{artist} {title}'
+    return None
+
+class TracklistStreamParser(HTMLParser):
+    """
+    Incremental parser for 1001tracklists pages. Feed it HTML chunks; it keeps only the
+    page title, the text of the 'trackValue' span being read and the tracks found so far.
+    Text lines outside of script/style are checked with the Method 3 heuristics on the
+    fly, so no full document or full page text is ever held in memory.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tracks = []
+        self.text_tracks = []
+        self.h1_title = None
+        self.page_title = None
+        self._tlp_depth = 0       # >0 while inside <div class="tlpItem">
+        self._value_depth = 0     # >0 while inside <span class="trackValue"> of a tlpItem
+        self._value_text = []     # stripped text nodes of the trackValue span, like get_text(strip=True)
+        self._value_node = []     # the current text node, which may arrive split across chunks
+        self._capture = None      # 'h1' or 'title' while reading the title text
+        self._title_text = []
+        self._skip_depth = 0      # >0 while inside <script>/<style>
+        self._line = []
+
+    def _end_value_node(self):
+        if self._value_node:
+            self._value_text.append(''.join(self._value_node).strip())
+            self._value_node = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._value_depth:
+            self._end_value_node()
+        classes = (dict(attrs).get('class') or '').split()
+        if tag in ('script', 'style'):
+            self._skip_depth += 1
+        elif tag == 'div' and (self._tlp_depth or 'tlpItem' in classes):
+            self._tlp_depth += 1
+        elif tag == 'span' and (self._value_depth or (self._tlp_depth and 'trackValue' in classes)):
+            self._value_depth += 1
+        if tag in ('h1', 'title') and self._capture is None:
+            if (tag == 'h1' and self.h1_title is None) or (tag == 'title' and self.page_title is None):
+                self._capture = tag
+                self._title_text = []
+        if tag in ('br', 'p', 'div', 'li', 'tr'):
+            self._flush_line()
+
+    def handle_endtag(self, tag):
+        if self._value_depth:
+            self._end_value_node()
+        if tag in ('script', 'style') and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == 'span' and self._value_depth:
+            self._value_depth -= 1
+            if not self._value_depth:
+                track = parse_track_value(''.join(self._value_text).strip())
+                if track:
+                    self.tracks.append(track)
+                self._value_text = []
+        elif tag == 'div' and self._tlp_depth:
+            self._tlp_depth -= 1
+        if tag == self._capture:
+            text = ''.join(self._title_text).strip()
+            if tag == 'h1':
+                self.h1_title = text
+            else:
+                self.page_title = text
+            self._capture = None
+        if tag in ('p', 'div', 'li', 'tr'):
+            self._flush_line()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._value_depth:
+            self._value_node.append(data)
+        if self._capture:
+            self._title_text.append(data)
+        # Method 3 fallback: check text lines as they complete
+        if self.tracks:
+            return
+        lines = data.split('\n')
+        self._line.append(lines[0])
+        for line in lines[1:]:
+            self._flush_line()
+            self._line.append(line)
+
+    def _flush_line(self):
+        if self._line:
+            track = None if self.tracks else parse_text_line(''.join(self._line))
+            if track:
+                self.text_tracks.append(track)
+            self._line = []
+
+    def close(self):
+        super().close()
+        self._flush_line()
+
+    @property
+    def title(self):
+        if self.h1_title:
+            return self.h1_title
+        if self.page_title:
+            return self.page_title.replace(" | 1001Tracklists", "")
+        return "Unknown Tracklist"
+
+def fetch_1001tracklists_tracks_streaming(url, headers, chunk_size=64 * 1024):
+    """
+    Streaming variant of fetch_1001tracklists_tracks: the response is read in chunks and
+    fed to TracklistStreamParser, so each chunk is released as soon as it is parsed.
+    Method 2 needs a full element tree and is not available in this mode.
+    Returns (tracks, title).
+    """
+    parser = TracklistStreamParser()
+    with requests.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.tracks or parser.text_tracks, parser.title
+
+def fetch_1001tracklists_tracks_soup(url, headers):
+    """Download the whole page and parse it with BeautifulSoup. Returns (tracks, title)."""
+    response = requests.get(url, headers=headers)
+    response.raise_for_status()
+    
+    soup = BeautifulSoup(response.content, 'html.parser')
+    tracks = []
+    
+    # Extract tracklist title
+    tracklist_title = extract_tracklist_title(soup)
+    
+    print(f"Page title: {tracklist_title}")
+    
+    # Method 1: Look for 1001tracklists track items specifically
+    # Based on actual HTML structure analysis
+    track_items = soup.find_all('div', class_='tlpItem')
+    
+    for item in track_items:
+        # Look for the track value span
+        track_value_span = item.find('span', class_='trackValue')
+        if track_value_span:
+            track = parse_track_value(track_value_span.get_text(strip=True))
+            if track:
+                tracks.append(track)
+    
+    # Method 2: Look for divs and spans with track data
+    if not tracks:
+        # Look for common track listing patterns
+        track_elements = soup.find_all(['div', 'span', 'p', 'li'])
+        
+        for elem in track_elements:
+            text = elem.get_text(strip=True)
+            # Look for "Artist - Title" pattern
+            if ' - ' in text and 5 < len(text) < 200:
+                # Skip obviously non-track content
+                if any(skip in text.lower() for skip in [
+                    'download', 'subscribe', 'comment', 'share', 'upload', 
+                    'genre:', 'bpm:', 'key:', 'time:', 'length:', 'duration:',
+                    'http', 'www', '.com', 'follow', 'like', 'playlist'
+                ]):
+                    continue
                 
-                # Parse the track text to extract artist and title
-                # Pattern: "Artist - Title" or "Artist & Artist - Title (Remix info)"
-                if ' - ' in track_text:
-                    # Remove common extra info that might interfere
-                    clean_text = re.sub(r'\(.*?\)', '', track_text)  # Remove remix info in parentheses
-                    clean_text = re.sub(r'\[.*?\]', '', clean_text)  # Remove label info in brackets
-                    clean_text = clean_text.strip()
-                    
-                    parts = clean_text.split(' - ', 1)
+                # Look for pattern that suggests it's a track
+                if re.match(r'^[^-]+ - [^-]+$', text):
+                    parts = text.split(' - ', 1)
                     if len(parts) == 2:
-                        artist = parts[0].strip()
-                        title = parts[1].strip()
+                        artist, title = parts
+                        artist = artist.strip()
+                        title = title.strip()
                         
-                        if len(artist) > 0 and len(title) > 0:
+                        # Basic validation
+                        if (len(artist) > 0 and len(title) > 0 and 
+                            len(artist) < 100 and len(title) < 100 and
+                            not artist.lower().startswith('http') and
+                            not title.lower().startswith('http')):
                             tracks.append(f'{artist} {title}')
+    
+    # Method 3: Parse all text and look for track patterns
+    if not tracks:
+        all_text = soup.get_text()
+        lines = all_text.split('\n')
         
-        # Method 2: Look for divs and spans with track data
-        if not tracks:
-            # Look for common track listing patterns
-            track_elements = soup.find_all(['div', 'span', 'p', 'li'])
-            
-            for elem in track_elements:
-                text = elem.get_text(strip=True)
-                # Look for "Artist - Title" pattern
-                if ' - ' in text and 5 < len(text) < 200:
-                    # Skip obviously non-track content
-                    if any(skip in text.lower() for skip in [
-                        'download', 'subscribe', 'comment', 'share', 'upload', 
-                        'genre:', 'bpm:', 'key:', 'time:', 'length:', 'duration:',
-                        'http', 'www', '.com', 'follow', 'like', 'playlist'
-                    ]):
-                        continue
-                    
-                    # Look for pattern that suggests it's a track
-                    if re.match(r'^[^-]+ - [^-]+$', text):
-                        parts = text.split(' - ', 1)
-                        if len(parts) == 2:
-                            artist, title = parts
-                            artist = artist.strip()
-                            title = title.strip()
-                            
-                            # Basic validation
-                            if (len(artist) > 0 and len(title) > 0 and 
-                                len(artist) < 100 and len(title) < 100 and
-                                not artist.lower().startswith('http') and
-                                not title.lower().startswith('http')):
-                                tracks.append(f'{artist} {title}')
-        
-        # Method 3: Parse all text and look for track patterns
-        if not tracks:
-            all_text = soup.get_text()
-            lines = all_text.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                # Look for lines that match track pattern
-                if ' - ' in line and 5 < len(line) < 200:
-                    # Skip non-track lines
-                    if any(skip in line.lower() for skip in [
-                        'download', 'subscribe', 'comment', 'share', 'upload',
-                        'genre:', 'bpm:', 'key:', 'tracklist', 'playlist',
-                        'http', 'www', '.com', 'follow', 'like', '1001'
-                    ]):
-                        continue
-                    
-                    # Check if it looks like a track (simple heuristic)
-                    if re.match(r'^[\w\s&.,-]+ - [\w\s&.,-]+$', line):
-                        parts = line.split(' - ', 1)
-                        if len(parts) == 2:
-                            artist, title = parts
-                            artist = artist.strip()
-                            title = title.strip()
-                            
-                            if (len(artist) > 0 and len(title) > 0 and 
-                                len(artist) < 100 and len(title) < 100):
-                                tracks.append(f'{artist} {title}')
+        for line in lines:
+            track = parse_text_line(line)
+            if track:
+                tracks.append(track)
+    
+    return tracks, tracklist_title
+
+def fetch_1001tracklists_tracks(url, stream=False):
+    """
+    Scrape tracks from a 1001tracklists URL.
+    Returns a list of "Artist Track" strings.
+    With stream=True the page is parsed incrementally (see fetch_1001tracklists_tracks_streaming).
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    
+    try:
+        if stream:
+            tracks, tracklist_title = fetch_1001tracklists_tracks_streaming(url, headers)
+            print(f"Page title: {tracklist_title}")
+        else:
+            tracks, tracklist_title = fetch_1001tracklists_tracks_soup(url, headers)
         
         # Remove duplicates while preserving order
         seen = set()
@@ -173,27 +323,6 @@ def read_soulseek_credentials(path='soulseek_credentials.txt'):
                 creds[k.strip()] = v.strip()
     return creds.get('SOULSEEK_USER'), creds.get('SOULSEEK_PASS')
 
-def flatten_directory(root_dir):
-    """Move all music files from subfolders up to root_dir and remove empty subfolders."""
-    music_exts = {'.mp3', '.flac', '.wav', '.aac', '.ogg', '.m4a', '.wma', '.alac', '.aiff', '.ape', '.opus', '.wv', '.tta', '.ac3', '.dts', '.amr', '.3gp', '.mid', '.midi', '.mod', '.xm', '.it', '.s3m', '.mp2', '.mp1', '.au', '.ra', '.ram', '.m4b', '.m4p', '.mpga', '.spx', '.oga', '.caf', '.dsf', '.dff', '.tak', '.shn', '.aif', '.aifc', '.snd', '.kar'}
-    for dirpath, dirnames, filenames in os.walk(root_dir, topdown=False):
-        for filename in filenames:
-            ext = os.path.splitext(filename)[1].lower()
-            if ext in music_exts:
-                src = os.path.join(dirpath, filename)
-                dst = os.path.join(root_dir, filename)
-                if src != dst:
-                    # Avoid overwriting files with the same name
-                    base, ext = os.path.splitext(filename)
-                    counter = 1
-                    while os.path.exists(dst):
-                        dst = os.path.join(root_dir, f"{base}_{counter}{ext}")
-                        counter += 1
-                    shutil.move(src, dst)
-        # Remove empty subfolders
-        if dirpath != root_dir and not os.listdir(dirpath):
-            os.rmdir(dirpath)
-
 def main():
     parser = argparse.ArgumentParser(description="Download tracks from a 1001tracklists URL using Soulseek via sldl.exe.")
     parser.add_argument('tracklist_url', help="1001tracklists URL")
@@ -202,7 +331,27 @@ def main():
     parser.add_argument('--min-bitrate', type=int, default=256, help='Minimum bitrate (default: 256)')
     parser.add_argument('--min-size', type=str, default='500K', help='Minimum file size (default: 500K)')
     parser.add_argument('--max-size', type=str, default='100M', help='Maximum file size (default: 100M)')
+    parser.add_argument('--max-variants', type=int, default=4, help='Maximum query variants tried per track (default: 4)')
+    parser.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    parser.add_argument('--backend', choices=('sldl', 'native'), default='sldl', help='Soulseek backend: sldl.exe, or the built-in client (default: sldl)')
+    parser.add_argument('--slsk-server', type=str, default='server.slsknet.org:2242', help='Soulseek server for the native backend (default: server.slsknet.org:2242)')
+    parser.add_argument('--listen-port', type=int, default=2234, help='Peer listen port for the native backend (default: 2234)')
+    parser.add_argument('--slsk-concurrency', type=int, default=4, help='Parallel searches/transfers for the native backend (default: 4)')
+    parser.add_argument('--search-timeout', type=int, default=8, help='Seconds to collect search results for the native backend (default: 8)')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often the tracks of a stalled sldl run are retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Stop starting new searches after this many minutes, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--stream-parse', action='store_true', help='Parse the page incrementally to keep memory low on huge pages')
+    parser.add_argument('--analyze', action='store_true', help='Compute loudness/ReplayGain, BPM and key of the downloads and tag them (needs numpy)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
     args = parser.parse_args()
+    io_scheduler.configure(args)
+    if args.plan:
+        plan_cached_source(args.directory, args.tracklist_url, args)
+        return
 
     # Read Soulseek credentials
     soulseek_user, soulseek_pass = read_soulseek_credentials()
@@ -211,7 +360,7 @@ def main():
 
     # Fetch tracklist
     print(f"Fetching tracks from 1001tracklists URL: {args.tracklist_url}")
-    tracks, tracklist_title = fetch_1001tracklists_tracks(args.tracklist_url)
+    tracks, tracklist_title = fetch_1001tracklists_tracks(args.tracklist_url, stream=args.stream_parse)
     
     if not tracks:
         sys.exit("No tracks found in tracklist. Please check the URL or try a different tracklist.")
@@ -234,52 +383,24 @@ def main():
             f.write(f'"{track}"\n')
     print(f"Tracklist written to {tracklist_path}")
 
-    # Build sldl.exe command
-    sldl_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sldl.exe')
-    cmd = [
-        sldl_path, tracklist_path,
-        '--user', soulseek_user,
-        '--pass', soulseek_pass,
-        '--pref-format', args.pref_format,
-        '--min-bitrate', str(args.min_bitrate),
-        '--input-type', 'list',
-        '-p', tracklist_root
-    ]
-    print(f"Running: {' '.join(cmd)}")
-
-    # Run sldl.exe and report progress
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    print("\n--- slsk-batchdl output ---")
-    for line in proc.stdout:
-        print(line, end="")
-    proc.wait()
-    print("--- slsk-batchdl finished ---\n")
+    # Search Soulseek with ranked query variants per track
+    watchdog = TransferWatchdog.from_args(args)
+    report = RunReport(tracklist_root, args.tracklist_url, args)
+    not_found, searches = download_with_query_plan(tracks, tracklist_root, args, soulseek_user, soulseek_pass,
+                                                   watchdog=watchdog, report=report)
+    report.close(searches=searches, watchdog=watchdog.stats)
+    print(f"Issued {searches} searches for {len(tracks)} tracks.")
+    print(f"Watchdog: {watchdog.summary()}")
 
-    # Post-process: flatten directory
-    flatten_directory(tracklist_root)
-    print(f"Flattened directory: {tracklist_root}")
-
-    # Check for not found tracks and write to not_found.txt
-    downloaded_files = [f for f in os.listdir(tracklist_root) if os.path.isfile(os.path.join(tracklist_root, f))]
-    downloaded_basenames = set(os.path.splitext(f)[0].lower() for f in downloaded_files)
-    not_found = []
-    for track in tracks:
-        # Remove quotes and sanitize to match file naming
-        base = sanitize_filename(track).lower()
-        if base not in downloaded_basenames:
-            not_found.append(track)
-    
-    not_found_path = os.path.join(tracklist_root, 'not_found.txt')
-    with open(not_found_path, 'w', encoding='utf-8') as nf:
-        for track in not_found:
-            nf.write(track + '\n')
-    
     if not_found:
-        print(f"\nTracks not found (also written to {not_found_path}):")
+        print(f"\nTracks not found (details in {report.path}):")
         for track in not_found:
             print(f"  - {track}")
     else:
         print("\nAll tracks were found and downloaded.")
 
+    if args.analyze:
+        analyze_directory(tracklist_root, analysis_cache_path(args.directory, args.store), tag=True)
+
 if __name__ == '__main__':
     main() 
\ No newline at end of file
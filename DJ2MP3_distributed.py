@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+from itertools import groupby
+
+from DJ2MP3_tracklist_via_soulseek import sanitize_filename, iter_tracklist_file, iter_batches, read_soulseek_credentials
+from job_queue import JobQueue, CoordinatorClient, serve
+from query_planner import download_with_query_plan
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+from candidate_rules import get_rules
+from job_plan import plan_mix, print_plan, load_history
+import io_scheduler
+
+SOURCES = ('soulseek', 'youtube', 'auto')
+TOKEN_ENV = 'DJ2MP3_COORDINATOR_TOKEN'
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+def make_client(args):
+    return CoordinatorClient(args.coordinator, token=args.token)
+
+
+def run_coordinator(args):
+    if args.host not in LOOPBACK_HOSTS and not args.token:
+        sys.exit(f"Refusing to listen on {args.host} without a shared token; pass --token or set {TOKEN_ENV}")
+    serve(JobQueue(args.db, args.lease, args.max_attempts), args.host, args.port, args.token)
+
+
+def run_enqueue(args):
+    client = make_client(args)
+    if args.name:
+        mix = args.name
+    elif args.tracklist_file == '-':
+        mix = 'stdin'
+    else:
+        mix = os.path.splitext(os.path.basename(args.tracklist_file))[0]
+    if args.plan:
+        tracks = list(iter_tracklist_file(args.tracklist_file))
+        counts = client.status()['mixes'].get(mix, {})
+        print(f"Coordinator has {sum(counts.values())} tracks for '{mix}'"
+              + (': ' + ', '.join(f"{count} {state}" for state, count in sorted(counts.items())) if counts else ''))
+        mix_root = os.path.join(args.directory, sanitize_filename(mix)) if args.directory else mix
+        sources = {'soulseek': ('soulseek',), 'youtube': ('youtube',), 'auto': ('soulseek', 'youtube')}[args.source]
+        print_plan(mix, plan_mix(tracks, mix_root, args, variants=args.source != 'youtube'),
+                   load_history([args.directory] if args.directory else []), sources)
+        return
+    total = added = 0
+    for batch in iter_batches(iter_tracklist_file(args.tracklist_file), 500):
+        added += client.enqueue(mix, batch, args.source, start=total + 1)
+        total += len(batch)
+    print(f"Queued {added} of {total} tracks for '{mix}' ({total - added} already queued).")
+
+
+def run_status(args):
+    status = make_client(args).status()
+    for mix, counts in status['mixes'].items():
+        print(f"{mix}: " + ', '.join(f"{count} {state}" for state, count in sorted(counts.items())))
+    for worker, count in status['workers'].items():
+        print(f"  worker {worker}: {count} leased")
+
+
+class Heartbeat(threading.Thread):
+    """Keeps the leases of the jobs a worker is holding alive."""
+
+    def __init__(self, client, worker_id, interval):
+        super().__init__(daemon=True)
+        self.client = client
+        self.worker_id = worker_id
+        self.interval = interval
+        self.held = set()
+        self.lock = threading.Lock()
+
+    def hold(self, ids):
+        with self.lock:
+            self.held.update(ids)
+
+    def release(self, job_id):
+        with self.lock:
+            self.held.discard(job_id)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                ids = sorted(self.held)
+            if not ids:
+                continue
+            try:
+                lost = self.client.heartbeat(self.worker_id, ids)
+            except RuntimeError as e:
+                print(f"[HEARTBEAT] {e}")
+                continue
+            if lost:
+                print(f"[HEARTBEAT] Lost the lease on {len(lost)} jobs; they may be downloaded twice")
+
+
+def process_mix(mix, jobs, args, credentials, watchdog):
+    """Download the leased jobs of one mix. Returns {track: report record}."""
+    mix_root = os.path.join(args.directory, sanitize_filename(mix))
+    os.makedirs(mix_root, exist_ok=True)
+    results = {}
+    report = RunReport(mix_root, f"{args.coordinator} {mix}", args,
+                       listener=lambda record: results.__setitem__(record['track'], record))
+
+    slsk_tracks = [j['track'] for j in jobs if j['source'] in ('soulseek', 'auto')]
+    if slsk_tracks:
+        # Each worker gets its own list (and sldl index folder) inside the shared mix folder
+        download_with_query_plan(slsk_tracks, mix_root, args, *credentials,
+                                 list_name=f"{args.worker_id}.txt", watchdog=watchdog, report=report)
+
+    yt_jobs = [j for j in jobs if j['source'] == 'youtube'
+               or (j['source'] == 'auto' and 'youtube' in args.sources and results.get(j['track'], {}).get('status') != 'downloaded')]
+    if yt_jobs:
+        import DJ2MP3_youtube as youtube
+        # The YouTube summary drives mix_priority; count only this mix's tracks
+        with youtube.log_lock:
+            for outcomes in youtube.summary.values():
+                outcomes.clear()
+        yt_args = argparse.Namespace(min_duration=args.yt_min_duration, max_duration=args.yt_max_duration,
+                                     max_requeues=args.max_requeues, rules=args.rules)
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'noplaylist': True,
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '0'}],
+        }
+        if args.stall_timeout:
+            ydl_opts['socket_timeout'] = args.stall_timeout
+        for job in yt_jobs:
+            youtube.process_track(job['position'], job['track'], yt_args, ydl_opts, mix_root, report, len(yt_jobs), watchdog)
+    report.close(watchdog=watchdog.stats)
+    return results
+
+
+def run_worker(args):
+    args.worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    args.directory = os.path.abspath(args.directory)
+    args.sources = [s.strip() for s in args.sources.split(',') if s.strip()]
+    if 'soulseek' in args.sources:
+        credentials = read_soulseek_credentials()
+        if not all(credentials):
+            sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
+    else:
+        credentials = (None, None)
+    lease_sources = [s for s in SOURCES if s in args.sources or (s == 'auto' and 'soulseek' in args.sources)]
+
+    io_scheduler.configure(args)
+    try:
+        get_rules('candidates', args.rules)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Could not load rules: {e}")
+    client = make_client(args)
+    heartbeat = Heartbeat(client, args.worker_id, args.heartbeat)
+    heartbeat.start()
+    watchdog = TransferWatchdog.from_args(args)
+    done = 0
+    print(f"Worker {args.worker_id} pulling {', '.join(lease_sources)} jobs from {args.coordinator}")
+    while not watchdog.expired():
+        jobs = client.lease(args.worker_id, args.batch_size, lease_sources)
+        if not jobs:
+            if args.exit_when_empty:
+                break
+            time.sleep(args.poll)
+            continue
+        heartbeat.hold(j['id'] for j in jobs)
+        print(f"\nLeased {len(jobs)} jobs")
+        for mix, mix_jobs in groupby(sorted(jobs, key=lambda j: (j['mix'], j['id'])), key=lambda j: j['mix']):
+            mix_jobs = list(mix_jobs)
+            results = process_mix(mix, mix_jobs, args, credentials, watchdog)
+            for job in mix_jobs:
+                record = results.get(job['track']) or {'status': 'failed', 'reason': 'no result recorded'}
+                record = {**record, 'worker': args.worker_id, 'attempt': job['attempt']}
+                if job['source'] == 'auto' and record['status'] != 'downloaded' and 'youtube' not in args.sources:
+                    # Leave the YouTube fallback to a worker that has it
+                    if client.handoff(args.worker_id, job['id'], 'youtube', record):
+                        print(f"[HANDOFF] {job['track']}: not on Soulseek, queued for YouTube")
+                    else:
+                        print(f"[HANDOFF] {job['track']}: lease lost, not queued for YouTube")
+                elif not client.complete(args.worker_id, job['id'], record['status'], record):
+                    print(f"[COMPLETE] {job['track']}: already finished by another worker")
+                heartbeat.release(job['id'])
+                done += 1
+    print(f"\nWorker {args.worker_id} finished {done} jobs. Watchdog: {watchdog.summary()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread downloads over several hosts: one coordinator holds the job queue, workers lease and download tracks.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('coordinator', help='Run the job queue HTTP coordinator')
+    p.add_argument('--db', type=str, default='jobs.sqlite', help='SQLite job database (default: jobs.sqlite)')
+    p.add_argument('--host', type=str, default='127.0.0.1', help='Listen address; other hosts than this one need --token (default: 127.0.0.1)')
+    p.add_argument('--port', type=int, default=8765, help='Listen port (default: 8765)')
+    p.add_argument('--lease', type=int, default=300, help='Seconds a leased job stays with a worker without a heartbeat (default: 300)')
+    p.add_argument('--max-attempts', type=int, default=3, help='Leases per job before it is marked failed (default: 3)')
+    p.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV), help='Shared token clients must send (default: $DJ2MP3_COORDINATOR_TOKEN)')
+    p.set_defaults(func=run_coordinator)
+
+    p = sub.add_parser('enqueue', help='Queue the tracks of a text file tracklist')
+    p.add_argument('tracklist_file', help="Path to text file containing tracks (format: Artist Trackname), or '-' for stdin")
+    p.add_argument('--coordinator', type=str, default='http://127.0.0.1:8765', help='Coordinator URL (default: http://127.0.0.1:8765)')
+    p.add_argument('--name', type=str, default=None, help='Mix (output folder) name (default: tracklist filename, or "stdin")')
+    p.add_argument('--source', choices=SOURCES, default='auto', help='soulseek, youtube, or auto = Soulseek with YouTube fallback (default: auto)')
+    p.add_argument('--plan', action='store_true', help='Only print the projected work of the tracklist and exit; nothing is queued')
+    p.add_argument('-d', '--directory', type=str, default=None, help="The workers' output directory, if reachable from here; --plan checks it for downloaded tracks and run reports")
+    p.add_argument('--max-variants', type=int, default=4, help='Query variants per track the workers try, for --plan (default: 4)')
+    p.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV), help='Coordinator token (default: $DJ2MP3_COORDINATOR_TOKEN)')
+    p.set_defaults(func=run_enqueue)
+
+    p = sub.add_parser('status', help='Show queue progress per mix and worker')
+    p.add_argument('--coordinator', type=str, default='http://127.0.0.1:8765', help='Coordinator URL (default: http://127.0.0.1:8765)')
+    p.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV), help='Coordinator token (default: $DJ2MP3_COORDINATOR_TOKEN)')
+    p.set_defaults(func=run_status)
+
+    p = sub.add_parser('worker', help='Lease jobs from the coordinator and download them')
+    p.add_argument('-d', '--directory', required=True, help='Output directory for downloads')
+    p.add_argument('--coordinator', type=str, default='http://127.0.0.1:8765', help='Coordinator URL (default: http://127.0.0.1:8765)')
+    p.add_argument('--worker-id', type=str, default=None, help='Worker name (default: <hostname>-<pid>)')
+    p.add_argument('--sources', type=str, default='soulseek,youtube', help='Job sources this worker handles (default: soulseek,youtube)')
+    p.add_argument('--batch-size', type=int, default=20, help='Jobs leased at a time (default: 20)')
+    p.add_argument('--heartbeat', type=int, default=30, help='Seconds between lease heartbeats (default: 30)')
+    p.add_argument('--poll', type=int, default=10, help='Seconds to wait when the queue is empty (default: 10)')
+    p.add_argument('--exit-when-empty', action='store_true', help='Stop when there are no queued jobs instead of polling')
+    p.add_argument('--pref-format', type=str, default='mp3,flac,wav', help='Preferred formats, comma-separated (default: mp3,flac,wav)')
+    p.add_argument('--min-bitrate', type=int, default=256, help='Minimum bitrate (default: 256)')
+    p.add_argument('--min-size', type=str, default='500K', help='Minimum file size (default: 500K)')
+    p.add_argument('--max-size', type=str, default='100M', help='Maximum file size (default: 100M)')
+    p.add_argument('--max-variants', type=int, default=4, help='Maximum query variants tried per track (default: 4)')
+    p.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    p.add_argument('--backend', choices=('sldl', 'native'), default='sldl', help='Soulseek backend: sldl.exe, or the built-in client (default: sldl)')
+    p.add_argument('--slsk-server', type=str, default='server.slsknet.org:2242', help='Soulseek server for the native backend (default: server.slsknet.org:2242)')
+    p.add_argument('--listen-port', type=int, default=2234, help='Peer listen port for the native backend (default: 2234)')
+    p.add_argument('--slsk-concurrency', type=int, default=4, help='Parallel searches/transfers for the native backend (default: 4)')
+    p.add_argument('--search-timeout', type=int, default=8, help='Seconds to collect search results for the native backend (default: 8)')
+    p.add_argument('--yt-min-duration', type=int, default=150, help='YouTube minimum duration (s)')
+    p.add_argument('--yt-max-duration', type=int, default=630, help='YouTube maximum duration (s)')
+    p.add_argument('--rules', type=str, default=None, help='Reject rules file for YouTube video titles (default: candidate_rules.txt)')
+    p.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    p.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    p.add_argument('--max-requeues', type=int, default=1, help='How often a stalled track is retried (default: 1)')
+    p.add_argument('--deadline', type=float, default=0, help='Stop leasing new jobs after this many minutes, 0 for no limit (default: 0)')
+    p.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    p.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    p.add_argument('--token', type=str, default=os.environ.get(TOKEN_ENV), help='Coordinator token (default: $DJ2MP3_COORDINATOR_TOKEN)')
+    p.set_defaults(func=run_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
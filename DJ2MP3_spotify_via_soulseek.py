@@ -1,11 +1,15 @@
 import os
 import sys
 import argparse
-import subprocess
 import re
-from spotipy.oauth2 import SpotifyClientCredentials
-import spotipy
-import shutil
+
+from audio_analysis import analyze_directory, analysis_cache_path
+from query_planner import download_with_query_plan
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+import io_scheduler
+from job_plan import plan_cached_source
+from spotify_session import get_spotify
 
 def sanitize_filename(name):
     # Replace all problematic characters (including slashes, backslashes, and whitespace at ends) with underscores
@@ -66,27 +70,6 @@ def write_tracklist_with_dash_fallback(tracks, path):
                     f.write(f'"{fallback}"\n')
                     written.add(fallback)
 
-def flatten_directory(root_dir):
-    """Move all music files from subfolders up to root_dir and remove empty subfolders."""
-    music_exts = {'.mp3', '.flac', '.wav', '.aac', '.ogg', '.m4a', '.wma', '.alac', '.aiff', '.ape', '.opus', '.wv', '.tta', '.ac3', '.dts', '.amr', '.3gp', '.mid', '.midi', '.mod', '.xm', '.it', '.s3m', '.mp2', '.mp1', '.au', '.ra', '.ram', '.m4b', '.m4p', '.mpga', '.spx', '.oga', '.caf', '.dsf', '.dff', '.tak', '.shn', '.aif', '.aifc', '.snd', '.kar'}
-    for dirpath, dirnames, filenames in os.walk(root_dir, topdown=False):
-        for filename in filenames:
-            ext = os.path.splitext(filename)[1].lower()
-            if ext in music_exts:
-                src = os.path.join(dirpath, filename)
-                dst = os.path.join(root_dir, filename)
-                if src != dst:
-                    # Avoid overwriting files with the same name
-                    base, ext = os.path.splitext(filename)
-                    counter = 1
-                    while os.path.exists(dst):
-                        dst = os.path.join(root_dir, f"{base}_{counter}{ext}")
-                        counter += 1
-                    shutil.move(src, dst)
-        # Remove empty subfolders
-        if dirpath != root_dir and not os.listdir(dirpath):
-            os.rmdir(dirpath)
-
 def main():
     parser = argparse.ArgumentParser(description="Download tracks from a Spotify playlist using Soulseek via sldl.exe.")
     parser.add_argument('playlist_url', help="Spotify playlist URL")
@@ -95,7 +78,26 @@ def main():
     parser.add_argument('--min-bitrate', type=int, default=256, help='Minimum bitrate (default: 256)')
     parser.add_argument('--min-size', type=str, default='500K', help='Minimum file size (default: 500K)')
     parser.add_argument('--max-size', type=str, default='100M', help='Maximum file size (default: 100M)')
+    parser.add_argument('--max-variants', type=int, default=4, help='Maximum query variants tried per track (default: 4)')
+    parser.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    parser.add_argument('--backend', choices=('sldl', 'native'), default='sldl', help='Soulseek backend: sldl.exe, or the built-in client (default: sldl)')
+    parser.add_argument('--slsk-server', type=str, default='server.slsknet.org:2242', help='Soulseek server for the native backend (default: server.slsknet.org:2242)')
+    parser.add_argument('--listen-port', type=int, default=2234, help='Peer listen port for the native backend (default: 2234)')
+    parser.add_argument('--slsk-concurrency', type=int, default=4, help='Parallel searches/transfers for the native backend (default: 4)')
+    parser.add_argument('--search-timeout', type=int, default=8, help='Seconds to collect search results for the native backend (default: 8)')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often the tracks of a stalled sldl run are retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Stop starting new searches after this many minutes, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--analyze', action='store_true', help='Compute loudness/ReplayGain, BPM and key of the downloads and tag them (needs numpy)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
     args = parser.parse_args()
+    io_scheduler.configure(args)
+    if args.plan:
+        plan_cached_source(args.directory, args.playlist_url, args)
+        return
 
     # Read Spotify credentials
     client_id, client_secret = read_spotify_credentials()
@@ -107,8 +109,8 @@ def main():
     if not soulseek_user or not soulseek_pass:
         sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
 
-    # Spotify API setup
-    sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=client_id, client_secret=client_secret))
+    # Spotify API setup (token shared with concurrent runs through .cache-<client id hash>)
+    sp = get_spotify(client_id, client_secret)
 
     # Fetch playlist tracks
     print(f"Fetching tracks from Spotify playlist: {args.playlist_url}")
@@ -128,50 +130,24 @@ def main():
             f.write(f'"{track}"\n')
     print(f"Tracklist written to {tracklist_path}")
 
-    # Build sldl.exe command
-    sldl_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sldl.exe')
-    cmd = [
-        sldl_path, tracklist_path,
-        '--user', soulseek_user,
-        '--pass', soulseek_pass,
-        '--pref-format', args.pref_format,
-        '--min-bitrate', str(args.min_bitrate),
-        '--input-type', 'list',
-        '-p', playlist_root
-    ]
-    print(f"Running: {' '.join(cmd)}")
-
-    # Run sldl.exe and report progress
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    print("\n--- slsk-batchdl output ---")
-    for line in proc.stdout:
-        print(line, end="")
-    proc.wait()
-    print("--- slsk-batchdl finished ---\n")
-
-    # Post-process: flatten directory
-    flatten_directory(playlist_root)
-    print(f"Flattened directory: {playlist_root}")
-
-    # Check for not found tracks and write to not_found.txt
-    downloaded_files = [f for f in os.listdir(playlist_root) if os.path.isfile(os.path.join(playlist_root, f))]
-    downloaded_basenames = set(os.path.splitext(f)[0].lower() for f in downloaded_files)
-    not_found = []
-    for track in tracks:
-        # Remove quotes and sanitize to match file naming
-        base = sanitize_filename(track).lower()
-        if base not in downloaded_basenames:
-            not_found.append(track)
-    not_found_path = os.path.join(playlist_root, 'not_found.txt')
-    with open(not_found_path, 'w', encoding='utf-8') as nf:
-        for track in not_found:
-            nf.write(track + '\n')
+    # Search Soulseek with ranked query variants per track
+    watchdog = TransferWatchdog.from_args(args)
+    report = RunReport(playlist_root, args.playlist_url, args)
+    not_found, searches = download_with_query_plan(tracks, playlist_root, args, soulseek_user, soulseek_pass,
+                                                   watchdog=watchdog, report=report)
+    report.close(searches=searches, watchdog=watchdog.stats)
+    print(f"Issued {searches} searches for {len(tracks)} tracks.")
+    print(f"Watchdog: {watchdog.summary()}")
+
     if not_found:
-        print(f"\nTracks not found (also written to {not_found_path}):")
+        print(f"\nTracks not found (details in {report.path}):")
         for track in not_found:
             print(f"  - {track}")
     else:
         print("\nAll tracks were found and downloaded.")
 
+    if args.analyze:
+        analyze_directory(playlist_root, analysis_cache_path(args.directory, args.store), tag=True)
+
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -1,28 +1,61 @@
 import os
 import sys
 import argparse
-import subprocess
 import re
-import shutil
+import hashlib
+import itertools
+
+from audio_analysis import analyze_directory, analysis_cache_path
+from query_planner import download_with_query_plan, MixFolder
+from library_store import LibraryStore
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+import io_scheduler
+from job_plan import plan_mix, print_plan, load_history
 
 def sanitize_filename(name):
     # Replace all problematic characters (including slashes, backslashes, and whitespace at ends) with underscores
     return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_')
 
-def read_tracklist_file(file_path):
-    """Read tracks from a text file with format: Artist Trackname"""
-    tracks = []
+def normalize_track_line(line):
+    """Strip surrounding whitespace/quotes and collapse inner whitespace."""
+    line = line.strip().strip('"').strip()
+    return re.sub(r'\s+', ' ', line)
+
+def track_digest(track):
+    """64-bit digest of a normalized track, used as the dedup key."""
+    return int.from_bytes(hashlib.blake2b(track.casefold().encode('utf-8'), digest_size=8).digest(), 'little')
+
+def iter_tracklist_file(file_path):
+    """
+    Stream tracks from a text file (or stdin when file_path is '-') with format: Artist Trackname.
+    Lines are normalized and de-duplicated on the fly; only a 64-bit digest per unique
+    track is kept, so memory does not depend on line length or on the number of duplicates.
+    """
+    seen = set()
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if line:  # Skip empty lines
-                    tracks.append(line)
-        return tracks
+        f = sys.stdin if file_path == '-' else open(file_path, 'r', encoding='utf-8')
     except FileNotFoundError:
         sys.exit(f"Error: Tracklist file '{file_path}' not found.")
     except Exception as e:
         sys.exit(f"Error reading tracklist file: {e}")
+    try:
+        for line in f:
+            track = normalize_track_line(line)
+            if not track:  # Skip empty lines
+                continue
+            digest = track_digest(track)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            yield track
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def iter_batches(tracks, batch_size):
+    """Group an iterable of tracks into lists of at most batch_size items."""
+    return iter(lambda: list(itertools.islice(tracks, batch_size)), [])
 
 def read_soulseek_credentials(path='soulseek_credentials.txt'):
     creds = {}
@@ -36,127 +69,106 @@ def read_soulseek_credentials(path='soulseek_credentials.txt'):
         sys.exit(f"Error: Soulseek credentials file '{path}' not found.")
     return creds.get('SOULSEEK_USER'), creds.get('SOULSEEK_PASS')
 
-def write_tracklist_with_dash_fallback(tracks, path):
-    """
-    Write tracklist to file. If a track contains '-' and is not found, also try without the dash.
-    """
-    written = set()
-    with open(path, 'w', encoding='utf-8') as f:
-        for track in tracks:
-            f.write(f'"{track}"\n')
-            written.add(track)
-            # If the track contains a dash, add a fallback without the dash (if not already present)
-            if '-' in track:
-                fallback = track.replace('-', '').replace('  ', ' ').strip()
-                if fallback and fallback not in written:
-                    f.write(f'"{fallback}"\n')
-                    written.add(fallback)
-
-def flatten_directory(root_dir):
-    """Move all music files from subfolders up to root_dir and remove empty subfolders."""
-    music_exts = {'.mp3', '.flac', '.wav', '.aac', '.ogg', '.m4a', '.wma', '.alac', '.aiff', '.ape', '.opus', '.wv', '.tta', '.ac3', '.dts', '.amr', '.3gp', '.mid', '.midi', '.mod', '.xm', '.it', '.s3m', '.mp2', '.mp1', '.au', '.ra', '.ram', '.m4b', '.m4p', '.mpga', '.spx', '.oga', '.caf', '.dsf', '.dff', '.tak', '.shn', '.aif', '.aifc', '.snd', '.kar'}
-    for dirpath, dirnames, filenames in os.walk(root_dir, topdown=False):
-        for filename in filenames:
-            ext = os.path.splitext(filename)[1].lower()
-            if ext in music_exts:
-                src = os.path.join(dirpath, filename)
-                dst = os.path.join(root_dir, filename)
-                if src != dst:
-                    # Avoid overwriting files with the same name
-                    base, ext = os.path.splitext(filename)
-                    counter = 1
-                    while os.path.exists(dst):
-                        dst = os.path.join(root_dir, f"{base}_{counter}{ext}")
-                        counter += 1
-                    shutil.move(src, dst)
-        # Remove empty subfolders
-        if dirpath != root_dir and not os.listdir(dirpath):
-            os.rmdir(dirpath)
-
 def main():
     parser = argparse.ArgumentParser(description="Download tracks from a text file using Soulseek via sldl.exe.")
-    parser.add_argument('tracklist_file', help="Path to text file containing tracks (format: Artist Trackname)")
+    parser.add_argument('tracklist_file', help="Path to text file containing tracks (format: Artist Trackname), or '-' for stdin")
     parser.add_argument('-d', '--directory', required=True, help='Output directory for downloads')
     parser.add_argument('--pref-format', type=str, default='mp3,flac,wav', help='Preferred formats, comma-separated (default: mp3,flac,wav)')
     parser.add_argument('--min-bitrate', type=int, default=256, help='Minimum bitrate (default: 256)')
     parser.add_argument('--min-size', type=str, default='500K', help='Minimum file size (default: 500K)')
     parser.add_argument('--max-size', type=str, default='100M', help='Maximum file size (default: 100M)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Tracks submitted to sldl per batch (default: 100)')
+    parser.add_argument('--max-variants', type=int, default=4, help='Maximum query variants tried per track (default: 4)')
+    parser.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    parser.add_argument('--backend', choices=('sldl', 'native'), default='sldl', help='Soulseek backend: sldl.exe, or the built-in client (default: sldl)')
+    parser.add_argument('--slsk-server', type=str, default='server.slsknet.org:2242', help='Soulseek server for the native backend (default: server.slsknet.org:2242)')
+    parser.add_argument('--listen-port', type=int, default=2234, help='Peer listen port for the native backend (default: 2234)')
+    parser.add_argument('--slsk-concurrency', type=int, default=4, help='Parallel searches/transfers for the native backend (default: 4)')
+    parser.add_argument('--search-timeout', type=int, default=8, help='Seconds to collect search results for the native backend (default: 8)')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often the tracks of a stalled sldl run are retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Stop starting new searches after this many minutes, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--name', type=str, default=None, help='Output folder name (default: tracklist filename, or "stdin")')
+    parser.add_argument('--analyze', action='store_true', help='Compute loudness/ReplayGain, BPM and key of the downloads and tag them (needs numpy)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
     args = parser.parse_args()
+    io_scheduler.configure(args)
+    if args.batch_size < 1:
+        sys.exit("--batch-size must be at least 1")
 
-    # Read Soulseek credentials
-    soulseek_user, soulseek_pass = read_soulseek_credentials()
-    if not soulseek_user or not soulseek_pass:
-        sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
-
-    # Read tracklist from file
-    print(f"Reading tracks from: {args.tracklist_file}")
-    tracks = read_tracklist_file(args.tracklist_file)
-    print(f"Loaded {len(tracks)} tracks from file.")
-    if not tracks:
-        sys.exit("No tracks found in file.")
+    if args.tracklist_file != '-' and not os.path.isfile(args.tracklist_file):
+        sys.exit(f"Error: Tracklist file '{args.tracklist_file}' not found.")
 
     # Use tracklist filename (without extension) for folder
-    tracklist_basename = os.path.splitext(os.path.basename(args.tracklist_file))[0]
+    if args.name:
+        tracklist_basename = args.name
+    elif args.tracklist_file == '-':
+        tracklist_basename = 'stdin'
+    else:
+        tracklist_basename = os.path.splitext(os.path.basename(args.tracklist_file))[0]
     folder_name = sanitize_filename(tracklist_basename)
     playlist_root = os.path.join(args.directory, folder_name)
+
+    if args.plan:
+        plan = plan_mix(list(iter_tracklist_file(args.tracklist_file)), playlist_root, args)
+        print_plan(tracklist_basename, plan, load_history([args.directory]))
+        return
+
+    # Read Soulseek credentials
+    soulseek_user, soulseek_pass = read_soulseek_credentials()
+    if not soulseek_user or not soulseek_pass:
+        sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
     os.makedirs(playlist_root, exist_ok=True)
-    
-    # Write tracklist with dash fallbacks
+
     tracklist_path = os.path.join(playlist_root, 'tracklist.txt')
-    write_tracklist_with_dash_fallback(tracks, tracklist_path)
-    print(f"Tracklist written to {tracklist_path}")
+    open(tracklist_path, 'w', encoding='utf-8').close()
+
+    # Stream tracks and submit them to sldl in fixed-size batches
+    print(f"Reading tracks from: {'stdin' if args.tracklist_file == '-' else args.tracklist_file}")
+    watchdog = TransferWatchdog.from_args(args)
+    report = RunReport(playlist_root, args.tracklist_file, args)
+    # Listed once; each batch only adds its own downloads
+    folder = MixFolder(playlist_root, LibraryStore(args.store) if args.store else None)
+    total_tracks = 0
+    total_searches = 0
+    not_found_count = 0
+    for batch_num, batch in enumerate(iter_batches(iter_tracklist_file(args.tracklist_file), args.batch_size), 1):
+        total_tracks += len(batch)
+        print(f"\nBatch {batch_num}: {len(batch)} tracks ({total_tracks} so far)")
+
+        # Append batch to the full tracklist, then search it with ranked query variants
+        with open(tracklist_path, 'a', encoding='utf-8') as f:
+            for track in batch:
+                f.write(f'"{track}"\n')
+        not_found, searches = download_with_query_plan(batch, playlist_root, args, soulseek_user, soulseek_pass,
+                                                       watchdog=watchdog, report=report, folder=folder)
+        total_searches += searches
 
-    # Build sldl.exe command
-    sldl_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sldl.exe')
-    cmd = [
-        sldl_path, tracklist_path,
-        '--user', soulseek_user,
-        '--pass', soulseek_pass,
-        '--pref-format', args.pref_format,
-        '--min-bitrate', str(args.min_bitrate),
-        '--input-type', 'list',
-        '-p', playlist_root
-    ]
-    print(f"Running: {' '.join(cmd)}")
-
-    # Run sldl.exe and report progress
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    print("\n--- slsk-batchdl output ---")
-    for line in proc.stdout:
-        print(line, end="")
-    proc.wait()
-    print("--- slsk-batchdl finished ---\n")
-
-    # Post-process: flatten directory
-    flatten_directory(playlist_root)
-    print(f"Flattened directory: {playlist_root}")
-
-    # Check for not found tracks and write to not_found.txt
-    downloaded_files = [f for f in os.listdir(playlist_root) if os.path.isfile(os.path.join(playlist_root, f))]
-    downloaded_basenames = set(os.path.splitext(f)[0].lower() for f in downloaded_files)
-    not_found = []
-    for track in tracks:
-        # Remove quotes and sanitize to match file naming
-        base = sanitize_filename(track).lower()
-        if base not in downloaded_basenames:
-            not_found.append(track)
-    
-    not_found_path = os.path.join(playlist_root, 'not_found.txt')
-    with open(not_found_path, 'w', encoding='utf-8') as nf:
-        for track in not_found:
-            nf.write(track + '\n')
-    
-    if not_found:
-        print(f"\nTracks not found (also written to {not_found_path}):")
         for track in not_found:
-            print(f"  - {track}")
+            print(f"  - not found: {track}")
+        not_found_count += len(not_found)
+
+    folder.save()
+    report.close(searches=total_searches, watchdog=watchdog.stats)
+    if not total_tracks:
+        sys.exit("No tracks found in file.")
+    print(f"Tracklist written to {tracklist_path}")
+
+    if not_found_count:
+        print(f"\n{not_found_count} tracks not found (details in {report.path}).")
     else:
         print("\nAll tracks were found and downloaded.")
 
     # Summary
-    total_tracks = len(tracks)
-    found_tracks = total_tracks - len(not_found)
-    print(f"\nSummary: {found_tracks}/{total_tracks} tracks downloaded successfully.")
+    found_tracks = total_tracks - not_found_count
+    print(f"\nSummary: {found_tracks}/{total_tracks} tracks downloaded successfully ({total_searches} searches issued).")
+    print(f"Watchdog: {watchdog.summary()}")
+
+    if args.analyze:
+        analyze_directory(playlist_root, analysis_cache_path(args.directory, args.store), tag=True)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,306 @@
+import os
+import sys
+import re
+import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import DJ2MP3_youtube as youtube
+from audio_analysis import analyze_directory, analysis_cache_path
+from DJ2MP3_tracklist_via_soulseek import sanitize_filename, iter_tracklist_file, read_soulseek_credentials
+from library_store import LibraryStore
+from sldl_utils import track_key, sldl_index_path, read_sldl_index, build_sldl_cmd, flatten_directory, SldlMonitor
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+from candidate_rules import get_rules
+import io_scheduler
+from job_plan import plan_mix, print_plan, load_history
+
+# sldl output lines that mean a track will not come from Soulseek
+SLDL_FAILED_RE = re.compile(r"^\s*(?:Failed|Not found|All downloads failed|Timed out|Search timed out)[^:]*:\s*(.+?)(?:\s+<-\s.*)?\s*$")
+# sldl output lines that mean a track is being searched / downloaded / done
+SLDL_STARTED_RE = re.compile(r"^\s*(?:Searching|Downloading|Initialize|InProgress)[^:]*:\s*(.+?)(?:\s+<-\s.*)?\s*$")
+SLDL_SUCCEEDED_RE = re.compile(r"^\s*(?:Succeeded|Succeded|Downloaded)[^:]*:\s*(.+?)(?:\s+<-\s.*)?\s*$")
+
+
+class TrackRouter:
+    """
+    Tracks the Soulseek state of every track and hands failed or timed-out
+    tracks to the YouTube worker pool as soon as they are known to be lost.
+    The YouTube workers record their tracks through the router (see track()), so a
+    YouTube failure can give way to a Soulseek download that finished late.
+    """
+
+    def __init__(self, tracks, executor, yt_args, ydl_opts, out_dir, report, track_timeout, watchdog=None):
+        self.tracks = tracks
+        self.index = {track: i for i, track in enumerate(tracks, 1)}
+        self.by_key = {track_key(t): t for t in tracks}
+        self.executor = executor
+        self.yt_args = yt_args
+        self.ydl_opts = ydl_opts
+        self.out_dir = out_dir
+        self.report = report
+        self.track_timeout = track_timeout
+        self.watchdog = watchdog
+        self.lock = threading.Lock()
+        self.started = {}
+        self.finished = {}
+        self.soulseek_ok = set()
+        self.routed = set()
+        self.late = set()
+        self.futures = []
+        self.results = {}  # track -> YouTube future, returning the downloaded path or None
+        self.held = {}  # track -> YouTube failure record held back while Soulseek may still deliver
+        self.sldl_done = False
+
+    def match(self, text):
+        # sldl echoes the queries of the list file, so keys match exactly
+        return self.by_key.get(track_key(text))
+
+    def feed(self, line):
+        """Update state from one line of sldl output."""
+        for regex, handler in ((SLDL_SUCCEEDED_RE, self.succeeded),
+                               (SLDL_FAILED_RE, self.route),
+                               (SLDL_STARTED_RE, self.start)):
+            m = regex.match(line)
+            if m:
+                track = self.match(m.group(1))
+                if track:
+                    handler(track)
+                return
+
+    def start(self, track):
+        with self.lock:
+            self.started.setdefault(track, time.monotonic())
+
+    def succeeded(self, track):
+        with self.lock:
+            self.finished.setdefault(track, time.monotonic())
+            if track in self.routed:
+                # Already handed to YouTube; settled in settle_late() once YouTube is done
+                self.late.add(track)
+                return
+            self.soulseek_ok.add(track)
+
+    def track(self, track, status, **kwargs):
+        """
+        RunReport.track() for the YouTube workers. Failures are held back while sldl runs
+        and for late Soulseek tracks; settle_late() decides what is recorded for those.
+        """
+        with self.lock:
+            if status != 'downloaded' and (not self.sldl_done or track in self.late):
+                self.held[track] = (status, kwargs)
+                return
+        self.report.track(track, status, **kwargs)
+
+    def sldl_finished(self):
+        """No more late Soulseek downloads: record the held YouTube failures of the other tracks."""
+        with self.lock:
+            self.sldl_done = True
+            held = {t: r for t, r in self.held.items() if t not in self.late}
+            for track in held:
+                del self.held[track]
+        for track in sorted(held, key=self.index.get):
+            status, kwargs = held[track]
+            self.report.track(track, status, **kwargs)
+
+    def settle_late(self, index, index_dir):
+        """
+        After the YouTube workers are done, for the tracks sldl finished after their hand-off:
+        the Soulseek file is deleted if YouTube downloaded the track, else it is kept and
+        the track counts as a Soulseek download instead of the YouTube failure.
+        """
+        for track in sorted(self.late, key=self.index.get):
+            future = self.results[track]
+            filepath = index.get(track_key(track), {}).get('filepath')
+            path = os.path.normpath(os.path.join(index_dir, filepath)) if filepath else None
+            if not future.exception() and future.result():
+                if path and os.path.isfile(path):
+                    os.remove(path)
+                    print(f"[LATE] {track}: downloaded from YouTube too, removed the Soulseek copy {os.path.basename(path)}")
+                continue
+            if path and os.path.isfile(path):
+                print(f"[LATE] {track}: YouTube failed, keeping the Soulseek download {os.path.basename(path)}")
+                self.held.pop(track, None)
+                self.soulseek_ok.add(track)
+                with youtube.log_lock:
+                    youtube.summary['skipped'][:] = [s for s in youtube.summary['skipped'] if s[0] != track]
+            elif track in self.held:
+                status, kwargs = self.held.pop(track)
+                self.report.track(track, status, **kwargs)
+
+    def route(self, track, reason='soulseek failed'):
+        with self.lock:
+            if track in self.routed or track in self.soulseek_ok:
+                return
+            self.routed.add(track)
+        print(f"[ROUTE] {track} -> YouTube ({reason})")
+        future = self.executor.submit(
+            youtube.process_track, self.index[track], track, self.yt_args, self.ydl_opts,
+            self.out_dir, self, len(self.tracks), self.watchdog)
+        self.results[track] = future
+        self.futures.append(future)
+
+    def check_timeouts(self):
+        if not self.track_timeout:
+            return
+        now = time.monotonic()
+        with self.lock:
+            expired = [t for t, s in self.started.items()
+                       if now - s > self.track_timeout and t not in self.soulseek_ok and t not in self.routed]
+        for track in expired:
+            self.route(track, 'soulseek timed out')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download a text file tracklist from Soulseek, falling back to YouTube per track.")
+    parser.add_argument('tracklist_file', help="Path to text file containing tracks (format: Artist Trackname), or '-' for stdin")
+    parser.add_argument('-d', '--directory', required=True, help='Output directory for downloads')
+    parser.add_argument('--name', type=str, default=None, help='Output folder name (default: tracklist filename, or "stdin")')
+    parser.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    parser.add_argument('--slsk-pref-format', type=str, default='mp3,flac,wav', help='Soulseek preferred formats, comma-separated (default: mp3,flac,wav)')
+    parser.add_argument('--slsk-min-bitrate', type=int, default=256, help='Soulseek minimum bitrate (default: 256)')
+    parser.add_argument('--slsk-track-timeout', type=int, default=300, help='Seconds before a started Soulseek track is also sent to YouTube, 0 to disable (default: 300)')
+    parser.add_argument('--yt-codec', type=str, default='mp3', help='YouTube output codec (default: mp3)')
+    parser.add_argument('--yt-quality', type=str, default='0', help='YouTube ffmpeg quality, 0 = best VBR or a bitrate like 320 (default: 0)')
+    parser.add_argument('--yt-min-duration', type=int, default=150, help='YouTube minimum duration (s)')
+    parser.add_argument('--yt-max-duration', type=int, default=630, help='YouTube maximum duration (s)')
+    parser.add_argument('--rules', type=str, default=None, help='Reject rules file for YouTube video titles (default: candidate_rules.txt)')
+    parser.add_argument('--yt-workers', type=int, default=4, help='Concurrent YouTube downloads')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often a stalled YouTube track is retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Stop starting new downloads after this many minutes, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--analyze', action='store_true', help='Compute loudness/ReplayGain, BPM and key of the downloads and tag them (needs numpy)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
+    args = parser.parse_args()
+    io_scheduler.configure(args)
+    try:
+        get_rules('candidates', args.rules)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Could not load rules: {e}")
+
+    if args.tracklist_file != '-' and not os.path.isfile(args.tracklist_file):
+        sys.exit(f"Error: Tracklist file '{args.tracklist_file}' not found.")
+
+    tracks = list(iter_tracklist_file(args.tracklist_file))
+    print(f"Loaded {len(tracks)} tracks.")
+    if not tracks:
+        sys.exit("No tracks found in file.")
+
+    if args.name:
+        basename = args.name
+    elif args.tracklist_file == '-':
+        basename = 'stdin'
+    else:
+        basename = os.path.splitext(os.path.basename(args.tracklist_file))[0]
+    mix_root = os.path.join(args.directory, sanitize_filename(basename))
+
+    if args.plan:
+        # sldl searches every track once here, without query variants
+        print_plan(basename, plan_mix(tracks, mix_root, args, variants=False), load_history([args.directory]),
+                   sources=('soulseek', 'youtube'), workers=args.yt_workers)
+        return
+
+    soulseek_user, soulseek_pass = read_soulseek_credentials()
+    if not soulseek_user or not soulseek_pass:
+        sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
+    os.makedirs(mix_root, exist_ok=True)
+    tracklist_path = os.path.join(mix_root, 'tracklist.txt')
+    with open(tracklist_path, 'w', encoding='utf-8') as f:
+        for track in tracks:
+            f.write(f'"{track}"\n')
+    print(f"Tracklist written to {tracklist_path}")
+
+    report = RunReport(mix_root, args.tracklist_file, args)
+
+    # Per-source quality preferences
+    yt_args = argparse.Namespace(min_duration=args.yt_min_duration, max_duration=args.yt_max_duration,
+                                 max_requeues=args.max_requeues, rules=args.rules)
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': args.yt_codec,
+            'preferredquality': args.yt_quality
+        }]
+    }
+    if args.stall_timeout:
+        ydl_opts['socket_timeout'] = args.stall_timeout
+    watchdog = TransferWatchdog.from_args(args)
+
+    executor = ThreadPoolExecutor(max_workers=args.yt_workers)
+    router = TrackRouter(tracks, executor, yt_args, ydl_opts, mix_root, report, args.slsk_track_timeout, watchdog)
+
+    slsk_args = argparse.Namespace(pref_format=args.slsk_pref_format, min_bitrate=args.slsk_min_bitrate,
+                                   stall_timeout=args.stall_timeout)
+    cmd = build_sldl_cmd(tracklist_path, mix_root, slsk_args, soulseek_user, soulseek_pass)
+    print(f"Running: {' '.join(cmd)}")
+
+    # Watch sldl output and route misses while it is still running; a stalled sldl is
+    # stopped and its unfinished tracks go to YouTube below
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    monitor = SldlMonitor(proc, mix_root, watchdog)
+    monitor.start()
+    stop = threading.Event()
+
+    def timeout_loop():
+        while not stop.wait(5):
+            router.check_timeouts()
+
+    watcher = threading.Thread(target=timeout_loop, daemon=True)
+    watcher.start()
+    print("\n--- slsk-batchdl output ---")
+    for line in proc.stdout:
+        print(line, end="")
+        router.feed(line)
+    proc.wait()
+    stop.set()
+    monitor.join()
+    monitor.cleanup()
+    print("--- slsk-batchdl finished ---\n")
+
+    # Anything sldl did not confirm is routed now
+    index_path = sldl_index_path(tracklist_path, mix_root)
+    index = read_sldl_index(index_path)
+    for track in tracks:
+        if index.get(track_key(track), {}).get('state') == '1':
+            router.succeeded(track)
+        router.route(track, 'not downloaded by sldl')
+    router.sldl_finished()
+
+    wait(router.futures)
+    executor.shutdown(wait=True)
+    router.settle_late(index, os.path.dirname(index_path))
+    flatten_directory(mix_root, LibraryStore(args.store) if args.store else None)
+    print(f"Flattened directory: {mix_root}")
+
+    # YouTube tracks were recorded by their workers; add the Soulseek ones
+    for track in sorted(router.soulseek_ok, key=router.index.get):
+        name = os.path.basename(index.get(track_key(track), {}).get('filepath') or '')
+        path = os.path.join(mix_root, name) if name else None
+        stages = {}
+        if track in router.started:
+            stages['soulseek'] = router.finished[track] - router.started[track]
+        report.track(track, 'downloaded', source='soulseek', candidate={'file': name or None}, path=path,
+                     bytes=os.path.getsize(path) if path and os.path.isfile(path) else None, stages=stages)
+    report.close(watchdog=watchdog.stats)
+
+    soulseek_count = len(router.soulseek_ok)
+    print(f"\nSummary: {soulseek_count} from Soulseek, {len(youtube.summary['success'])} from YouTube, "
+          f"{len(youtube.summary['skipped'])} not found, {len(tracks)} total.")
+    print(f"Watchdog: {watchdog.summary()}")
+    if youtube.summary['skipped']:
+        print(f"See {report.path} for details on skipped tracks.")
+
+    if args.analyze:
+        analyze_directory(mix_root, analysis_cache_path(args.directory, args.store), tag=True)
+
+
+if __name__ == '__main__':
+    main()
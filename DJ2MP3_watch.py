@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from DJ2MP3_spotify_via_soulseek import read_spotify_credentials
+from DJ2MP3_1001tracklists_via_soulseek import fetch_1001tracklists_tracks
+from DJ2MP3_tracklist_via_soulseek import sanitize_filename, read_soulseek_credentials
+from query_planner import download_with_query_plan
+from transfer_watchdog import TransferWatchdog
+from run_report import RunReport
+import io_scheduler
+from job_plan import plan_mix, print_plan, load_history, success_rate, format_duration
+from spotify_session import get_spotify
+
+state_lock = threading.Lock()
+# Sources are checked in parallel, but only one downloads at a time: every sldl run
+# logs in with the same Soulseek account
+download_lock = threading.Lock()
+
+
+def read_sources(path):
+    """Read watched source URLs, one per line. Blank lines and '#' comments are ignored."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+    except FileNotFoundError:
+        sys.exit(f"Error: Sources file '{path}' not found.")
+
+
+def source_kind(url):
+    if 'open.spotify.com/playlist/' in url:
+        return 'spotify'
+    if '1001tracklists.com' in url:
+        return '1001tracklists'
+    return None
+
+
+def load_state(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, path):
+    """Write the state file atomically (temp file + rename)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def fetch_spotify_playlist_tracks(sp, playlist_id):
+    """Fetch every track of a playlist as 'Artist Title', following pagination."""
+    tracks = []
+    results = sp.playlist_items(playlist_id, fields='items(track(name,artists(name))),next', additional_types=('track',))
+    while results:
+        for item in results['items']:
+            track = item.get('track')
+            if not track:
+                continue
+            artist = track['artists'][0]['name'] if track['artists'] else ''
+            title = track['name']
+            if artist and title:
+                tracks.append(f'{artist} {title}')
+        results = sp.next(results) if results.get('next') else None
+    return tracks
+
+
+def check_source(url, entry, sp):
+    """
+    Return (changed, name, tracks, marker) for a source. Unchanged Spotify playlists
+    cost a single snapshot_id request; 1001tracklists pages are compared by a hash
+    of the scraped track list.
+    """
+    if source_kind(url) == 'spotify':
+        playlist_id = url.split("playlist/")[-1].split("?")[0]
+        meta = sp.playlist(playlist_id, fields='snapshot_id,name')
+        marker = meta['snapshot_id']
+        if entry.get('marker') == marker:
+            return False, entry.get('name'), None, marker
+        return True, meta['name'], fetch_spotify_playlist_tracks(sp, playlist_id), marker
+
+    tracks, title = fetch_1001tracklists_tracks(url)
+    marker = hashlib.sha256('\n'.join(tracks).encode('utf-8')).hexdigest()
+    if not tracks or entry.get('marker') == marker:
+        return False, entry.get('name') or title, None, marker
+    return True, title, tracks, marker
+
+
+def sync_source(url, state, state_path, args, sp, soulseek_user, soulseek_pass):
+    """Download the tracks added to one source since the last sync, and retry the missing ones."""
+    with state_lock:
+        entry = dict(state.get(url, {}))
+    try:
+        changed, name, tracks, marker = check_source(url, entry, sp)
+    except Exception as e:
+        print(f"[ERROR] {url}: {e}")
+        return
+    missing = entry.get('missing', [])
+    if not changed:
+        if not missing:
+            print(f"[UNCHANGED] {name or url}")
+            return
+        tracks = entry.get('tracks', [])
+
+    known = set(entry.get('tracks', []))
+    added = [t for t in tracks if t not in known]
+    current = set(tracks)
+    retry = [t for t in missing if t in current and t not in added]
+    if changed:
+        print(f"[CHANGED] {name}: {len(added)} new of {len(tracks)} tracks, {len(retry)} missing retried")
+    else:
+        print(f"[RETRY] {name}: {len(retry)} missing tracks")
+
+    source_root = os.path.join(args.directory, sanitize_filename(name))
+    os.makedirs(source_root, exist_ok=True)
+    with open(os.path.join(source_root, 'tracklist.txt'), 'w', encoding='utf-8') as f:
+        for track in tracks:
+            f.write(f'"{track}"\n')
+
+    not_found = []
+    if added or retry:
+        with download_lock:
+            watchdog = TransferWatchdog.from_args(args)
+            report = RunReport(source_root, url, args)
+            not_found, searches = download_with_query_plan(added + retry, source_root, args, soulseek_user, soulseek_pass,
+                                                           list_name='delta.txt', watchdog=watchdog, report=report)
+            report.close(searches=searches, watchdog=watchdog.stats)
+        print(f"[WATCHDOG] {name}: {watchdog.summary()}")
+        print(f"[REPORT] {name}: {len(added) + len(retry) - len(not_found)}/{len(added) + len(retry)} downloaded, see {report.path}")
+
+    with state_lock:
+        state[url] = {
+            'name': name,
+            'marker': marker,
+            'tracks': tracks,
+            'missing': not_found,
+            'synced_at': datetime.datetime.now().isoformat(),
+        }
+        save_state(state, state_path)
+
+
+def print_watch_plan(sources, state, args):
+    """--plan: the state of every source as of its last sync; the sources themselves are not checked."""
+    for url in sources:
+        entry = state.get(url)
+        if not entry:
+            print(f"\nPlan for {url}\n  Not synced yet; the next pass downloads its whole tracklist")
+            continue
+        source_root = os.path.join(args.directory, sanitize_filename(entry['name']))
+        print_plan(f"{entry['name']} (last synced {entry.get('synced_at', '?')})",
+                   plan_mix(entry.get('tracks', []), source_root, args), {}, sources=())
+        if entry.get('missing'):
+            print(f"  {'Retried next sync:':<22}{len(entry['missing'])} tracks not found last time")
+    stats = load_history([args.directory]).get('soulseek')
+    print("\nA sync downloads the tracks added since the last one and retries the ones not found before.")
+    if stats and stats['tracks']:
+        print(f"From {stats['tracks']} earlier tracks: {success_rate(stats) * 100:.0f}% found, "
+              f"~{stats['bytes'] / max(stats['downloaded'], 1) / 1024 ** 2:.1f} MiB and "
+              f"~{format_duration(stats['seconds'] / stats['tracks'])} per new track.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch Spotify playlists and 1001tracklists pages and download only newly added tracks via Soulseek.")
+    parser.add_argument('sources_file', help="Text file with one Spotify playlist or 1001tracklists URL per line")
+    parser.add_argument('-d', '--directory', required=True, help='Output directory for downloads')
+    parser.add_argument('--pref-format', type=str, default='mp3,flac,wav', help='Preferred formats, comma-separated (default: mp3,flac,wav)')
+    parser.add_argument('--min-bitrate', type=int, default=256, help='Minimum bitrate (default: 256)')
+    parser.add_argument('--min-size', type=str, default='500K', help='Minimum file size (default: 500K)')
+    parser.add_argument('--max-size', type=str, default='100M', help='Maximum file size (default: 100M)')
+    parser.add_argument('--max-variants', type=int, default=4, help='Maximum query variants tried per track (default: 4)')
+    parser.add_argument('--store', type=str, default=None, help='Content-addressed library store directory; mix folders then only hold links and a manifest.json')
+    parser.add_argument('--backend', choices=('sldl', 'native'), default='sldl', help='Soulseek backend: sldl.exe, or the built-in client (default: sldl)')
+    parser.add_argument('--slsk-server', type=str, default='server.slsknet.org:2242', help='Soulseek server for the native backend (default: server.slsknet.org:2242)')
+    parser.add_argument('--listen-port', type=int, default=2234, help='Peer listen port for the native backend (default: 2234)')
+    parser.add_argument('--slsk-concurrency', type=int, default=4, help='Parallel searches/transfers for the native backend (default: 4)')
+    parser.add_argument('--search-timeout', type=int, default=8, help='Seconds to collect search results for the native backend (default: 8)')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often the tracks of a stalled sldl run are retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Give up on missing tracks after this many minutes per sync, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='File moves/conversions running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--interval', type=int, default=3600, help='Seconds between sync passes (default: 3600)')
+    parser.add_argument('--max-concurrent', type=int, default=4, help='Sources checked for changes in parallel; downloads run one source at a time (default: 4)')
+    parser.add_argument('--once', action='store_true', help='Run a single sync pass and exit')
+    parser.add_argument('--state-file', type=str, default=None, help='Sync state file (default: <directory>/.watch_state.json)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
+    args = parser.parse_args()
+    io_scheduler.configure(args)
+    if args.plan:
+        state = load_state(args.state_file or os.path.join(args.directory, '.watch_state.json'))
+        print_watch_plan([u for u in read_sources(args.sources_file) if source_kind(u)], state, args)
+        return
+
+    soulseek_user, soulseek_pass = read_soulseek_credentials()
+    if not soulseek_user or not soulseek_pass:
+        sys.exit("Soulseek credentials not found in soulseek_credentials.txt")
+
+    os.makedirs(args.directory, exist_ok=True)
+    state_path = args.state_file or os.path.join(args.directory, '.watch_state.json')
+    state = load_state(state_path)
+
+    sp = None
+    while True:
+        sources = read_sources(args.sources_file)
+        unknown = [u for u in sources if not source_kind(u)]
+        for url in unknown:
+            print(f"[SKIP] Unsupported source: {url}")
+        sources = [u for u in sources if source_kind(u)]
+
+        if sp is None and any(source_kind(u) == 'spotify' for u in sources):
+            client_id, client_secret = read_spotify_credentials()
+            if not client_id or not client_secret:
+                sys.exit("Spotify credentials not found in spotify_credentials.txt")
+            sp = get_spotify(client_id, client_secret, pool_size=max(10, args.max_concurrent))
+
+        print(f"\n=== Sync pass {datetime.datetime.now().isoformat()} ({len(sources)} sources) ===")
+        with ThreadPoolExecutor(max_workers=args.max_concurrent) as executor:
+            futures = {executor.submit(sync_source, url, state, state_path, args, sp, soulseek_user, soulseek_pass): url
+                       for url in sources}
+        for future, url in futures.items():
+            if future.exception():
+                print(f"[ERROR] {url}: {future.exception()}")
+
+        if args.once:
+            break
+        print(f"Next sync in {args.interval}s")
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,23 @@ import re
 import os
 import sys
 import argparse
+import time
+import signal
 import threading
-import datetime
 from urllib.parse import urlparse, parse_qs
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from youtube_comment_downloader import YoutubeCommentDownloader, SORT_BY_POPULAR
 import yt_dlp
 
+from audio_analysis import analyze_directory, analysis_cache_path
+from transfer_watchdog import TransferWatchdog, TransferStalled
+from run_report import RunReport
+from candidate_rules import get_rules
+import io_scheduler
+from job_plan import plan_cached_source
+from io_scheduler import get_scheduler, mix_priority
+
 # Optional for ID3 tagging
 try:
     from mutagen.easyid3 import EasyID3
@@ -27,18 +36,27 @@ try:
 except ImportError:
     HAVE_TQDM = False
 
-# Blacklist terms in video titles
-BLACKLIST_TERMS = ('live', 'dj set')
+# Optional: finds the ffmpeg process of a hung conversion on any OS (else /proc, Linux only)
+try:
+    import psutil
+    HAVE_PSUTIL = True
+except ImportError:
+    HAVE_PSUTIL = False
+
+# Seconds a conversion may run before its ffmpeg process is killed
+CONVERT_TIMEOUT = 300
 
 # Thread-safe structures
 log_lock = threading.Lock()
 summary = {'success': [], 'skipped': []}
 
 
-def sanitize_tracklist(lines):
+def sanitize_tracklist(lines, rules=None):
     """
     Clean and filter raw comment lines into 'Artist - Title' format.
+    Lines whose title matches a [tracklist] rule (intro, outro, ...) are dropped.
     """
+    rules = rules or get_rules('tracklist')
     cleaned, seen = [], set()
     for line in lines:
         line = line.strip()
@@ -58,7 +76,7 @@ def sanitize_tracklist(lines):
             continue
         if not re.search(r"[A-Za-z]", artist) or not re.search(r"[A-Za-z]", title):
             continue
-        if any(w in title.lower() for w in ('intro','outro','mixout','timestamp','setlist')):
+        if rules.match(title):
             continue
         key = f"{artist.lower()} - {title.lower()}"
         if key in seen:
@@ -68,74 +86,264 @@ def sanitize_tracklist(lines):
     return cleaned
 
 
-def process_track(index, track, args, ydl_opts, out_dir, log_path, total):
+def reject_reason(vid, args, rules):
+    """Why a search result is not a candidate (duration out of range or a [candidates] rule), or None."""
+    dur = vid.get('duration') or 0
+    if dur < args.min_duration:
+        return 'too short'
+    if dur > args.max_duration:
+        return 'too long'
+    rule = rules.match(vid.get('title') or '')
+    if rule:
+        return f"blacklisted: {rule}"
+    return None
+
+
+def process_track(index, track, args, ydl_opts, out_dir, report, total, watchdog=None):
     """
-    Handle a single track: search, filter, download, tag, and log.
+    Handle a single track: search, filter, download, tag, and record it in the run report.
+    With a TransferWatchdog, a stalled download is cancelled and requeued on the next match.
+    Download and conversion go through the IOScheduler, ahead of other tracks once the mix is nearly done.
+    A conversion running longer than args.convert_timeout seconds is killed (see ConversionGuard).
+    Returns the path of the downloaded file, or None when the track was skipped.
     """
+    stages = {}
+
+    def skip(reason, **extra):
+        with log_lock:
+            summary['skipped'].append((track, reason))
+        report.track(track, 'not_found' if reason == 'no valid match' else 'failed', source='youtube',
+                     stages=stages, reason=reason, **extra)
+
+    if watchdog and watchdog.expired():
+        watchdog.skipped()
+        skip('run deadline reached')
+        return
     # Search
+    started = time.monotonic()
     try:
         with yt_dlp.YoutubeDL({**ydl_opts, 'quiet': True}) as ydl:
             info = ydl.extract_info(f"ytsearch5:{track}", download=False)
     except Exception as e:
-        reason = f"search error: {e}"
-        with log_lock:
-            summary['skipped'].append((track, reason))
+        skip(f"search error: {e}")
         return
+    finally:
+        stages['search'] = time.monotonic() - started
     entries = info.get('entries', [])
+    rules = get_rules('candidates', getattr(args, 'rules', None))
     filtered = []
-    chosen = None
+    candidates = []
     for vid in entries:
-        title = (vid.get('title') or '').lower()
-        dur = vid.get('duration', 0)
-        url = vid.get('webpage_url') or f"https://www.youtube.com/watch?v={vid.get('id')}"
-        if dur < args.min_duration:
-            filtered.append((url, 'too short'))
-            continue
-        if dur > args.max_duration:
-            filtered.append((url, 'too long'))
+        reason = reject_reason(vid, args, rules)
+        if reason:
+            url = vid.get('webpage_url') or f"https://www.youtube.com/watch?v={vid.get('id')}"
+            filtered.append((url, reason))
             continue
-        if any(term in title for term in BLACKLIST_TERMS):
-            filtered.append((url, 'blacklisted'))
-            continue
-        chosen = vid
-        break
-    if not chosen:
-        with log_lock:
-            summary['skipped'].append((track, 'no valid match'))
-            with open(log_path, 'a', encoding='utf-8') as log:
-                log.write(f"\n[SKIPPED] {track}\n")
-                for u, r in filtered:
-                    log.write(f"  - {u} ({r})\n")
+        candidates.append(vid)
+    if not candidates:
+        skip('no valid match', rejected=[{'url': u, 'reason': r} for u, r in filtered])
         return
-    dl_url = chosen.get('webpage_url')
     safe = re.sub(r'[\\/*?:"<>|]', '_', track)
-    out_template = os.path.join(out_dir, f"{index:02d} - {safe}.%(ext)s")
+    out_base = os.path.join(out_dir, f"{index:02d} - {safe}")
+    out_template = f"{out_base}.%(ext)s"
+    attempts = 1 + (args.max_requeues if watchdog else 0)
+    with log_lock:
+        priority = mix_priority(len(summary['success']) + len(summary['skipped']), total)
     # Download and convert
-    try:
-        with yt_dlp.YoutubeDL({**ydl_opts, 'outtmpl': out_template, 'quiet': False}) as ydl:
-            ydl.download([dl_url])
-    except Exception as e:
-        with log_lock:
-            summary['skipped'].append((track, f"download error: {e}"))
-            with open(log_path, 'a', encoding='utf-8') as log:
-                log.write(f"\n[FAILED] {track} - download error: {e}\n")
+    for attempt, chosen in enumerate(candidates[:attempts]):
+        dl_url = chosen.get('webpage_url') or f"https://www.youtube.com/watch?v={chosen.get('id')}"
+        stalled = []
+        timer = StageTimer(stages)
+        shaper = IOShaper(priority, watchdog, dl_url)
+        guard = ConversionGuard(getattr(args, 'convert_timeout', CONVERT_TIMEOUT), out_base)
+        opts = {**ydl_opts, 'outtmpl': out_template, 'quiet': False,
+                'progress_hooks': [timer.progress_hook, shaper.progress_hook],
+                'postprocessor_hooks': [timer.postprocessor_hook, shaper.postprocessor_hook, guard.postprocessor_hook]}
+        if watchdog:
+            opts['progress_hooks'].append(make_watchdog_hook(watchdog, dl_url, stalled))
+        try:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                ydl.download([dl_url])
+            break
+        except Exception as e:
+            error = f"conversion timed out after {guard.timeout}s" if guard.timed_out else e
+        finally:
+            guard.cancel()
+            timer.stop()
+            shaper.release()
+            if watchdog:
+                watchdog.finish(dl_url)
+        if stalled and attempt + 1 < min(attempts, len(candidates)) and not watchdog.expired():
+            watchdog.requeued()
+            print(f"[WATCHDOG] {track}: {stalled[0]}, requeueing on the next match")
+            continue
+        skip(f"download error: {stalled[0] if stalled else error}", candidate={'url': dl_url, 'title': chosen.get('title')})
         return
     with log_lock:
         summary['success'].append((track, dl_url))
-        with open(log_path, 'a', encoding='utf-8') as log:
-            log.write(f"[SUCCESS] {track} -> {dl_url}\n")
     # Tag metadata
-    if HAVE_MUTAGEN:
-        mp3_path = os.path.join(out_dir, f"{index:02d} - {safe}.mp3")
-        if os.path.isfile(mp3_path):
+    path = timer.path or os.path.join(out_dir, f"{index:02d} - {safe}.mp3")
+    if HAVE_MUTAGEN and path.endswith('.mp3') and os.path.isfile(path):
+        try:
+            artist, title = track.split(' - ', 1)
+            tags = EasyID3(path)
+            tags['artist'] = artist.strip()
+            tags['title'] = title.strip()
+            tags.save()
+        except Exception:
+            pass
+    report.track(track, 'downloaded', source='youtube',
+                 candidate={'url': dl_url, 'title': chosen.get('title'), 'duration': chosen.get('duration')},
+                 path=path, bytes=os.path.getsize(path) if os.path.isfile(path) else None, stages=stages)
+    return path
+
+
+class StageTimer:
+    """yt-dlp hooks that add download and conversion times to a stages dict and note the final file."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.stage = 'download'
+        self.since = time.monotonic()
+        self.path = None
+
+    def switch(self, stage):
+        now = time.monotonic()
+        if self.stage:
+            self.stages[self.stage] = self.stages.get(self.stage, 0.0) + now - self.since
+        self.stage, self.since = stage, now
+
+    def progress_hook(self, d):
+        if d.get('status') == 'downloading' and self.stage != 'download':
+            self.switch('download')
+        elif d.get('status') == 'finished':
+            self.switch(None)
+
+    def postprocessor_hook(self, d):
+        if d.get('status') == 'started':
+            self.switch('convert')
+        elif d.get('status') == 'finished':
+            self.switch(None)
+            self.path = (d.get('info_dict') or {}).get('filepath') or self.path
+
+    def stop(self):
+        self.switch(None)
+
+
+class IOShaper:
+    """
+    yt-dlp hooks that charge download progress to the IOScheduler bandwidth cap and run
+    the conversion in one of its disk slots.
+    """
+
+    def __init__(self, priority, watchdog=None, key=None):
+        self.scheduler = get_scheduler()
+        self.priority = priority
+        self.watchdog = watchdog
+        self.key = key
+        self.downloaded = 0
+        self.holding = False
+
+    def progress_hook(self, d):
+        if d.get('status') != 'downloading':
+            return
+        done = d.get('downloaded_bytes') or 0
+        delay = self.scheduler.throttle(done - self.downloaded, self.priority)
+        self.downloaded = done
+        if delay:
+            time.sleep(delay)
+            if self.watchdog:
+                self.watchdog.extend(delay, self.key)
+
+    def postprocessor_hook(self, d):
+        if d.get('status') == 'started' and not self.holding and self.scheduler.disk_slots:
+            self.scheduler.disk_slots.acquire(self.priority)
+            self.holding = True
+        elif d.get('status') == 'finished':
+            self.release()
+
+    def release(self):
+        if self.holding:
+            self.holding = False
+            self.scheduler.disk_slots.release()
+
+
+def ffmpeg_children(marker):
+    """PIDs of this process's ffmpeg/ffprobe children whose command line contains marker."""
+    found = []
+    if HAVE_PSUTIL:
+        for proc in psutil.Process().children(recursive=True):
+            try:
+                name, cmdline = proc.name(), ' '.join(proc.cmdline())
+            except psutil.Error:
+                continue
+            found.append((proc.pid, name, cmdline))
+    elif os.path.isdir('/proc'):
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                with open(f"/proc/{pid}/stat", 'rb') as f:
+                    stat = f.read().decode(errors='replace')
+                with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                    cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+            except OSError:
+                continue
+            # 'pid (comm) state ppid ...'; comm may itself contain spaces and parentheses
+            name = stat[stat.find('(') + 1:stat.rfind(')')]
+            if int(stat[stat.rfind(')') + 2:].split()[1]) == os.getpid():
+                found.append((int(pid), name, cmdline))
+    return [pid for pid, name, cmdline in found
+            if os.path.splitext(name)[0] in ('ffmpeg', 'ffprobe') and marker in cmdline]
+
+
+class ConversionGuard:
+    """
+    yt-dlp postprocessor hook that kills the ffmpeg process of a conversion still running
+    timeout seconds after it started, so a hung ffmpeg fails the track instead of blocking
+    its worker. Needs psutil or /proc to find the process; otherwise there is no limit.
+    """
+
+    def __init__(self, timeout, marker):
+        self.timeout = timeout
+        self.marker = marker
+        self.timer = None
+        self.timed_out = False
+
+    def postprocessor_hook(self, d):
+        if d.get('status') == 'started' and self.timeout:
+            self.cancel()
+            self.timer = threading.Timer(self.timeout, self.kill)
+            self.timer.daemon = True
+            self.timer.start()
+        elif d.get('status') == 'finished':
+            self.cancel()
+
+    def kill(self):
+        for pid in ffmpeg_children(self.marker):
+            self.timed_out = True
             try:
-                artist, title = track.split(' - ', 1)
-                tags = EasyID3(mp3_path)
-                tags['artist'] = artist.strip()
-                tags['title'] = title.strip()
-                tags.save()
-            except Exception:
+                os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            except OSError:
                 pass
+        if self.timed_out:
+            print(f"[TIMEOUT] Conversion of {os.path.basename(self.marker)} still running after {self.timeout}s, killed ffmpeg")
+
+    def cancel(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+
+def make_watchdog_hook(watchdog, key, stalled):
+    """yt-dlp progress hook feeding the watchdog; aborts the download when it stalls."""
+    def hook(d):
+        if d.get('status') != 'downloading':
+            return
+        try:
+            watchdog.progress(key, d.get('downloaded_bytes') or 0)
+        except TransferStalled as e:
+            stalled.append(str(e))
+            raise
+    return hook
 
 
 def main():
@@ -145,7 +353,27 @@ def main():
     parser.add_argument('--min-duration', type=int, default=150, help='Minimum duration (s)')
     parser.add_argument('--max-duration', type=int, default=630, help='Maximum duration (s)')
     parser.add_argument('--workers', type=int, default=4, help='Concurrent downloads')
+    parser.add_argument('--stall-rate', type=int, default=8, help='Transfers slower than this many KiB/s for --stall-timeout are cancelled and requeued (default: 8)')
+    parser.add_argument('--stall-timeout', type=int, default=60, help='Seconds of low throughput before a transfer counts as stalled, 0 to disable (default: 60)')
+    parser.add_argument('--max-requeues', type=int, default=1, help='How often a stalled track is retried (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='Stop starting new downloads after this many minutes, 0 for no limit (default: 0)')
+    parser.add_argument('--bandwidth', type=str, default=None, help='Total download bandwidth cap in bytes/s, e.g. 2M (default: unlimited)')
+    parser.add_argument('--disk-slots', type=int, default=None, help='Conversions/file moves running at the same time, shared with the other runs on this host that set it or --bandwidth (default: 2, for this run alone)')
+    parser.add_argument('--convert-timeout', type=int, default=CONVERT_TIMEOUT, help='Seconds before a hung ffmpeg conversion is killed, 0 to disable (default: 300)')
+    parser.add_argument('--rules', type=str, default=None, help='Reject rules file for video titles and tracklist lines (default: candidate_rules.txt)')
+    parser.add_argument('--analyze', action='store_true', help='Compute loudness/ReplayGain, BPM and key of the downloads and tag them (needs numpy)')
+    parser.add_argument('--plan', action='store_true', help='Only print the projected work (tracks already downloaded, searches, volume and time from earlier runs) and exit; nothing is downloaded')
     args = parser.parse_args()
+    io_scheduler.configure(args)
+    if args.plan:
+        plan_cached_source(args.directory, args.comment_url, args, sources=('youtube',), workers=args.workers, variants=False)
+        return
+
+    try:
+        tracklist_rules = get_rules('tracklist', args.rules)
+        get_rules('candidates', args.rules)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Could not load rules: {e}")
 
     # Parse comment URL
     parsed = urlparse(args.comment_url)
@@ -167,19 +395,14 @@ def main():
         sys.exit("Comment not found.")
 
     # Parse tracklist
-    tracks = sanitize_tracklist(comment_text.splitlines())
+    tracks = sanitize_tracklist(comment_text.splitlines(), tracklist_rules)
     print(f"Parsed {len(tracks)} tracks from comment.")
     if not tracks:
         sys.exit("No valid 'Artist - Title' entries found.")
 
-    # Prepare output and log
+    # Prepare output and run report
     os.makedirs(args.directory, exist_ok=True)
-    log_path = os.path.join(args.directory, 'download_log.txt')
-    # Initialize log file
-    with open(log_path, 'w', encoding='utf-8') as log:
-        log.write("=== Download Log ===\n")
-        log.write(f"Date: {datetime.datetime.now().isoformat()}\n")
-        log.write(f"Source Comment: {args.comment_url}\n\n")
+    report = RunReport(args.directory, args.comment_url, args)
 
     # yt-dlp options
     ydl_opts = {
@@ -191,6 +414,9 @@ def main():
             'preferredquality': '0'
         }]
     }
+    if args.stall_timeout:
+        ydl_opts['socket_timeout'] = args.stall_timeout
+    watchdog = TransferWatchdog.from_args(args)
 
     # Concurrency
     print(f"Starting processing with {args.workers} workers...")
@@ -198,7 +424,7 @@ def main():
     futures = []
     total = len(tracks)
     for idx, tr in enumerate(tracks, start=1):
-        futures.append(executor.submit(process_track, idx, tr, args, ydl_opts, args.directory, log_path, total))
+        futures.append(executor.submit(process_track, idx, tr, args, ydl_opts, args.directory, report, total, watchdog))
 
     # Progress indicator
     if HAVE_TQDM:
@@ -207,11 +433,17 @@ def main():
         for _ in as_completed(futures): pass
 
     executor.shutdown(wait=True)
+    report.close(watchdog=watchdog.stats)
 
     # Summary
     print(f"\nDone. {len(summary['success'])} succeeded, {len(summary['skipped'])} skipped.")
+    print(f"Watchdog: {watchdog.summary()}")
     if summary['skipped']:
-        print("See download_log.txt for details on skipped tracks.")
+        print(f"See {report.path} for details on skipped tracks.")
+
+    if args.analyze:
+        analyze_directory(args.directory, analysis_cache_path(args.directory), tag=True)
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
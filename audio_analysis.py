@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from library_store import hash_file, load_manifest, atomic_write_json, file_lock
+from sldl_utils import MUSIC_EXTS
+
+# Optional: the analysis itself needs NumPy
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+# Optional for ReplayGain/BPM/key tagging
+try:
+    from mutagen import File as MutagenFile
+    from mutagen.easyid3 import EasyID3
+    if 'initialkey' not in EasyID3.valid_keys:
+        EasyID3.RegisterTextKey('initialkey', 'TKEY')
+    HAVE_MUTAGEN = True
+except ImportError:
+    HAVE_MUTAGEN = False
+
+SAMPLE_RATE = 44100
+CHUNK_SECONDS = 10
+SEGMENT_SECONDS = 0.1        # loudness is measured on 100 ms segments, 4 per 400 ms gating block
+STFT_SIZE = 2048             # at SAMPLE_RATE / 2 for tempo and key
+STFT_HOP = 512
+REPLAYGAIN_REFERENCE_LUFS = -18.0
+CACHE_VERSION = 1
+CACHE_NAME = '.analysis_cache.json'
+
+NOTE_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+# Krumhansl-Kessler key profiles
+MAJOR_PROFILE = (6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88)
+MINOR_PROFILE = (6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17)
+
+
+def biquad_response(b, a, freqs, fs):
+    """|H(f)|^2 of a biquad at the given frequencies."""
+    z = np.exp(-1j * 2 * np.pi * freqs / fs)
+    h = (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.abs(h) ** 2
+
+
+def k_weighting_power(freqs, fs):
+    """Power response of the ITU-R BS.1770 K-weighting filter (high shelf + high pass)."""
+    # Stage 1: high shelf, +4 dB above ~1.5 kHz
+    gain_db, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / fs
+    alpha = np.sin(w0) / (2 * q)
+    cw = np.cos(w0)
+    shelf_b = (A * ((A + 1) + (A - 1) * cw + 2 * np.sqrt(A) * alpha),
+               -2 * A * ((A - 1) + (A + 1) * cw),
+               A * ((A + 1) + (A - 1) * cw - 2 * np.sqrt(A) * alpha))
+    shelf_a = ((A + 1) - (A - 1) * cw + 2 * np.sqrt(A) * alpha,
+               2 * ((A - 1) - (A + 1) * cw),
+               (A + 1) - (A - 1) * cw - 2 * np.sqrt(A) * alpha)
+    # Stage 2: high pass at ~38 Hz
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / fs
+    alpha = np.sin(w0) / (2 * q)
+    cw = np.cos(w0)
+    hp_b = ((1 + cw) / 2, -(1 + cw), (1 + cw) / 2)
+    hp_a = (1 + alpha, -2 * cw, 1 - alpha)
+    return biquad_response(shelf_b, shelf_a, freqs, fs) * biquad_response(hp_b, hp_a, freqs, fs)
+
+
+class StreamAnalyzer:
+    """
+    Accumulates loudness, tempo and key features from consecutive blocks of stereo
+    float32 samples, so a track of any length is analysed with flat memory.
+    Only small per-segment / per-frame summaries are kept between blocks.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.fs = sample_rate
+        self.seg_len = int(sample_rate * SEGMENT_SECONDS)
+        self.seg_weight = k_weighting_power(np.fft.rfftfreq(self.seg_len, 1 / sample_rate), sample_rate)
+        self.seg_carry = np.zeros((0, 2), dtype=np.float32)
+        self.segment_energy = []
+        self.peak = 0.0
+
+        # Tempo and key work on a mono signal at half the sample rate
+        self.fs_low = sample_rate / 2
+        self.window = np.hanning(STFT_SIZE).astype(np.float32)
+        self.mono_carry = np.zeros(0, dtype=np.float32)
+        self.prev_logmag = None
+        self.onset_env = []
+        freqs = np.fft.rfftfreq(STFT_SIZE, 1 / self.fs_low)
+        valid = (freqs >= 55) & (freqs <= 2000)
+        pitch_class = np.zeros(len(freqs), dtype=int)
+        pitch_class[valid] = np.round(12 * np.log2(freqs[valid] / 440.0) + 9).astype(int) % 12
+        self.chroma_map = np.zeros((len(freqs), 12), dtype=np.float32)
+        self.chroma_map[np.nonzero(valid)[0], pitch_class[valid]] = 1.0
+        self.chroma = np.zeros(12)
+
+    def feed(self, block):
+        """Add a (n, 2) float32 block of samples."""
+        if not len(block):
+            return
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        self._feed_loudness(block)
+        mono = block.mean(axis=1)
+        self._feed_spectral(mono[: len(mono) // 2 * 2].reshape(-1, 2).mean(axis=1))
+
+    def _feed_loudness(self, block):
+        data = np.concatenate([self.seg_carry, block])
+        n_seg = len(data) // self.seg_len
+        self.seg_carry = data[n_seg * self.seg_len:]
+        if not n_seg:
+            return
+        segs = data[: n_seg * self.seg_len].reshape(n_seg, self.seg_len, 2)
+        # Parseval: mean square of the K-weighted signal from the weighted power spectrum
+        spec = np.abs(np.fft.rfft(segs, axis=1)) ** 2
+        spec[:, 1:-1] *= 2
+        energy = (spec * self.seg_weight[None, :, None]).sum(axis=1) / self.seg_len ** 2
+        self.segment_energy.extend(energy.sum(axis=1).tolist())
+
+    def _feed_spectral(self, mono):
+        data = np.concatenate([self.mono_carry, mono])
+        if len(data) < STFT_SIZE:
+            self.mono_carry = data
+            return
+        n_frames = 1 + (len(data) - STFT_SIZE) // STFT_HOP
+        idx = np.arange(STFT_SIZE)[None, :] + STFT_HOP * np.arange(n_frames)[:, None]
+        mags = np.abs(np.fft.rfft(data[idx] * self.window, axis=1))
+        self.mono_carry = data[n_frames * STFT_HOP:]
+
+        self.chroma += mags.sum(axis=0) @ self.chroma_map
+        logmag = np.log1p(mags)
+        prev = logmag[:1] if self.prev_logmag is None else self.prev_logmag[None, :]
+        flux = np.maximum(np.diff(np.vstack([prev, logmag]), axis=0), 0).sum(axis=1)
+        self.prev_logmag = logmag[-1]
+        self.onset_env.extend(flux.tolist())
+
+    def loudness(self):
+        """Integrated loudness in LUFS with BS.1770 absolute and relative gating."""
+        seg = np.asarray(self.segment_energy)
+        if len(seg) < 4:
+            return None
+        blocks = np.convolve(seg, np.ones(4) / 4, mode='valid')   # 400 ms blocks, 75 % overlap
+        with np.errstate(divide='ignore'):
+            block_lufs = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[block_lufs > -70]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+        with np.errstate(divide='ignore'):
+            gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def bpm(self, low=70, high=180):
+        """Tempo from the autocorrelation of the spectral-flux onset envelope."""
+        env = np.asarray(self.onset_env)
+        if len(env) < 8:
+            return None
+        env = env - env.mean()
+        n = 1 << int(np.ceil(np.log2(2 * len(env))))
+        spectrum = np.fft.rfft(env, n)
+        acf = np.fft.irfft(spectrum * np.conj(spectrum), n)[: len(env)]
+        frame_rate = self.fs_low / STFT_HOP
+        lags = np.arange(len(acf))
+        valid = (lags >= frame_rate * 60 / high) & (lags <= frame_rate * 60 / low)
+        if not valid.any():
+            return None
+        best = lags[valid][np.argmax(acf[valid])]
+        # Parabolic interpolation around the peak for sub-frame precision
+        if 0 < best < len(acf) - 1:
+            y0, y1, y2 = acf[best - 1], acf[best], acf[best + 1]
+            denom = y0 - 2 * y1 + y2
+            best = best + (0.5 * (y0 - y2) / denom if denom else 0)
+        return round(float(60 * frame_rate / best), 1)
+
+    def key(self):
+        """Musical key from the summed chroma vector, correlated with major/minor profiles."""
+        if not self.chroma.any():
+            return None
+        best, best_score = None, -2.0
+        for mode, profile in (('major', MAJOR_PROFILE), ('minor', MINOR_PROFILE)):
+            for tonic in range(12):
+                score = np.corrcoef(self.chroma, np.roll(profile, tonic))[0, 1]
+                if score > best_score:
+                    best, best_score = f"{NOTE_NAMES[tonic]}{'m' if mode == 'minor' else ''}", score
+        return best
+
+    def result(self):
+        lufs = self.loudness()
+        return {
+            'loudness_lufs': None if lufs is None else round(lufs, 2),
+            'replaygain_track_gain': None if lufs is None else round(REPLAYGAIN_REFERENCE_LUFS - lufs, 2),
+            'replaygain_track_peak': round(self.peak, 6),
+            'bpm': self.bpm(),
+            'key': self.key(),
+        }
+
+
+def analyze_file(path, sample_rate=SAMPLE_RATE):
+    """Decode a file with ffmpeg in CHUNK_SECONDS blocks and analyse it."""
+    cmd = ['ffmpeg', '-v', 'error', '-i', path, '-f', 'f32le', '-ac', '2', '-ar', str(sample_rate), '-']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Drain stderr in the background so ffmpeg can never block on a full pipe
+    errors = []
+    drain = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    analyzer = StreamAnalyzer(sample_rate)
+    chunk_bytes = sample_rate * CHUNK_SECONDS * 2 * 4
+    leftover = b''
+    while True:
+        data = proc.stdout.read(chunk_bytes)
+        if not data:
+            break
+        data = leftover + data
+        usable = len(data) // 8 * 8
+        leftover = data[usable:]
+        analyzer.feed(np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, 2))
+    proc.wait()
+    drain.join()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {path}: {b''.join(errors).decode(errors='replace').strip()}")
+    return analyzer.result()
+
+
+def _analyze_job(path, digest):
+    """Process pool entry point."""
+    return path, digest, analyze_file(path)
+
+
+def analysis_cache_path(output_root, store=None):
+    """The cache shared by every mix folder of a download directory, or of a library store."""
+    return os.path.join(store or output_root, CACHE_NAME)
+
+
+def load_cache(cache_path):
+    if not os.path.isfile(cache_path):
+        return {}
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    return cache.get('results', {}) if cache.get('version') == CACHE_VERSION else {}
+
+
+def tag_file(path, result):
+    """Write ReplayGain, BPM and key tags."""
+    audio = MutagenFile(path, easy=True)
+    if audio is None:
+        return
+    if audio.tags is None:
+        audio.add_tags()
+    if result['replaygain_track_gain'] is not None:
+        audio['replaygain_track_gain'] = f"{result['replaygain_track_gain']:+.2f} dB"
+        audio['replaygain_track_peak'] = f"{result['replaygain_track_peak']:.6f}"
+    if result['bpm']:
+        audio['bpm'] = str(int(round(result['bpm'])))
+    if result['key']:
+        audio['initialkey'] = result['key']
+    audio.save()
+
+
+def analyze_directory(root_dir, cache_path=None, workers=None, tag=False):
+    """
+    Analyse every music file in root_dir on a process pool. Results are cached by file
+    content hash (taken from manifest.json when the folder uses a library store). The
+    default cache is the one of the download directory holding root_dir, so files
+    analysed before in any of its mix folders are skipped; the download scripts use the
+    store's cache with --store (see analysis_cache_path).
+    Returns {filename: result}.
+    """
+    if not HAVE_NUMPY:
+        print("[WARN] NumPy is not installed; skipping audio analysis.")
+        return {}
+    cache_path = cache_path or analysis_cache_path(os.path.dirname(os.path.abspath(root_dir)))
+    cache = load_cache(cache_path)
+    manifest = load_manifest(root_dir)
+    files = sorted(f for f in os.listdir(root_dir)
+                   if os.path.splitext(f)[1].lower() in MUSIC_EXTS and os.path.isfile(os.path.join(root_dir, f)))
+
+    results, jobs = {}, []
+    for name in files:
+        digest = manifest.get(name, {}).get('hash')
+        if digest and digest in cache:
+            results[name] = cache[digest]
+        else:
+            jobs.append((os.path.join(root_dir, name), digest))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Files without a manifest hash are hashed in the workers first
+            digests = executor.map(hash_file, [p for p, d in jobs if not d])
+            todo = []
+            for path, digest in jobs:
+                digest = digest or next(digests)
+                if digest in cache:
+                    results[os.path.basename(path)] = cache[digest]
+                else:
+                    todo.append((path, digest))
+            print(f"Analysing {len(todo)} files ({len(files) - len(todo)} cached)...")
+            futures = [executor.submit(_analyze_job, p, d) for p, d in todo]
+            for future in as_completed(futures):
+                try:
+                    path, digest, result = future.result()
+                except Exception as e:
+                    print(f"[FAILED] analysis: {e}")
+                    continue
+                cache[digest] = result
+                results[os.path.basename(path)] = result
+                print(f"[ANALYSED] {os.path.basename(path)}: {result['loudness_lufs']} LUFS, "
+                      f"{result['bpm']} BPM, key {result['key']}")
+
+    if tag and HAVE_MUTAGEN:
+        for name, result in results.items():
+            if name in manifest:
+                # Files linked from the library store are keyed by content; tagging would change it
+                print(f"[SKIP] not tagging store-linked file {name}")
+                continue
+            path = os.path.join(root_dir, name)
+            try:
+                tag_file(path, result)
+            except Exception as e:
+                print(f"[WARN] could not tag {name}: {e}")
+                continue
+            # Tagging changes the content hash; cache the result under the new hash too
+            cache[hash_file(path)] = result
+    # Other runs may have added results to the shared cache meanwhile
+    with file_lock(cache_path + '.lock'):
+        merged = load_cache(cache_path)
+        merged.update(cache)
+        atomic_write_json({'version': CACHE_VERSION, 'results': merged}, cache_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute loudness (ReplayGain), BPM and key for the music files in a folder.")
+    parser.add_argument('directory', help='Folder with downloaded tracks')
+    parser.add_argument('--cache', type=str, default=None, help='Results cache file (default: .analysis_cache.json in the parent of <directory>, shared by its mix folders)')
+    parser.add_argument('--workers', type=int, default=None, help='Analysis processes (default: CPU count)')
+    parser.add_argument('--tag', action='store_true', help='Write ReplayGain/BPM/key tags to the files')
+    args = parser.parse_args()
+    if not os.path.isdir(args.directory):
+        sys.exit(f"Error: '{args.directory}' is not a directory.")
+    results = analyze_directory(args.directory, args.cache, args.workers, args.tag)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark the candidate reject rules over a large synthetic corpus of video titles:
+substring any() (the old check), one word-boundary regex per rule, and the combined RuleSet.
+"""
+import re
+import time
+import random
+import string
+import argparse
+
+from candidate_rules import RuleSet, get_rules, normalize
+
+REJECT_PHRASES = [
+    'live', 'dj set', 'reaction', 'sped up', 'nightcore', 'slowed', 'slowed reverb', '8d audio',
+    'bass boosted', 'karaoke', 'cover', 'piano cover', 'tutorial', 'full album', 'full set',
+    'boiler room', 'live stream', 'livestream', 'concert', 'festival', 'instrumental', 'acapella',
+    'lyrics video', 'mashup', 'megamix', 'teaser', 'preview', 'snippet', 'trailer', 'interview',
+    'documentary', 'podcast', 'radio show', 'guest mix', 'essential mix', 'unboxing', 'review',
+]
+WORDS = [
+    'love', 'night', 'dream', 'alive', 'delivery', 'coverage', 'setting', 'reactor', 'speedup',
+    'original', 'mix', 'remix', 'extended', 'club', 'edit', 'dub', 'vocal', 'deep', 'house',
+    'techno', 'acid', 'trance', 'feat', 'the', 'of', 'in', 'my', 'heart', 'sun', 'sunset',
+    'premiere', 'official', 'audio', 'video', 'hd', 'records', 'music', 'release',
+]
+
+
+def make_corpus(count, rng, hit_rate=0.15):
+    titles = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(4, 10))
+        if rng.random() < hit_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(REJECT_PHRASES))
+        titles.append(' '.join(w.title() if rng.random() < 0.5 else w for w in words))
+    return titles
+
+
+def make_rules(count, rng):
+    rules = list(REJECT_PHRASES)
+    while len(rules) < count:
+        rules.append(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10))))
+    return rules[:count]
+
+
+def rule_regex(rule):
+    """The same matching as RuleSet, as a separate regex for one rule."""
+    if rule.startswith('re:'):
+        return re.compile(rule[3:], re.IGNORECASE)
+    words = [re.escape(w) for w in normalize(rule).split()]
+    return re.compile(r"(?<!\w)" + r"\s+".join(words) + r"(?!\w)", re.IGNORECASE)
+
+
+def bench(name, fn, titles):
+    started = time.perf_counter()
+    hits = [fn(t) for t in titles]
+    elapsed = time.perf_counter() - started
+    print(f"{name:<28} {elapsed:>8.3f}s {len(titles) / elapsed:>12,.0f} titles/s {sum(1 for h in hits if h):>9} rejected")
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark YouTube candidate reject rules.")
+    parser.add_argument('--titles', type=int, default=200000, help='Number of synthetic titles (default: 200000)')
+    parser.add_argument('--rules', type=int, default=500, help='Number of reject rules, padded with random words (default: 500)')
+    parser.add_argument('--rules-file', type=str, default=None, help='Benchmark the [candidates] rules of this file instead')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    titles = make_corpus(args.titles, rng)
+    if args.rules_file:
+        rules = get_rules('candidates', args.rules_file).rules
+    else:
+        rules = make_rules(args.rules, rng)
+    phrases = [normalize(r) for r in rules if not r.startswith('re:')]
+    print(f"{len(titles)} titles, {len(rules)} rules\n")
+
+    substring = bench('substring any()', lambda t: next((p for p in phrases if p in t.lower()), None), titles)
+    per_rule = [(r, rule_regex(r)) for r in rules]
+    bench('regex per rule', lambda t: next((r for r, rx in per_rule if rx.search(t)), None), titles)
+    started = time.perf_counter()
+    ruleset = RuleSet(rules)
+    print(f"{'RuleSet compile':<28} {time.perf_counter() - started:>8.3f}s")
+    combined = bench('RuleSet.match', ruleset.match, titles)
+
+    misfires = [(t, s) for t, s, c in zip(titles, substring, combined) if s and not c]
+    print(f"\n{len(misfires)} titles rejected by substring matching only (inside other words), e.g.:")
+    for title, rule in misfires[:5]:
+        print(f"  {rule!r:>14} in {title!r}")
+
+
+if __name__ == '__main__':
+    main()
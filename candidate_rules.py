@@ -0,0 +1,133 @@
+import os
+import re
+from functools import lru_cache
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'candidate_rules.txt')
+
+# Used when there is no rules file
+DEFAULT_RULES = {
+    'candidates': ['live', 'dj set'],
+    'tracklist': ['intro', 'outro', 'mixout', 'timestamp', 'setlist'],
+}
+
+
+def _trie_regex(node):
+    """Regex for a character trie, so shared prefixes are only matched once."""
+    alts = []
+    for ch in sorted(k for k in node if k):
+        alts.append((r'\s+' if ch == ' ' else re.escape(ch)) + _trie_regex(node[ch]))
+    if not alts:
+        return ''
+    body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+    return f'(?:{body})?' if '' in node else body
+
+
+def normalize(phrase):
+    return ' '.join(phrase.lower().split())
+
+
+def _internal_group(name):
+    """Group names RuleSet uses for itself when it combines the rules."""
+    return name == 'phrase' or re.fullmatch(r'r\d+', name) is not None
+
+
+class RuleSet:
+    """
+    Reject rules compiled into a single case-insensitive regex. Plain phrases match whole
+    words only ("live" does not match "alive") and are merged into one trie; rules
+    starting with 're:' are regular expressions. match() returns the rule that matched.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.phrases = {}
+        self.regexes = {}
+        parts = []
+        for rule in self.rules:
+            if rule.startswith('re:'):
+                group = f"r{len(self.regexes)}"
+                self.regexes[group] = rule
+                parts.append(f"(?P<{group}>{rule[3:]})")
+            elif normalize(rule):
+                self.phrases.setdefault(normalize(rule), rule)
+        if self.phrases:
+            trie = {}
+            for phrase in self.phrases:
+                node = trie
+                for ch in phrase:
+                    node = node.setdefault(ch, {})
+                node[''] = True
+            parts.insert(0, rf"(?<!\w)(?P<phrase>{_trie_regex(trie)})(?!\w)")
+        try:
+            self.regex = re.compile('|'.join(parts), re.IGNORECASE) if parts else None
+        except re.error as e:
+            raise ValueError(f"rules cannot be combined into one regular expression: {e}")
+
+    def match(self, text):
+        """The first rule matching text, or None."""
+        m = self.regex.search(text) if self.regex and text else None
+        if not m:
+            return None
+        if m.lastgroup == 'phrase':
+            return self.phrases[normalize(m.group('phrase'))]
+        return self.regexes[m.lastgroup]
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def parse_rules(lines, source='<rules>'):
+    """
+    Parse a rules file: '[section]' headers, one rule per line, '#' comments.
+    Returns {section: [rules]}. The 're:' rules of a section end up in one regex,
+    so a named group can only be used once per section.
+    """
+    sections = {}
+    groups = {}
+    current = None
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            name = line[1:-1].strip().lower()
+            current = sections.setdefault(name, [])
+            named = groups.setdefault(name, {})
+            continue
+        if current is None:
+            raise ValueError(f"{source}:{lineno}: rule outside of a [section]: {line!r}")
+        if line.startswith('re:'):
+            try:
+                regex = re.compile(line[3:])
+                # As it will sit in the combined regex, where e.g. '(?i)' is no longer at the start
+                re.compile(f"(?:{line[3:]})")
+            except re.error as e:
+                raise ValueError(f"{source}:{lineno}: invalid regular expression {line[3:]!r}: {e}")
+            for group in regex.groupindex:
+                if _internal_group(group):
+                    raise ValueError(f"{source}:{lineno}: group name {group!r} is reserved, use another name")
+                if group in named:
+                    raise ValueError(f"{source}:{lineno}: group name {group!r} is already used on line {named[group]}, "
+                                     f"use each name once per section")
+                named[group] = lineno
+        current.append(line)
+    return sections
+
+
+@lru_cache(maxsize=None)
+def load_rules(path=None):
+    """
+    {section: RuleSet} from a rules file (default: candidate_rules.txt next to the scripts,
+    or the built-in rules if that does not exist). Cached per path.
+    """
+    if path is None and not os.path.isfile(DEFAULT_RULES_PATH):
+        sections = DEFAULT_RULES
+    else:
+        path = path or DEFAULT_RULES_PATH
+        with open(path, 'r', encoding='utf-8') as f:
+            sections = parse_rules(f, path)
+    return {name: RuleSet(rules) for name, rules in sections.items()}
+
+
+def get_rules(section, path=None):
+    return load_rules(path).get(section) or RuleSet([])
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import heapq
+import tempfile
+import itertools
+import threading
+from contextlib import contextmanager
+
+from library_store import atomic_write_json, file_lock
+
+# Optional: tells whether the holder of a shared disk slot is still running (else os.kill / OpenProcess)
+try:
+    import psutil
+    HAVE_PSUTIL = True
+except ImportError:
+    HAVE_PSUTIL = False
+
+# Priority classes, most urgent first
+FINISHING, NORMAL, BACKGROUND = 0, 1, 2
+
+# Bandwidth and disk slot state shared by the runs on this host that set a cap
+STATE_PATH = os.path.join(tempfile.gettempdir(), 'dj2mp3_io.json')
+# Disk slots of a run that sets neither --bandwidth nor --disk-slots, for itself alone
+DISK_SLOTS = 2
+
+
+def mix_priority(done, total):
+    """A mix with at most a quarter (or three tracks) left is finished first."""
+    if total and (done / total >= 0.75 or total - done <= 3):
+        return FINISHING
+    return NORMAL
+
+
+def pid_alive(pid):
+    if HAVE_PSUTIL:
+        return psutil.pid_exists(pid)
+    if os.name == 'nt':
+        return windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def windows_pid_alive(pid):
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: it exists, but is not ours
+    try:
+        code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == 259  # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class LocalState:
+    """Scheduler state of this process only."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def update(self):
+        with self.lock:
+            yield self.data
+
+
+class SharedState:
+    """
+    Scheduler state in a JSON file at path, read and rewritten under a lock file so that
+    every process using the same path shares one bandwidth cap and one set of disk slots.
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.thread_lock = threading.Lock()
+
+    @contextmanager
+    def update(self):
+        """The state to read and change; written back only if it was changed."""
+        with self.thread_lock, file_lock(self.lock_path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+                data, before = json.loads(text), json.loads(text)
+            except (OSError, ValueError):
+                data, before = {}, None
+            yield data
+            if data != before:
+                atomic_write_json(data, self.path)
+
+
+class TokenBucket:
+    """
+    Bandwidth cap of rate bytes/s with bursts up to burst bytes. Callers take tokens for
+    what they have just transferred (possibly running into debt) and wait off the debt.
+    With a SharedState the tokens are shared with the other processes using it; bytes
+    are then taken in batches of up to SYNC_SECONDS of traffic (or time) at a time.
+    """
+
+    SYNC_SECONDS = 0.1
+
+    def __init__(self, rate, burst=None, state=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.state = state or LocalState()
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced = 0.0
+
+    def reserve(self, nbytes, priority=NORMAL):
+        """Take nbytes tokens; returns the seconds the caller should pause before continuing."""
+        now = time.time()
+        if isinstance(self.state, SharedState):
+            with self.lock:
+                self.unsynced += nbytes
+                if self.unsynced < self.rate * self.SYNC_SECONDS and now - self.synced < self.SYNC_SECONDS:
+                    return 0.0
+                nbytes, self.unsynced, self.synced = self.unsynced, 0, now
+        with self.state.update() as data:
+            bucket = data.setdefault('bucket', {'tokens': self.capacity, 'updated': now})
+            # The clock can go back; never refill for negative time
+            elapsed = max(0.0, now - bucket['updated'])
+            tokens = min(self.capacity, bucket['tokens'] + elapsed * self.rate) - nbytes
+            bucket.update(tokens=tokens, updated=now)
+            # priority -> last time it took tokens (JSON keys are strings)
+            active = {p: seen for p, seen in bucket.get('active', {}).items() if now - seen < 2}
+            active[str(priority)] = now
+            bucket['active'] = active
+        wait = max(0.0, -tokens / self.rate)
+        # Lower classes back off longer while more urgent traffic is flowing, leaving it the refill
+        urgent = min(int(p) for p in active)
+        return wait * 2 ** (priority - urgent)
+
+
+class PrioritySemaphore:
+    """Semaphore that lets waiters in by priority (lower first), FIFO within a priority."""
+
+    def __init__(self, slots):
+        self.free = slots
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.seq = itertools.count()
+
+    def acquire(self, priority=NORMAL):
+        with self.cond:
+            ticket = (priority, next(self.seq))
+            heapq.heappush(self.waiting, ticket)
+            while self.waiting[0] != ticket or not self.free:
+                self.cond.wait()
+            heapq.heappop(self.waiting)
+            self.free -= 1
+            self.cond.notify_all()
+
+    def release(self):
+        with self.cond:
+            self.free += 1
+            self.cond.notify_all()
+
+
+class SharedSemaphore:
+    """
+    PrioritySemaphore across the processes of a SharedState. Waiters queue a ticket in the
+    state and poll it, less often the longer they wait (up to MAX_POLL seconds); the first
+    ticket in priority order takes a free slot. Slots and tickets of processes that are
+    gone are dropped.
+    """
+
+    POLL = 0.05
+    MAX_POLL = 1.0
+
+    def __init__(self, slots, state):
+        self.slots = slots
+        self.state = state
+
+    @staticmethod
+    def _disk(data):
+        disk = data.setdefault('disk', {'seq': 0, 'held': {}, 'waiting': []})
+        disk['held'] = {pid: n for pid, n in disk['held'].items() if n > 0 and pid_alive(int(pid))}
+        disk['waiting'] = [ticket for ticket in disk['waiting'] if pid_alive(ticket[2])]
+        return disk
+
+    def acquire(self, priority=NORMAL):
+        pid = os.getpid()
+        with self.state.update() as data:
+            disk = self._disk(data)
+            disk['seq'] += 1
+            ticket = [priority, disk['seq'], pid]
+            disk['waiting'].append(ticket)
+        poll = self.POLL
+        try:
+            while True:
+                with self.state.update() as data:
+                    disk = self._disk(data)
+                    if ticket not in disk['waiting']:  # state file removed in the meantime
+                        disk['waiting'].append(ticket)
+                    if min(disk['waiting']) == ticket and sum(disk['held'].values()) < self.slots:
+                        disk['waiting'].remove(ticket)
+                        disk['held'][str(pid)] = disk['held'].get(str(pid), 0) + 1
+                        return
+                time.sleep(poll)
+                poll = min(poll * 1.5, self.MAX_POLL)
+        except BaseException:
+            with self.state.update() as data:
+                waiting = self._disk(data)['waiting']
+                if ticket in waiting:
+                    waiting.remove(ticket)
+            raise
+
+    def release(self):
+        pid = str(os.getpid())
+        with self.state.update() as data:
+            held = self._disk(data)['held']
+            if held.get(pid, 0) > 1:
+                held[pid] -= 1
+            else:
+                held.pop(pid, None)
+
+
+class IOScheduler:
+    """
+    Shaping of downloads and disk-heavy work (transcodes, flattening into the store): a
+    total bandwidth cap and a limited number of concurrent disk operations, both served
+    in priority order. With a state_path they are shared by every process using that
+    path, else they apply to this process only.
+    """
+
+    def __init__(self, bandwidth=None, disk_slots=None, state_path=None):
+        state = SharedState(state_path) if state_path else None
+        self.bucket = TokenBucket(bandwidth, state=state) if bandwidth else None
+        if not disk_slots:
+            self.disk_slots = None
+        elif state:
+            self.disk_slots = SharedSemaphore(disk_slots, state)
+        else:
+            self.disk_slots = PrioritySemaphore(disk_slots)
+
+    def throttle(self, nbytes, priority=NORMAL):
+        """Account nbytes of download traffic; returns the seconds to pause (0 without a cap)."""
+        return self.bucket.reserve(nbytes, priority) if self.bucket and nbytes > 0 else 0.0
+
+    def wait(self, nbytes, priority=NORMAL):
+        delay = self.throttle(nbytes, priority)
+        if delay:
+            time.sleep(delay)
+
+    @contextmanager
+    def disk(self, priority=NORMAL):
+        """Hold one of the disk slots for the duration of the block."""
+        if not self.disk_slots:
+            yield
+            return
+        self.disk_slots.acquire(priority)
+        try:
+            yield
+        finally:
+            self.disk_slots.release()
+
+
+_scheduler = IOScheduler()
+
+
+def configure(args):
+    """
+    Set up the scheduler from --bandwidth and --disk-slots. A run that sets either shares
+    the cap and the slots with the other such runs on this host; one that sets neither
+    keeps DISK_SLOTS slots to itself and does not touch the shared state.
+    """
+    global _scheduler
+    from sldl_utils import parse_size
+    bandwidth = parse_size(args.bandwidth) if getattr(args, 'bandwidth', None) else None
+    disk_slots = getattr(args, 'disk_slots', None)
+    _scheduler = IOScheduler(bandwidth, disk_slots or DISK_SLOTS,
+                             STATE_PATH if bandwidth or disk_slots else None)
+    return _scheduler
+
+
+def get_scheduler():
+    return _scheduler
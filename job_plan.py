@@ -0,0 +1,216 @@
+import os
+import re
+import sys
+import glob
+from contextlib import closing
+from collections import Counter, defaultdict
+
+from sldl_utils import track_key, read_sldl_index, list_music_files
+from query_planner import query_variants
+from library_store import LibraryStore
+from run_report import REPORTS_DIR, iter_report_files, iter_records
+
+SOURCE_NAMES = {'soulseek': 'Soulseek', 'youtube': 'YouTube'}
+# DJ2MP3_youtube.py names its files '<index> - <track>.mp3'
+INDEX_PREFIX_RE = re.compile(r"^\d+\s*-\s*")
+
+
+def read_tracklist(path):
+    """Tracks of a tracklist.txt written by an earlier run ('"Artist Title"' per line)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [t for t in (re.sub(r'\s+', ' ', line.strip().strip('"').strip()) for line in f) if t]
+
+
+def find_cached_run(directory, source):
+    """
+    (output folder, tracks) of the latest run report under directory for source (a URL or
+    tracklist file), or (None, []). Tracks come from the tracklist.txt that run left in
+    its folder, or else from its track records.
+    """
+    latest, tracks = None, []
+    for path in iter_report_files([directory]):
+        # Every report file holds one run, header first
+        with closing(iter_records([path])) as records:
+            run = next(records, {})
+            if run.get('type') != 'run' or run.get('source') != source:
+                continue
+            if latest and (latest.get('started_at') or '') > (run.get('started_at') or ''):
+                continue
+            latest = run
+            tracks = [r['track'] for r in records if r.get('type') == 'track']
+    if not latest:
+        return None, []
+    tracklist_path = os.path.join(latest['output'], 'tracklist.txt')
+    if os.path.isfile(tracklist_path):
+        return latest['output'], read_tracklist(tracklist_path)
+    return latest['output'], list(dict.fromkeys(tracks))
+
+
+def load_history(paths):
+    """
+    Per-source totals of the track records in earlier run reports: tracks, downloaded,
+    bytes and seconds, plus 'round<N>' counts of Soulseek tracks found in query round N.
+    """
+    history = defaultdict(Counter)
+    for record in iter_records(paths):
+        if record.get('type') != 'track':
+            continue
+        stats = history[record.get('source') or '-']
+        stats['tracks'] += 1
+        stats['seconds'] += sum((record.get('stages') or {}).values())
+        if record.get('status') == 'downloaded':
+            stats['downloaded'] += 1
+            stats['bytes'] += record.get('bytes') or 0
+            rnd = (record.get('candidate') or {}).get('round')
+            if rnd:
+                stats[f"round{rnd}"] += 1
+    return history
+
+
+def reported_downloads(output_root, names):
+    """
+    Keys of the tracks that run reports record as downloaded into output_root, to a file
+    that is still among names. Reports sit in output_root or, for DJ2MP3_youtube.py, its parent.
+    """
+    output_root = os.path.abspath(output_root)
+    report_dirs = [os.path.join(d, REPORTS_DIR) for d in (output_root, os.path.dirname(output_root))]
+    keys = set()
+    for record in iter_records([d for d in report_dirs if os.path.isdir(d)]):
+        path = record.get('path')
+        if record.get('type') != 'track' or record.get('status') != 'downloaded' or not path:
+            continue
+        # Paths were written relative to the working directory of that run, so compare names only
+        folder, name = os.path.split(os.path.normpath(path))
+        if os.path.basename(folder) == os.path.basename(output_root) and name in names:
+            keys.add(track_key(record['track']))
+    return keys
+
+
+def plan_mix(tracks, output_root, args, variants=True):
+    """
+    Split tracks into those already in output_root (or marked downloaded in one of its
+    _index.sldl files, which sldl skips) and those that would be searched; counts the
+    Soulseek queries the query planner would issue for the latter at most.
+    Soulseek files keep the peer's file name, so a track counts as present when a run
+    report or an _index.sldl row links it to a file in the folder (the store manifest
+    with a store), or when a file is named after the track (YouTube downloads).
+    """
+    store = LibraryStore(args.store) if getattr(args, 'store', None) else None
+    names = list_music_files(output_root, store) if os.path.isdir(output_root) else set()
+    keys = reported_downloads(output_root, names) if names else set()
+    for name in names:
+        stem = os.path.splitext(name)[0]
+        keys.update((track_key(stem), track_key(INDEX_PREFIX_RE.sub('', stem))))
+    index = {}
+    for index_path in glob.glob(os.path.join(glob.escape(output_root), '*', '_index.sldl')):
+        for key, row in read_sldl_index(index_path).items():
+            if index.get(key, {}).get('state') != '1':
+                index[key] = row
+            # './<name>' of a download that was flattened into output_root
+            if row.get('state') == '1' and os.path.basename(row.get('filepath') or '') in names:
+                keys.add(key)
+
+    plan = {'output': output_root, 'tracks': len(tracks), 'present': 0, 'indexed': 0,
+            'pending': [], 'failed_before': 0, 'queries': []}
+    for track in tracks:
+        queries = query_variants(track, getattr(args, 'max_variants', None)) if variants else [track]
+        qkeys = [track_key(q) for q in queries]
+        if track_key(track) in keys or any(k in keys for k in qkeys):
+            plan['present'] += 1
+        elif any(index.get(k, {}).get('state') == '1' for k in qkeys):
+            plan['indexed'] += 1
+        else:
+            plan['pending'].append(track)
+            plan['queries'].append(len(queries) or 1)
+            if any(k in index for k in qkeys):
+                plan['failed_before'] += 1
+    return plan
+
+
+def success_rate(stats):
+    return stats['downloaded'] / stats['tracks'] if stats['tracks'] else None
+
+
+def expected_searches(query_counts, stats):
+    """Expected Soulseek queries: round N is only searched by tracks not found in earlier rounds."""
+    if not stats['tracks']:
+        return None
+    total = 0.0
+    for count in query_counts:
+        left = 1.0
+        for rnd in range(1, count + 1):
+            total += left
+            left -= stats[f"round{rnd}"] / stats['tracks']
+            if left <= 0:
+                break
+    return total
+
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    if seconds < 90 * 60:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def print_plan(title, plan, history, sources=('soulseek',), workers=1):
+    """
+    Print the projected work of a plan_mix() plan. sources are tried in order for the tracks
+    still missing; volume and time come from the history of earlier runs (load_history).
+    Without sources only the state of the folder is shown.
+    """
+    def line(label, value):
+        print(f"  {label + ':':<22}{value}")
+
+    pending = len(plan['pending'])
+    print(f"\nPlan for {title}")
+    line('Output folder', plan['output'])
+    line('Tracks', plan['tracks'])
+    line('Already in folder', plan['present'])
+    if plan['indexed']:
+        line('Done in _index.sldl', f"{plan['indexed']} (sldl skips them)")
+    line('To search' if sources else 'Missing',
+         pending if not plan['failed_before'] else f"{pending} ({plan['failed_before']} not found in earlier runs)")
+    if not pending or not sources:
+        return
+
+    remaining = float(pending)
+    found = volume = seconds = 0.0
+    missing = []
+    for source in sources:
+        stats = history.get(source, Counter())
+        if source == 'soulseek' and remaining == pending:
+            most = sum(plan['queries'])
+            expected = expected_searches(plan['queries'], stats)
+            line('Soulseek searches', (f"{pending}-{most}" if most > pending else str(pending))
+                 + (f", ~{expected:.0f} expected" if expected and most > pending else ''))
+        else:
+            line(f"{SOURCE_NAMES.get(source, source)} searches", f"~{remaining:.0f}" if remaining < pending else pending)
+        rate = success_rate(stats)
+        if rate is None:
+            missing.append(source)
+            continue
+        hits = remaining * rate
+        found += hits
+        volume += hits * stats['bytes'] / max(stats['downloaded'], 1)
+        seconds += remaining * stats['seconds'] / stats['tracks'] / (workers if source == 'youtube' else 1)
+        remaining -= hits
+
+    if len(missing) == len(sources):
+        line('Estimates', 'none yet, no earlier run reports for ' + ' or '.join(sources))
+        return
+    used = ', '.join(f"{history[s]['tracks']} {s} tracks" for s in sources if s not in missing)
+    line('Estimated download', f"~{volume / 1024 ** 2:.0f} MiB (~{found:.0f} tracks found)")
+    line('Estimated time', f"~{format_duration(seconds)} (from {used} in earlier runs)")
+    if missing:
+        line('Not estimated', f"{', '.join(missing)} (no earlier runs)")
+
+
+def plan_cached_source(directory, source, args, sources=('soulseek',), workers=1, variants=True):
+    """--plan for a URL source: uses the tracklist of the latest earlier run, never the network."""
+    output_root, tracks = find_cached_run(directory, source)
+    if not tracks:
+        sys.exit(f"No cached tracklist for {source} under {directory}; --plan does not fetch it.")
+    print_plan(os.path.basename(output_root) or output_root, plan_mix(tracks, output_root, args, variants),
+               load_history([directory]), sources, workers)
@@ -0,0 +1,236 @@
+import hmac
+import json
+import time
+import sqlite3
+import threading
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    mix TEXT NOT NULL,
+    track TEXT NOT NULL,
+    position INTEGER,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    updated_at REAL,
+    UNIQUE (mix, track)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+# queued -> leased -> downloaded / not_found / failed
+FINAL_STATES = ('downloaded', 'not_found', 'failed')
+TOKEN_HEADER = 'X-Coordinator-Token'
+
+
+class JobQueue:
+    """
+    Track jobs in a SQLite database. Workers lease jobs for lease_seconds and keep them
+    with heartbeats; leases that expire are handed out again, up to max_attempts times.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        if 'position' not in {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN position INTEGER")  # databases from before positions
+        self.lock = threading.Lock()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, mix, tracks, source='soulseek', start=1):
+        """
+        Add tracks of a mix, the first being number start in its tracklist; tracks already
+        queued for that mix are ignored. Returns the number added.
+        """
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO jobs (mix, track, position, source, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(mix, track, position, source, time.time()) for position, track in enumerate(tracks, start)])
+            return self.db.total_changes - before
+
+    def expire_leases(self, now):
+        expired = self.db.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_until < ?", (now, now)).rowcount
+        if expired:
+            print(f"[LEASE] {expired} expired leases back in the queue")
+        self.db.execute(
+            "UPDATE jobs SET status = 'failed', result = ?, updated_at = ? WHERE status = 'queued' AND attempts >= ?",
+            (json.dumps({'reason': f"lease expired {self.max_attempts} times"}), now, self.max_attempts))
+
+    def lease(self, worker, limit, sources):
+        """Lease up to limit queued jobs whose source is in sources to worker."""
+        now = time.time()
+        with self.lock, self.db:
+            self.expire_leases(now)
+            marks = ','.join('?' * len(sources))
+            rows = self.db.execute(
+                f"SELECT id, mix, track, source, attempts, position FROM jobs WHERE status = 'queued' AND source IN ({marks}) "
+                "ORDER BY id LIMIT ?", (*sources, limit)).fetchall()
+            self.db.executemany(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?", [(worker, now + self.lease_seconds, now, row[0]) for row in rows])
+        return [{'id': r[0], 'mix': r[1], 'track': r[2], 'source': r[3], 'attempt': r[4] + 1,
+                 'position': r[5] or r[0]} for r in rows]
+
+    def heartbeat(self, worker, ids):
+        """Extend the leases worker still holds. Returns the ids it has lost."""
+        now = time.time()
+        with self.lock, self.db:
+            held = []
+            for job_id in ids:
+                if self.db.execute(
+                        "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                        (now + self.lease_seconds, now, job_id, worker)).rowcount:
+                    held.append(job_id)
+        return [job_id for job_id in ids if job_id not in held]
+
+    def complete(self, worker, job_id, status, result):
+        """Store a job result. The first result wins; returns False if the job was already finished."""
+        if status not in FINAL_STATES:
+            raise ValueError(f"Invalid job status: {status!r}")
+        with self.lock, self.db:
+            return bool(self.db.execute(
+                f"UPDATE jobs SET status = ?, worker = ?, result = ?, updated_at = ? "
+                f"WHERE id = ? AND status NOT IN ({','.join('?' * len(FINAL_STATES))})",
+                (status, worker, json.dumps(result), time.time(), job_id, *FINAL_STATES)).rowcount)
+
+    def handoff(self, worker, job_id, source, result):
+        """
+        Queue a job worker holds again as a job for source (an 'auto' job Soulseek missed
+        goes to the YouTube workers), with a fresh set of attempts. Returns False if the
+        job was no longer leased by worker.
+        """
+        with self.lock, self.db:
+            return bool(self.db.execute(
+                "UPDATE jobs SET source = ?, status = 'queued', worker = NULL, lease_until = NULL, attempts = 0, "
+                "result = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (source, json.dumps(result), time.time(), job_id, worker)).rowcount)
+
+    def status(self):
+        with self.lock:
+            counts = self.db.execute(
+                "SELECT mix, status, COUNT(*) FROM jobs GROUP BY mix, status ORDER BY mix").fetchall()
+            workers = self.db.execute(
+                "SELECT worker, COUNT(*) FROM jobs WHERE status = 'leased' GROUP BY worker").fetchall()
+        mixes = {}
+        for mix, status, count in counts:
+            mixes.setdefault(mix, {})[status] = count
+        return {'mixes': mixes, 'workers': dict(workers)}
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """
+    JSON API for a JobQueue: POST /enqueue, /lease, /heartbeat, /complete, /handoff and GET /status.
+    With a token, every request must carry it in the X-Coordinator-Token header.
+    """
+
+    queue = None
+    token = None
+
+    def authorized(self):
+        if not self.token or hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.token):
+            return True
+        self.send_json({'error': 'missing or wrong coordinator token'}, 401)
+        return False
+
+    def send_json(self, data, code=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == '/status':
+            self.send_json(self.queue.status())
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/enqueue':
+                data = {'added': self.queue.enqueue(req['mix'], req['tracks'], req.get('source', 'soulseek'),
+                                                    int(req.get('start', 1)))}
+            elif self.path == '/lease':
+                data = {'jobs': self.queue.lease(req['worker'], int(req.get('limit', 10)), req['sources'])}
+            elif self.path == '/heartbeat':
+                data = {'lost': self.queue.heartbeat(req['worker'], req['ids'])}
+            elif self.path == '/complete':
+                data = {'accepted': self.queue.complete(req['worker'], req['id'], req['status'], req.get('result'))}
+            elif self.path == '/handoff':
+                data = {'accepted': self.queue.handoff(req['worker'], req['id'], req['source'], req.get('result'))}
+            else:
+                return self.send_json({'error': 'not found'}, 404)
+        except (KeyError, TypeError, ValueError) as e:
+            return self.send_json({'error': str(e)}, 400)
+        self.send_json(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(queue, host, port, token=None):
+    handler = type('Handler', (CoordinatorHandler,), {'queue': queue, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Coordinator listening on http://{host}:{server.server_address[1]} "
+          f"(lease {queue.lease_seconds}s, {queue.max_attempts} attempts{', token required' if token else ''})", flush=True)
+    server.serve_forever()
+
+
+class CoordinatorClient:
+    """Talks to a coordinator; retries while it is unreachable (e.g. restarting)."""
+
+    def __init__(self, url, retries=5, timeout=30, token=None):
+        self.url = url.rstrip('/')
+        self.retries = retries
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers[TOKEN_HEADER] = token
+
+    def call(self, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        for attempt in range(self.retries):
+            req = urllib.request.Request(self.url + path, data=data, headers=self.headers)
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    return json.loads(resp.read())
+            except urllib.error.HTTPError as e:
+                raise RuntimeError(f"Coordinator error on {path}: {e.read().decode('utf-8', 'replace')}")
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+                if attempt == self.retries - 1:
+                    raise RuntimeError(f"Coordinator {self.url} unreachable: {e}")
+                time.sleep(2 ** attempt)
+
+    def enqueue(self, mix, tracks, source, start=1):
+        return self.call('/enqueue', {'mix': mix, 'tracks': tracks, 'source': source, 'start': start})['added']
+
+    def lease(self, worker, limit, sources):
+        return self.call('/lease', {'worker': worker, 'limit': limit, 'sources': sources})['jobs']
+
+    def heartbeat(self, worker, ids):
+        return self.call('/heartbeat', {'worker': worker, 'ids': ids})['lost']
+
+    def complete(self, worker, job_id, status, result):
+        return self.call('/complete', {'worker': worker, 'id': job_id, 'status': status, 'result': result})['accepted']
+
+    def handoff(self, worker, job_id, source, result):
+        return self.call('/handoff', {'worker': worker, 'id': job_id, 'source': source, 'result': result})['accepted']
+
+    def status(self):
+        return self.call('/status')
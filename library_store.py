@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """sha256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def atomic_write_json(data, path):
+    """Write JSON next to path under a temporary name, then rename it into place."""
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path (created if missing), held across processes on this host."""
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after 10s
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def load_manifest(mix_dir):
+    """Return {filename: {'hash', 'size', 'object'}} for a mix directory (empty if none yet)."""
+    path = os.path.join(mix_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('files', {})
+
+
+def save_manifest(mix_dir, files):
+    atomic_write_json({'files': files}, os.path.join(mix_dir, MANIFEST_NAME))
+
+
+class LibraryStore:
+    """
+    Content-addressed file store. Every file is kept once under objects/<aa>/<sha256><ext>;
+    mix directories only hold hardlinks (or symlinks across filesystems) into the store
+    plus a manifest.json describing them.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+
+    def object_path(self, digest, ext):
+        return os.path.join(self.root, 'objects', digest[:2], f"{digest}{ext.lower()}")
+
+    def ingest(self, path):
+        """
+        Move a file into the store (or drop it if the content is already there).
+        Returns (digest, object_path).
+        """
+        digest = hash_file(path)
+        obj = self.object_path(digest, os.path.splitext(path)[1])
+        if os.path.exists(obj):
+            os.remove(path)
+            return digest, obj
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(obj))
+        os.close(fd)
+        try:
+            try:
+                os.replace(path, tmp_path)
+            except OSError:
+                # Different filesystem: copy, then drop the original
+                shutil.copy2(path, tmp_path)
+                os.remove(path)
+            os.replace(tmp_path, obj)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, obj
+
+    def link(self, obj, target):
+        """Atomically place a hardlink (or symlink) to obj at target."""
+        tmp_path = os.path.join(os.path.dirname(target), f".tmp-{os.getpid()}-{os.path.basename(target)}")
+        try:
+            os.link(obj, tmp_path)
+        except OSError:
+            os.symlink(obj, tmp_path)
+        os.replace(tmp_path, target)
+
+    def adopt(self, path, target, files):
+        """Ingest path, link it at target and record it in the manifest dict files."""
+        digest, obj = self.ingest(path)
+        self.link(obj, target)
+        files[os.path.basename(target)] = {
+            'hash': digest,
+            'size': os.path.getsize(obj),
+            'object': os.path.relpath(obj, self.root),
+        }
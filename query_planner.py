@@ -0,0 +1,232 @@
+import os
+import re
+import time
+
+from sldl_utils import (
+    parse_size, track_key, sldl_index_path, read_sldl_index, run_sldl,
+    flatten_directory, list_music_files, MUSIC_EXTS, SLDL_FAILURE_REASONS,
+)
+from library_store import LibraryStore, load_manifest, save_manifest
+from io_scheduler import mix_priority
+
+MIX_NAME = r"(?:mix|remix|edit|dub|version|rework|bootleg|vip|remaster(?:ed)?)"
+MIX_SUFFIX_RE = re.compile(r"\s+-\s+([^-]*\b" + MIX_NAME + r")\s*$", re.IGNORECASE)
+# A suffix that is nothing but a mix name, e.g. 'Artist Title - Extended Mix'
+MIX_ONLY_RE = re.compile(r"(?:(?:original|extended|radio|club|dub|vip|instrumental)\s+)*" + MIX_NAME, re.IGNORECASE)
+MIX_WORDS_RE = re.compile(r"\b(?:original|extended|radio|club)\s+(?:mix|edit)\b", re.IGNORECASE)
+DASH_RE = re.compile(r"\s+-\s+")
+FEAT = r"(?:feat\.?|ft\.?|featuring)\s+"
+# The whole credit: a bracketed '(feat. X)', or up to the ' - ' before the title, a closing bracket or the end
+FEAT_RE = re.compile(r"\s*[(\[]" + FEAT + r"[^()\[\]]*[)\]]|\s+" + FEAT + r"[^()\[\]]*?(?=\s+-\s+|\s*[)\]]|\s*$)",
+                     re.IGNORECASE)
+
+
+def mix_only_suffix(query):
+    """The match of a trailing ' - <mix name>' part that holds nothing else, or None."""
+    m = MIX_SUFFIX_RE.search(query)
+    return m if m and MIX_ONLY_RE.fullmatch(m.group(1).strip()) else None
+
+
+def strip_mix_name(query):
+    """
+    Remove bracketed info and mix/edit names. A trailing ' - ... Mix' part is only removed
+    when it cannot be the title: it follows a second ' - ', or is nothing but a mix name.
+    """
+    query = re.sub(r"\(.*?\)|\[.*?\]", " ", query)
+    m = MIX_SUFFIX_RE.search(query)
+    if m and (DASH_RE.search(query[:m.start()]) or mix_only_suffix(query)):
+        query = query[:m.start()]
+    return MIX_WORDS_RE.sub("", query)
+
+
+def strip_feat(query):
+    """Remove 'feat. X' / 'ft. X' / 'featuring X' credits."""
+    return FEAT_RE.sub("", query)
+
+
+def query_variants(track, max_variants=None):
+    """
+    Ranked search queries for a track, most specific first:
+    the track as given, the dash-stripped form, without mix name, without featured artists.
+    Variants of an 'Artist - Title' track always keep a title after the dash.
+    """
+    variants = []
+    suffix = mix_only_suffix(track)
+    has_title = bool(DASH_RE.search(track[:suffix.start()] if suffix else track))
+
+    def add(query, keep_title=False):
+        query = re.sub(r"\s+", " ", query).strip(" -")
+        if keep_title and len(DASH_RE.split(query, 1)) < 2:
+            return
+        if len(query.split()) >= 2 and query.lower() not in (v.lower() for v in variants):
+            variants.append(query)
+
+    add(track)
+    if '-' in track:
+        add(track.replace('-', ' '))
+    no_mix = strip_mix_name(track)
+    add(no_mix, has_title)
+    add(strip_feat(no_mix), has_title)
+    return variants[:max_variants] if max_variants else variants
+
+
+class MixFolder:
+    """
+    The music files of a mix folder, listed once and then updated as each round's sldl
+    output is merged in, so a round only walks its own list folder. With a LibraryStore
+    the manifest is kept in memory and written by save(), and by merge() at most every
+    save_interval seconds.
+    """
+
+    def __init__(self, root, store=None, save_interval=60):
+        self.root = root
+        self.store = store
+        self.manifest = load_manifest(root) if store else None
+        self.files = set(self.manifest) if store else list_music_files(root)
+        self.keys = {track_key(os.path.splitext(f)[0]): f for f in self.files}
+        self.save_interval = save_interval
+        self.saved = time.monotonic()
+
+    def merge(self, source_dir, priority):
+        """Move the music files under source_dir into the folder. Returns {original name: name}."""
+        moved = flatten_directory(self.root, self.store, priority, source_dir, self.manifest)
+        for name in moved.values():
+            self.files.add(name)
+            self.keys.setdefault(track_key(os.path.splitext(name)[0]), name)
+        if self.store and time.monotonic() - self.saved > self.save_interval:
+            self.save()
+        return moved
+
+    def save(self):
+        if self.store:
+            # Keep entries other workers sharing this folder added meanwhile
+            manifest = load_manifest(self.root)
+            manifest.update(self.manifest)
+            save_manifest(self.root, manifest)
+            self.manifest = manifest
+            self.saved = time.monotonic()
+
+
+def enforce_size_limits(root_dir, known_files, min_size, max_size):
+    """
+    Delete newly downloaded music files (anywhere under root_dir, except the known_files
+    already in root_dir) that are outside [min_size, max_size]. Returns the removed names.
+    """
+    removed = set()
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() not in MUSIC_EXTS:
+                continue
+            if dirpath == root_dir and name in known_files:
+                continue
+            path = os.path.join(dirpath, name)
+            size = os.path.getsize(path)
+            if size < min_size or size > max_size:
+                print(f"[REJECT] {name}: {size} bytes outside {min_size}-{max_size}")
+                os.remove(path)
+                removed.add(name)
+    return removed
+
+
+def download_with_query_plan(tracks, output_root, args, soulseek_user, soulseek_pass, list_name='search.txt',
+                             watchdog=None, report=None, folder=None):
+    """
+    Download tracks with sldl in rounds. Round N searches only the tracks still missing,
+    using their N-th ranked query variant, so later variants are only tried after the
+    earlier ones failed. Files outside --min-size/--max-size are rejected and count as misses.
+    With --store, downloads go into the content-addressed store and output_root gets links.
+    With a TransferWatchdog, stalled transfers are requeued and no round starts after the deadline.
+    Downloads and flattening of mixes that are almost done get priority in the IOScheduler.
+    With a RunReport, every track's outcome is recorded; each track is charged its share of
+    the time of the rounds it took part in, since sldl does not report per-track timings.
+    Only each round's list folder is post-processed; callers downloading in batches pass
+    one MixFolder for all of them (and save() it at the end).
+    Returns (not_found_tracks, searches_issued).
+    """
+    own_folder = folder is None
+    if own_folder:
+        folder = MixFolder(output_root, LibraryStore(args.store) if getattr(args, 'store', None) else None)
+    min_size, max_size = parse_size(args.min_size), parse_size(args.max_size)
+    plans = {track: query_variants(track, getattr(args, 'max_variants', None)) for track in tracks}
+    list_path = os.path.join(output_root, list_name)
+    index_path = sldl_index_path(list_path, output_root)
+    # sldl (and the native backend) download into the list folder next to the index
+    list_dir = os.path.dirname(index_path)
+    pending = list(tracks)
+    searches = 0
+    rnd = 0
+    stages = {track: {'soulseek': 0.0, 'postprocess': 0.0} for track in tracks}
+    failures = {}
+    while pending:
+        queries = {}
+        for track in pending:
+            if rnd < len(plans[track]):
+                queries.setdefault(plans[track][rnd], []).append(track)
+        if not queries:
+            break
+        if watchdog and watchdog.expired():
+            print(f"Run deadline reached, {len(pending)} tracks not searched further")
+            watchdog.skipped(len(pending))
+            for track in pending:
+                failures[track] = 'run deadline reached'
+            break
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for query in queries:
+                f.write(f'"{query}"\n')
+        print(f"Search round {rnd + 1}: {len(queries)} queries")
+
+        priority = mix_priority(len(tracks) - len(pending), len(tracks))
+        started = time.monotonic()
+        run_sldl(list_path, output_root, args, soulseek_user, soulseek_pass, watchdog, priority)
+        sldl_done = time.monotonic()
+        rejected = enforce_size_limits(list_dir, set(), min_size, max_size) if os.path.isdir(list_dir) else set()
+        moved = folder.merge(list_dir, priority) if os.path.isdir(list_dir) else {}
+        index = read_sldl_index(index_path)
+        finished = time.monotonic()
+
+        found = set()
+        round_tracks = sum(len(t) for t in queries.values())
+        for query, query_tracks in queries.items():
+            row = index.get(track_key(query))
+            name = None
+            if row and row.get('state') == '1':
+                name = os.path.basename(row.get('filepath') or '')
+                if name in rejected:
+                    failures.update((t, 'rejected: size outside limits') for t in query_tracks)
+                    name = None
+                elif name in moved:
+                    name = moved[name]
+                elif name not in folder.files:
+                    name = folder.keys.get(track_key(query), name)
+            else:
+                name = folder.keys.get(track_key(query))
+                if row and not name:
+                    reason = SLDL_FAILURE_REASONS.get(row.get('failurereason'), 'not downloaded by sldl')
+                    failures.update((t, reason) for t in query_tracks)
+            for track in query_tracks:
+                stages[track]['soulseek'] += (sldl_done - started) / round_tracks
+                stages[track]['postprocess'] += (finished - sldl_done) / round_tracks
+            if name:
+                found.update(query_tracks)
+                if report:
+                    path = os.path.join(output_root, name)
+                    for track in query_tracks:
+                        report.track(track, 'downloaded', source='soulseek',
+                                     candidate={'query': query, 'file': name, 'round': rnd + 1},
+                                     path=path, bytes=os.path.getsize(path) if os.path.exists(path) else None,
+                                     stages=stages[track])
+        searches += len(queries)
+        pending = [t for t in pending if t not in found]
+        print(f"Search round {rnd + 1}: {len(found)} found, {len(pending)} still missing")
+        rnd += 1
+
+    if report:
+        for track in pending:
+            report.track(track, 'not_found', source='soulseek', stages=stages[track],
+                         reason=failures.get(track, f"not found with {len(plans[track])} queries"),
+                         queries=plans[track])
+    if own_folder:
+        folder.save()
+    if os.path.exists(list_path):
+        os.remove(list_path)
+    return pending, searches
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import datetime
+import threading
+import itertools
+from collections import Counter, defaultdict
+
+REPORTS_DIR = 'reports'
+_report_numbers = itertools.count(1)
+
+
+class RunReport:
+    """
+    Structured report of one run, written as JSON Lines through a buffered file:
+    a 'run' header, one 'track' record per track and an 'end' record with the totals.
+    Safe to use from several worker threads. listener, if given, is called with every track record.
+    Closed by close(), at the end of a with block, or at exit if neither happened.
+    """
+
+    def __init__(self, out_dir, source, args=None, buffer_size=64 * 1024, listener=None):
+        started = datetime.datetime.now()
+        # Several reports can be started by one process within a second (watch mode)
+        self.run_id = f"{started.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_report_numbers)}"
+        report_dir = os.path.join(out_dir, REPORTS_DIR)
+        os.makedirs(report_dir, exist_ok=True)
+        self.path = os.path.join(report_dir, f"run-{self.run_id}.jsonl")
+        self.file = open(self.path, 'w', encoding='utf-8', buffering=buffer_size)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.counts = Counter()
+        self.listener = listener
+        self.write({
+            'type': 'run', 'script': os.path.basename(sys.argv[0]), 'source': source,
+            'output': os.path.abspath(out_dir), 'started_at': started.isoformat(timespec='seconds'),
+            'options': {k: v for k, v in vars(args).items() if not callable(v)} if args else {},
+        })
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        with self.lock:
+            self._write(record)
+
+    def _write(self, record):
+        if not self.file.closed:
+            self.file.write(json.dumps({**record, 'run_id': self.run_id}, ensure_ascii=False) + '\n')
+
+    def track(self, track, status, source=None, candidate=None, path=None, bytes=None,
+              stages=None, reason=None, **extra):
+        """
+        Record the outcome of one track. status is 'downloaded', 'not_found' or 'failed';
+        stages maps stage name to seconds spent.
+        """
+        with self.lock:
+            self.counts[status] += 1
+        record = {
+            'type': 'track', 'track': track, 'status': status, 'source': source,
+            'candidate': candidate, 'path': path, 'bytes': bytes,
+            'stages': {k: round(v, 3) for k, v in (stages or {}).items()}, 'reason': reason, **extra,
+        }
+        self.write(record)
+        if self.listener:
+            self.listener(record)
+
+    def close(self, **totals):
+        """Write the end record (with any extra totals, e.g. watchdog stats) and flush. Only the first call counts."""
+        atexit.unregister(self.close)
+        with self.lock:
+            if self.file.closed:
+                return
+            self._write({
+                'type': 'end', 'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'seconds': round(time.monotonic() - self.start, 3), 'counts': dict(self.counts), **totals,
+            })
+            self.file.close()
+
+
+# --- querying ---
+
+def iter_report_files(paths):
+    """Yield every run-*.jsonl report under the given files/directories."""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in sorted(filenames):
+                if name.startswith('run-') and name.endswith('.jsonl'):
+                    yield os.path.join(dirpath, name)
+
+
+def iter_records(paths):
+    """Stream records from all reports, one line at a time; skips lines cut off by a crash."""
+    for path in iter_report_files(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def group_key(record, run, by):
+    if by == 'source':
+        return record.get('source') or '-'
+    if by == 'script':
+        return run.get('script', '-')
+    if by == 'day':
+        return run.get('started_at', '-')[:10]
+    return run.get('output', '-')
+
+
+def aggregate(paths, by='source'):
+    """
+    Success rate and throughput per group, in a single pass over the reports.
+    Returns ({group: stats}, Counter of failure reasons).
+    """
+    groups = defaultdict(Counter)
+    reasons = Counter()
+    runs = {}
+    for record in iter_records(paths):
+        kind = record.get('type')
+        if kind == 'run':
+            runs[record['run_id']] = {k: record.get(k) for k in ('script', 'started_at', 'output')}
+            continue
+        if kind == 'end':
+            runs.pop(record.get('run_id'), None)
+        if kind != 'track':
+            continue
+        stats = groups[group_key(record, runs.get(record.get('run_id'), {}), by)]
+        stats['tracks'] += 1
+        if record.get('status') == 'downloaded':
+            stats['downloaded'] += 1
+            stats['bytes'] += record.get('bytes') or 0
+            stats['seconds'] += sum((record.get('stages') or {}).values())
+        else:
+            reasons[record.get('reason') or record.get('status')] += 1
+    return groups, reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate DJ2MP3 run reports (success rate, throughput, failure reasons).")
+    parser.add_argument('paths', nargs='+', help='Report files or folders to search for reports/run-*.jsonl')
+    parser.add_argument('--by', choices=['source', 'script', 'day', 'output'], default='source', help='Group results by (default: source)')
+    parser.add_argument('--failures', type=int, default=10, help='Show the N most common failure reasons (default: 10)')
+    args = parser.parse_args()
+
+    groups, reasons = aggregate(args.paths, args.by)
+    if not groups:
+        sys.exit("No run reports found.")
+    print(f"{args.by:<30} {'tracks':>7} {'ok':>7} {'rate':>7} {'MiB':>9} {'MiB/s':>7}")
+    for name, stats in sorted(groups.items()):
+        rate = stats['downloaded'] / stats['tracks'] * 100
+        mib = stats['bytes'] / 1024 ** 2
+        speed = mib / stats['seconds'] if stats['seconds'] else 0
+        print(f"{str(name)[:30]:<30} {stats['tracks']:>7} {stats['downloaded']:>7} {rate:>6.1f}% {mib:>9.1f} {speed:>7.2f}")
+    if reasons and args.failures:
+        print("\nMost common failure reasons:")
+        for reason, count in reasons.most_common(args.failures):
+            print(f"  {count:>6}  {reason}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import os
+import re
+import csv
+import time
+import shutil
+import signal
+import threading
+import subprocess
+
+from io_scheduler import get_scheduler, NORMAL
+from library_store import load_manifest, save_manifest
+from transfer_watchdog import TransferStalled
+
+MUSIC_EXTS = {'.mp3', '.flac', '.wav', '.aac', '.ogg', '.m4a', '.wma', '.alac', '.aiff', '.ape', '.opus', '.wv', '.tta', '.ac3', '.dts', '.amr', '.3gp', '.mid', '.midi', '.mod', '.xm', '.it', '.s3m', '.mp2', '.mp1', '.au', '.ra', '.ram', '.m4b', '.m4p', '.mpga', '.spx', '.oga', '.caf', '.dsf', '.dff', '.tak', '.shn', '.aif', '.aifc', '.snd', '.kar'}
+# sldl writes a transfer to <file>.incomplete and renames it when done
+INCOMPLETE_EXT = '.incomplete'
+# failurereason column of _index.sldl
+SLDL_FAILURE_REASONS = {'1': 'invalid search string', '2': 'out of download retries',
+                        '3': 'no suitable file found', '4': 'all downloads failed'}
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size):
+    """Parse a size like '500K', '100M' or '2G' into bytes."""
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([BKMG]?)B?\s*', str(size), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Invalid size: {size!r}")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def track_key(text):
+    """Loose key used to match sldl's echo of a track back to the tracklist entry."""
+    text = re.sub(r"\s*\[.*?\]\s*$|\s*\(.*?\)\s*$", "", text)
+    return re.sub(r"[\W_]+", "", text).lower()
+
+
+def sldl_index_path(list_path, output_root):
+    """sldl keeps its index in a folder named after the list file inside the output root."""
+    return os.path.join(output_root, os.path.splitext(os.path.basename(list_path))[0], '_index.sldl')
+
+
+def read_sldl_index(index_path):
+    """Return {track_key(query): row} from an sldl _index.sldl file (row['state'] '1' = downloaded)."""
+    rows = {}
+    if not os.path.isfile(index_path):
+        return rows
+    with open(index_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            query = ' '.join(p for p in (row.get('artist'), row.get('title')) if p)
+            rows[track_key(query)] = row
+    return rows
+
+
+def build_sldl_cmd(list_path, output_root, args, soulseek_user, soulseek_pass):
+    sldl_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sldl.exe')
+    cmd = [
+        sldl_path, list_path,
+        '--user', soulseek_user,
+        '--pass', soulseek_pass,
+        '--pref-format', args.pref_format,
+        '--min-bitrate', str(args.min_bitrate),
+        '--input-type', 'list',
+        '-p', output_root
+    ]
+    if getattr(args, 'stall_timeout', 0):
+        # Let sldl itself drop transfers that make no progress at all and try the next candidate
+        cmd += ['--max-stale-time', str(args.stall_timeout * 1000)]
+    return cmd
+
+
+class SldlMonitor(threading.Thread):
+    """
+    Polls the size of sldl's .incomplete files under output_root. Kills the sldl process
+    when one of them stalls (see TransferWatchdog) or the run deadline passes, and pauses
+    it to stay within the IOScheduler bandwidth cap. reason is set when the process was killed.
+    """
+
+    # sldl has no rate limit option, so it is paused with SIGSTOP/SIGCONT. Windows has neither:
+    # there sldl is not paused, but its traffic still counts against the cap of the other downloads
+    CAN_PAUSE = hasattr(signal, 'SIGSTOP')
+    MAX_PAUSE = 10
+
+    def __init__(self, proc, output_root, watchdog=None, priority=NORMAL, interval=2):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.output_root = os.path.abspath(output_root)
+        self.watchdog = watchdog
+        self.priority = priority
+        self.interval = interval
+        self.scheduler = get_scheduler()
+        self.sizes = {}
+        self.reason = None
+
+    def run(self):
+        while self.proc.poll() is None:
+            files = incomplete_files(self.output_root)
+            if self.watchdog:
+                for path, size in files:
+                    try:
+                        self.watchdog.progress(path, size)
+                    except TransferStalled as e:
+                        self.reason = f"{os.path.basename(path)[:-len(INCOMPLETE_EXT)]}: {e}"
+                        break
+                if not self.reason and self.watchdog.expired():
+                    self.reason = "run deadline reached"
+            if self.reason:
+                print(f"[WATCHDOG] Stopping sldl ({self.reason})")
+                self.proc.kill()
+                return
+            self.throttle(files)
+            time.sleep(self.interval)
+
+    def throttle(self, files):
+        """Charge the bytes sldl received since the last poll to the bandwidth cap, pausing it if over."""
+        sizes = dict(files)
+        grown = sum(max(0, size - self.sizes.get(path, 0)) for path, size in sizes.items())
+        self.sizes = sizes
+        delay = min(self.scheduler.throttle(grown, self.priority), self.MAX_PAUSE)
+        if not delay or not self.CAN_PAUSE or self.proc.poll() is not None:
+            return
+        self.proc.send_signal(signal.SIGSTOP)
+        try:
+            time.sleep(delay)
+        finally:
+            self.proc.send_signal(signal.SIGCONT)
+        if self.watchdog:
+            for path in sizes:
+                self.watchdog.extend(delay, path)
+
+    def cleanup(self):
+        """Forget this run's transfers; after a kill, remove the partial files."""
+        for key in (self.watchdog.active() if self.watchdog else []):
+            if isinstance(key, str) and key.startswith(self.output_root):
+                self.watchdog.finish(key)
+        if self.reason:
+            for path, size in incomplete_files(self.output_root):
+                os.remove(path)
+
+
+def incomplete_files(root_dir):
+    """(path, size) of every sldl .incomplete file under root_dir."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for name in filenames:
+            if name.endswith(INCOMPLETE_EXT):
+                path = os.path.join(dirpath, name)
+                try:
+                    found.append((path, os.path.getsize(path)))
+                except OSError:
+                    pass  # renamed by sldl in the meantime
+    return found
+
+
+def read_list_file(list_path):
+    """Queries of an sldl list file ('"query"' per line)."""
+    with open(list_path, 'r', encoding='utf-8') as f:
+        return [line.strip().strip('"') for line in f if line.strip()]
+
+
+def write_list_file(list_path, queries):
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for query in queries:
+            f.write(f'"{query}"\n')
+
+
+def run_sldl(list_path, output_root, args, soulseek_user, soulseek_pass, watchdog=None, priority=NORMAL):
+    """
+    Run sldl.exe on a list file and stream its output. Returns the exit code.
+    With --backend native the in-process Soulseek client is used instead.
+    With a TransferWatchdog, sldl is killed when a transfer stalls and re-run (up to
+    --max-requeues times) on the tracks it had not finished: the stalled ones and those
+    it had not reached yet. Tracks already downloaded or not found are not searched again.
+    Downloads are shaped by the IOScheduler at the given priority.
+    """
+    if getattr(args, 'backend', 'sldl') == 'native':
+        from slsk_client import run_native
+        return run_native(list_path, output_root, args, soulseek_user, soulseek_pass, watchdog, priority)
+    cmd = build_sldl_cmd(list_path, output_root, args, soulseek_user, soulseek_pass)
+    attempts = 1 + (getattr(args, 'max_requeues', 0) if watchdog else 0)
+    index_path = sldl_index_path(list_path, output_root)
+    queries = None
+    finished = {}
+
+    try:
+        for attempt in range(attempts):
+            print(f"Running: {' '.join(cmd)}")
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            monitor = None
+            if watchdog or get_scheduler().bucket:
+                monitor = SldlMonitor(proc, output_root, watchdog, priority)
+                monitor.start()
+            print("\n--- slsk-batchdl output ---")
+            for line in proc.stdout:
+                print(line, end="")
+            proc.wait()
+            print("--- slsk-batchdl finished ---\n")
+            if not monitor:
+                break
+            monitor.join()
+            monitor.cleanup()
+            if not monitor.reason or not watchdog or watchdog.expired() or attempt == attempts - 1:
+                break
+            if queries is None:
+                queries = read_list_file(list_path)
+            finished.update((key, row) for key, row in read_sldl_index(index_path).items()
+                            if row.get('state') in ('1', '2'))
+            remaining = [q for q in queries if track_key(q) not in finished]
+            if not remaining:
+                break
+            watchdog.requeued()
+            print(f"[WATCHDOG] Requeueing the {len(remaining)} of {len(queries)} tracks sldl had not finished")
+            write_list_file(list_path, remaining)
+    finally:
+        if queries is not None:
+            # Restore the full list, and the index rows a re-run on fewer tracks may have dropped
+            write_list_file(list_path, queries)
+            from slsk_client import write_index
+            current = read_sldl_index(index_path)
+            write_index(index_path, [row for key, row in finished.items() if key not in current])
+    return proc.returncode
+
+
+def flatten_directory(root_dir, store=None, priority=NORMAL, source_dir=None, files=None):
+    """
+    Move all music files from subfolders up to root_dir and remove empty subfolders.
+    With source_dir, only the files under that folder (e.g. one sldl list folder) are moved.
+    With a LibraryStore, files are moved into the store instead and root_dir gets a link
+    plus a manifest entry for each of them; pass the manifest dict as files to keep it in
+    memory (it is then not saved). Runs in one of the IOScheduler's disk slots.
+    Returns {original name: name in root_dir} of the files moved.
+    """
+    with get_scheduler().disk(priority):
+        return _flatten_directory(root_dir, store, source_dir or root_dir, files)
+
+
+def _flatten_directory(root_dir, store, source_dir, files):
+    save = store and files is None
+    if save:
+        files = load_manifest(root_dir)
+    moved = {}
+    for dirpath, dirnames, filenames in os.walk(source_dir, topdown=False):
+        for filename in filenames:
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in MUSIC_EXTS:
+                src = os.path.join(dirpath, filename)
+                dst = os.path.join(root_dir, filename)
+                if store and src == dst and filename in files:
+                    continue
+                if src != dst:
+                    # Avoid overwriting files with the same name
+                    base, ext = os.path.splitext(filename)
+                    counter = 1
+                    while os.path.exists(dst) or (store and os.path.basename(dst) in files):
+                        dst = os.path.join(root_dir, f"{base}_{counter}{ext}")
+                        counter += 1
+                try:
+                    if store:
+                        store.adopt(src, dst, files)
+                    elif src != dst:
+                        shutil.move(src, dst)
+                    moved[filename] = os.path.basename(dst)
+                except FileNotFoundError:
+                    pass  # already moved by another worker sharing this folder
+        # Remove empty subfolders
+        if dirpath != root_dir:
+            try:
+                if not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+            except OSError:
+                pass
+    if save:
+        save_manifest(root_dir, files)
+    return moved
+
+
+def list_music_files(root_dir, store=None):
+    """Names of the music files directly inside root_dir (from the manifest when using a store)."""
+    if store:
+        return set(load_manifest(root_dir))
+    return {f for f in os.listdir(root_dir)
+            if os.path.splitext(f)[1].lower() in MUSIC_EXTS and os.path.isfile(os.path.join(root_dir, f))}
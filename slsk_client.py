@@ -0,0 +1,623 @@
+import os
+import csv
+import time
+import zlib
+import struct
+import socket
+import atexit
+import asyncio
+import hashlib
+import tempfile
+import itertools
+import threading
+from collections import namedtuple
+
+from sldl_utils import parse_size, sldl_index_path
+from transfer_watchdog import TransferStalled
+from io_scheduler import get_scheduler, NORMAL
+
+DEFAULT_SERVER = ('server.slsknet.org', 2242)
+CLIENT_VERSION = 160
+CLIENT_MINOR_VERSION = 1
+
+# Server message codes
+LOGIN = 1
+SET_WAIT_PORT = 2
+GET_PEER_ADDRESS = 3
+CONNECT_TO_PEER = 18
+FILE_SEARCH = 26
+SET_STATUS = 28
+SERVER_PING = 32
+SHARED_FOLDERS_FILES = 35
+
+# Peer init codes
+PIERCE_FIREWALL = 0
+PEER_INIT = 1
+
+# Peer message codes
+FILE_SEARCH_RESPONSE = 9
+TRANSFER_REQUEST = 40
+TRANSFER_RESPONSE = 41
+QUEUE_UPLOAD = 43
+UPLOAD_FAILED = 46
+UPLOAD_DENIED = 50
+
+# File attribute codes in search results
+ATTR_BITRATE = 0
+ATTR_DURATION = 1
+
+INDEX_FIELDS = ['filepath', 'artist', 'album', 'title', 'length', 'tracktype', 'state', 'failurereason']
+
+SearchResult = namedtuple('SearchResult', 'username filename size ext bitrate duration free_slot speed queue')
+TransferResult = namedtuple('TransferResult', 'path bytes seconds')
+
+
+class SoulseekError(Exception):
+    pass
+
+
+# --- Wire format ---
+
+def pack_uint32(value):
+    return struct.pack('<I', value)
+
+
+def pack_uint64(value):
+    return struct.pack('<Q', value)
+
+
+def pack_string(text):
+    data = text.encode('utf-8')
+    return pack_uint32(len(data)) + data
+
+
+def pack_message(code, payload=b''):
+    """Server / peer message: uint32 length, uint32 code, payload."""
+    return pack_uint32(len(payload) + 4) + pack_uint32(code) + payload
+
+
+def pack_init_message(code, payload=b''):
+    """Peer init message: uint32 length, uint8 code, payload."""
+    return pack_uint32(len(payload) + 1) + bytes([code]) + payload
+
+
+def unpack_ip(value):
+    return socket.inet_ntoa(struct.pack('>I', value))
+
+
+class MessageReader:
+    """Sequential reader over a message payload."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def uint8(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def uint32(self):
+        value, = struct.unpack_from('<I', self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def uint64(self):
+        value, = struct.unpack_from('<Q', self.data, self.pos)
+        self.pos += 8
+        return value
+
+    def string(self):
+        length = self.uint32()
+        raw = self.data[self.pos:self.pos + length]
+        self.pos += length
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw.decode('latin-1')
+
+
+async def read_message(reader):
+    """Read one length-prefixed message and return its raw body."""
+    length, = struct.unpack('<I', await reader.readexactly(4))
+    return await reader.readexactly(length)
+
+
+def parse_search_response(data):
+    """Decode a (zlib compressed) FileSearchResponse into (token, [SearchResult])."""
+    msg = MessageReader(zlib.decompress(data))
+    username = msg.string()
+    token = msg.uint32()
+    files = []
+    for _ in range(msg.uint32()):
+        msg.uint8()
+        filename = msg.string()
+        size = msg.uint64()
+        ext = msg.string()
+        attrs = {}
+        for _ in range(msg.uint32()):
+            code = msg.uint32()
+            attrs[code] = msg.uint32()
+        files.append((filename, size, ext, attrs))
+    try:
+        free_slot, speed, queue = bool(msg.uint8()), msg.uint32(), msg.uint32()
+    except (IndexError, struct.error):
+        free_slot, speed, queue = False, 0, 0
+    return token, [
+        SearchResult(username, filename, size,
+                     (ext or os.path.splitext(filename)[1].lstrip('.')).lower(),
+                     attrs.get(ATTR_BITRATE), attrs.get(ATTR_DURATION), free_slot, speed, queue)
+        for filename, size, ext, attrs in files
+    ]
+
+
+# --- Client ---
+
+class PeerConnection:
+    """A 'P' (message) connection to one peer, reused for everything sent to that user."""
+
+    def __init__(self, client, username, reader, writer):
+        self.client = client
+        self.username = username
+        self.reader = reader
+        self.writer = writer
+        self.task = client.spawn(self.read_loop())
+
+    def send(self, code, payload=b''):
+        self.writer.write(pack_message(code, payload))
+
+    async def read_loop(self):
+        try:
+            while True:
+                body = await read_message(self.reader)
+                code, = struct.unpack_from('<I', body)
+                self.client.handle_peer_message(self, code, body[4:])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.writer.close()
+            if self.client.peers.get(self.username) is self:
+                del self.client.peers[self.username]
+
+
+def place_file(tmp_path, dest_path):
+    """
+    Move tmp_path to dest_path without replacing an existing file: if the name is taken,
+    dest_path gets a _1, _2, ... suffix as in flatten_directory. Returns the final path.
+    """
+    base, ext = os.path.splitext(dest_path)
+    counter = 0
+    while True:
+        path = f"{base}_{counter}{ext}" if counter else dest_path
+        try:
+            # A hardlink only succeeds if the name is free, so two transfers cannot both claim it
+            os.link(tmp_path, path)
+            os.remove(tmp_path)
+            return path
+        except FileExistsError:
+            counter += 1
+        except OSError:
+            # No hardlinks here: reserve the name with an exclusive create instead
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                counter += 1
+                continue
+            os.replace(tmp_path, path)
+            return path
+
+
+class PendingDownload:
+    def __init__(self, result, dest_path, future, watchdog=None, priority=NORMAL):
+        self.result = result
+        self.dest_path = dest_path
+        self.future = future
+        self.size = result.size
+        self.watchdog = watchdog
+        self.priority = priority
+
+
+class SoulseekClient:
+    """
+    Minimal asyncio Soulseek client: one persistent server connection, reused peer
+    connections and parallel file transfers. Server and listen addresses are
+    configurable, so it can be pointed at a local fake server and peer.
+    """
+
+    def __init__(self, username, password, server=DEFAULT_SERVER, listen_host='0.0.0.0', listen_port=2234,
+                 connect_timeout=10):
+        self.username = username
+        self.password = password
+        self.server = server
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.connect_timeout = connect_timeout
+        self.tokens = itertools.count(int(time.time()) & 0xFFFFFF)
+        self.peers = {}
+        self.searches = {}
+        self.address_requests = {}
+        self.indirect_requests = {}
+        self.downloads = {}         # (username, filename) -> PendingDownload
+        self.transfer_tokens = {}   # transfer token -> PendingDownload
+        self.tasks = set()
+
+    # Connection setup
+
+    async def connect(self):
+        self.server_reader, self.server_writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.server), self.connect_timeout)
+        digest = hashlib.md5((self.username + self.password).encode('utf-8')).hexdigest()
+        self.send_server(LOGIN, pack_string(self.username) + pack_string(self.password) +
+                         pack_uint32(CLIENT_VERSION) + pack_string(digest) + pack_uint32(CLIENT_MINOR_VERSION))
+        body = await asyncio.wait_for(read_message(self.server_reader), self.connect_timeout)
+        msg = MessageReader(body)
+        if msg.uint32() != LOGIN:
+            raise SoulseekError("Unexpected reply to login")
+        if not msg.uint8():
+            raise SoulseekError(f"Login failed: {msg.string()}")
+
+        self.listener = await asyncio.start_server(self.handle_incoming, self.listen_host, self.listen_port)
+        self.listen_port = self.listener.sockets[0].getsockname()[1]
+        self.send_server(SET_WAIT_PORT, pack_uint32(self.listen_port))
+        self.send_server(SHARED_FOLDERS_FILES, pack_uint32(0) + pack_uint32(0))
+        self.send_server(SET_STATUS, pack_uint32(2))
+        self.spawn(self.server_loop())
+        self.spawn(self.ping_loop())
+
+    async def close(self):
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if getattr(self, 'listener', None):
+            self.listener.close()
+        if getattr(self, 'server_writer', None):
+            self.server_writer.close()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def send_server(self, code, payload=b''):
+        self.server_writer.write(pack_message(code, payload))
+
+    async def ping_loop(self):
+        while True:
+            await asyncio.sleep(300)
+            self.send_server(SERVER_PING)
+
+    async def server_loop(self):
+        while True:
+            body = await read_message(self.server_reader)
+            msg = MessageReader(body)
+            code = msg.uint32()
+            if code == GET_PEER_ADDRESS:
+                username, ip, port = msg.string(), unpack_ip(msg.uint32()), msg.uint32()
+                future = self.address_requests.pop(username, None)
+                if future and not future.done():
+                    future.set_result((ip, port))
+            elif code == CONNECT_TO_PEER:
+                username, conn_type = msg.string(), msg.string()
+                ip, port, token = unpack_ip(msg.uint32()), msg.uint32(), msg.uint32()
+                self.spawn(self.pierce_firewall(username, conn_type, ip, port, token))
+
+    # Peer connections
+
+    async def handle_incoming(self, reader, writer):
+        """Accept a connection from a peer: PeerInit ('P' or 'F') or PierceFirewall."""
+        try:
+            msg = MessageReader(await asyncio.wait_for(read_message(reader), self.connect_timeout))
+            code = msg.uint8()
+            if code == PEER_INIT:
+                username, conn_type = msg.string(), msg.string()
+                await self.setup_connection(username, conn_type, reader, writer)
+            elif code == PIERCE_FIREWALL:
+                future = self.indirect_requests.pop(msg.uint32(), None)
+                if future and not future.done():
+                    future.set_result((reader, writer))
+                else:
+                    writer.close()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, OSError):
+            writer.close()
+
+    async def pierce_firewall(self, username, conn_type, ip, port, token):
+        """Answer a server ConnectToPeer: connect to the peer and identify with its token."""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.connect_timeout)
+        except (asyncio.TimeoutError, OSError):
+            return
+        writer.write(pack_init_message(PIERCE_FIREWALL, pack_uint32(token)))
+        await self.setup_connection(username, conn_type, reader, writer)
+
+    async def setup_connection(self, username, conn_type, reader, writer):
+        if conn_type == 'P':
+            self.peers[username] = PeerConnection(self, username, reader, writer)
+        elif conn_type == 'F':
+            await self.receive_file(reader, writer)
+        else:
+            writer.close()
+
+    async def peer_connection(self, username):
+        """Return the open connection to a user, connecting directly or via the server."""
+        peer = self.peers.get(username)
+        if peer and not peer.task.done():
+            return peer
+        loop = asyncio.get_running_loop()
+        future = self.address_requests.get(username)
+        if future is None or future.done():
+            future = self.address_requests[username] = loop.create_future()
+        self.send_server(GET_PEER_ADDRESS, pack_string(username))
+        try:
+            ip, port = await asyncio.wait_for(future, self.connect_timeout)
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.connect_timeout)
+            writer.write(pack_init_message(PEER_INIT, pack_string(self.username) + pack_string('P') + pack_uint32(0)))
+        except (asyncio.TimeoutError, OSError):
+            self.address_requests.pop(username, None)
+            # Direct connection failed: ask the peer to connect to us instead
+            token = next(self.tokens)
+            future = self.indirect_requests[token] = loop.create_future()
+            self.send_server(CONNECT_TO_PEER, pack_uint32(token) + pack_string(username) + pack_string('P'))
+            try:
+                reader, writer = await asyncio.wait_for(future, self.connect_timeout)
+            except asyncio.TimeoutError:
+                self.indirect_requests.pop(token, None)
+                raise SoulseekError(f"Cannot connect to peer {username}")
+        peer = self.peers[username] = PeerConnection(self, username, reader, writer)
+        return peer
+
+    def handle_peer_message(self, peer, code, payload):
+        if code == FILE_SEARCH_RESPONSE:
+            try:
+                token, results = parse_search_response(payload)
+            except (zlib.error, IndexError, struct.error):
+                return
+            if token in self.searches:
+                self.searches[token].extend(results)
+        elif code == TRANSFER_REQUEST:
+            msg = MessageReader(payload)
+            direction, token, filename = msg.uint32(), msg.uint32(), msg.string()
+            pending = self.downloads.get((peer.username, filename))
+            if direction != 1 or not pending:
+                peer.send(TRANSFER_RESPONSE, pack_uint32(token) + bytes([0]) + pack_string('Cancelled'))
+                return
+            pending.size = msg.uint64()
+            self.transfer_tokens[token] = pending
+            peer.send(TRANSFER_RESPONSE, pack_uint32(token) + bytes([1]))
+        elif code in (UPLOAD_FAILED, UPLOAD_DENIED):
+            msg = MessageReader(payload)
+            filename = msg.string()
+            reason = msg.string() if code == UPLOAD_DENIED and msg.pos < len(payload) else 'upload failed'
+            pending = self.downloads.get((peer.username, filename))
+            if pending and not pending.future.done():
+                pending.future.set_exception(SoulseekError(f"{peer.username}: {reason}"))
+
+    # Search and transfer
+
+    async def search(self, query, timeout=8):
+        """Send a search and collect results for `timeout` seconds."""
+        token = next(self.tokens)
+        self.searches[token] = []
+        self.send_server(FILE_SEARCH, pack_uint32(token) + pack_string(query))
+        await asyncio.sleep(timeout)
+        return self.searches.pop(token)
+
+    async def download(self, result, dest_path, timeout=600, watchdog=None, priority=NORMAL):
+        """
+        Queue a file with its owner and wait until it has been received into dest_path, or
+        into dest_path with a _N suffix if that name is taken (TransferResult.path).
+        With a TransferWatchdog the transfer fails with TransferStalled when it stalls.
+        The transfer is shaped by the IOScheduler bandwidth cap at the given priority.
+        """
+        key = (result.username, result.filename)
+        pending = self.downloads[key] = PendingDownload(
+            result, dest_path, asyncio.get_running_loop().create_future(), watchdog, priority)
+        if watchdog and watchdog.time_left() is not None:
+            timeout = min(timeout, watchdog.time_left())
+        try:
+            peer = await self.peer_connection(result.username)
+            peer.send(QUEUE_UPLOAD, pack_string(result.filename))
+            return await asyncio.wait_for(pending.future, timeout)
+        finally:
+            self.downloads.pop(key, None)
+            for token, value in list(self.transfer_tokens.items()):
+                if value is pending:
+                    del self.transfer_tokens[token]
+
+    async def receive_file(self, reader, writer):
+        """'F' connection: read the transfer token, send offset 0, then stream the file to disk."""
+        pending = None
+        try:
+            token, = struct.unpack('<I', await asyncio.wait_for(reader.readexactly(4), self.connect_timeout))
+            pending = self.transfer_tokens.get(token)
+            if not pending:
+                return
+            writer.write(pack_uint64(0))
+            start = time.monotonic()
+            os.makedirs(os.path.dirname(pending.dest_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(pending.dest_path))
+            received = 0
+            watchdog = pending.watchdog
+            # Without new data the watchdog still gets to look at the transfer every stall period
+            read_timeout = (watchdog.stall_seconds or None) if watchdog else None
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    while received < pending.size:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                reader.read(min(1024 * 1024, pending.size - received)), read_timeout)
+                        except asyncio.TimeoutError:
+                            chunk = None
+                        if chunk == b'':
+                            break
+                        if chunk:
+                            f.write(chunk)
+                            received += len(chunk)
+                            delay = get_scheduler().throttle(len(chunk), pending.priority)
+                            if delay:
+                                await asyncio.sleep(delay)
+                                if watchdog:
+                                    watchdog.extend(delay, pending.dest_path)
+                        if watchdog:
+                            watchdog.progress(pending.dest_path, received)
+                if received < pending.size:
+                    raise SoulseekError(f"Transfer incomplete ({received}/{pending.size} bytes)")
+                os.chmod(tmp_path, 0o644)
+                path = place_file(tmp_path, pending.dest_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            if not pending.future.done():
+                pending.future.set_result(TransferResult(path, received, time.monotonic() - start))
+        except Exception as e:
+            if pending and not pending.future.done():
+                pending.future.set_exception(e)
+        finally:
+            if pending and pending.watchdog:
+                pending.watchdog.finish(pending.dest_path)
+            writer.close()
+
+
+# --- sldl-compatible backend ---
+
+def rank_results(results, args):
+    """Filter search results by the user's format/bitrate/size preferences and rank them."""
+    formats = [f.strip().lower() for f in args.pref_format.split(',') if f.strip()]
+    min_size = parse_size(args.min_size)
+    max_size = parse_size(args.max_size)
+    candidates = []
+    for r in results:
+        if formats and r.ext not in formats:
+            continue
+        if r.bitrate and r.bitrate < args.min_bitrate:
+            continue
+        if not min_size <= r.size <= max_size:
+            continue
+        candidates.append(r)
+    candidates.sort(key=lambda r: (formats.index(r.ext) if r.ext in formats else len(formats),
+                                   not r.free_slot, r.queue, -r.speed))
+    return candidates
+
+
+async def fetch_track(client, query, output_dir, args, semaphore, watchdog=None, priority=NORMAL):
+    """
+    Search one query and download the best candidate. A candidate whose transfer stalls
+    is cancelled and the track is requeued on the next one. Returns an _index.sldl row.
+    """
+    async with semaphore:
+        if watchdog and watchdog.expired():
+            watchdog.skipped()
+            print(f"Failed: {query} (run deadline reached)")
+            return {'filepath': '', 'title': query, 'length': -1, 'state': 2, 'failurereason': 0}
+        results = rank_results(await client.search(query, args.search_timeout), args)
+        stalled = False
+        for result in results[:3]:
+            name = result.filename.replace('\\', '/').split('/')[-1]
+            if watchdog and watchdog.expired():
+                break
+            if stalled:
+                watchdog.requeued()
+            try:
+                transfer = await client.download(result, os.path.join(output_dir, name),
+                                                 watchdog=watchdog, priority=priority)
+            except (SoulseekError, TransferStalled, asyncio.TimeoutError, OSError) as e:
+                stalled = isinstance(e, TransferStalled)
+                print(f"Failed: {query} ({result.username}: {e})")
+                continue
+            rate = transfer.bytes / max(transfer.seconds, 1e-6) / 1024
+            print(f"Succeeded: {query} <- {result.username} ({transfer.bytes} bytes in {transfer.seconds:.1f}s, {rate:.0f} KiB/s)")
+            return {'filepath': f"./{os.path.basename(transfer.path)}", 'title': query, 'length': result.duration or -1,
+                    'state': 1, 'failurereason': 0}
+        print(f"Not found: {query}")
+        return {'filepath': '', 'title': query, 'length': -1, 'state': 2, 'failurereason': 3}
+
+
+def write_index(index_path, rows):
+    """Merge rows into an _index.sldl file (keyed by title), written atomically."""
+    merged = {}
+    if os.path.isfile(index_path):
+        with open(index_path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                merged[(row.get('artist'), row.get('title'))] = row
+    for row in rows:
+        row = {field: row.get(field, '') for field in INDEX_FIELDS}
+        row['tracktype'] = row['tracktype'] or 0
+        merged[(row['artist'], row['title'])] = row
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(index_path))
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(merged.values())
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, index_path)
+
+
+class NativeBackend:
+    """
+    Owns a SoulseekClient on a background event loop so the server login is reused
+    by every list run in the process (search rounds, batches, watched sources).
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, soulseek_user, soulseek_pass, server, listen_port):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.client = SoulseekClient(soulseek_user, soulseek_pass, server=server, listen_port=listen_port)
+        self.run(self.client.connect())
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """Log out and stop the loop; get() connects a new backend after this."""
+        atexit.unregister(self.shutdown)
+        with self._lock:
+            if NativeBackend._instance is self:
+                NativeBackend._instance = None
+        if self.loop.is_running():
+            self.run(self.client.close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @classmethod
+    def get(cls, soulseek_user, soulseek_pass, server=DEFAULT_SERVER, listen_port=2234):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(soulseek_user, soulseek_pass, server, listen_port)
+            return cls._instance
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+def parse_server(address):
+    host, _, port = address.rpartition(':')
+    return (host, int(port)) if host else (address, DEFAULT_SERVER[1])
+
+
+def run_native(list_path, output_root, args, soulseek_user, soulseek_pass, watchdog=None, priority=NORMAL):
+    """
+    Drop-in replacement for running sldl on a list file: downloads into the same
+    <output_root>/<list name>/ folder and maintains a compatible _index.sldl.
+    Returns 0 like a successful sldl run.
+    """
+    with open(list_path, 'r', encoding='utf-8') as f:
+        queries = [line.strip().strip('"') for line in f if line.strip()]
+    index_path = sldl_index_path(list_path, output_root)
+    output_dir = os.path.dirname(index_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    backend = NativeBackend.get(soulseek_user, soulseek_pass, server=parse_server(args.slsk_server),
+                                listen_port=args.listen_port)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(args.slsk_concurrency)
+        return await asyncio.gather(*(fetch_track(backend.client, q, output_dir, args, semaphore, watchdog, priority)
+                                      for q in queries))
+
+    print(f"\n--- native Soulseek client: {len(queries)} queries ---")
+    rows = backend.run(run_all())
+    write_index(index_path, rows)
+    print("--- native Soulseek client finished ---\n")
+    return 0
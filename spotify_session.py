@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import spotipy
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from library_store import atomic_write_json, file_lock
+
+# Token cache files sit in the project root like the credential files, one per client id
+CACHE_PREFIX = '.cache-'
+
+
+def token_cache_path(client_id, directory='.'):
+    """'.cache-<hash of client_id>' in directory, so runs with other credentials never pick up its token."""
+    return os.path.join(directory, CACHE_PREFIX + hashlib.sha256(client_id.encode('utf-8')).hexdigest()[:12])
+
+
+class LockedTokenCache(CacheHandler):
+    """spotipy token cache file that concurrent runs read and refresh under a lock file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.thread_lock = threading.Lock()
+
+    @contextmanager
+    def lock(self):
+        with self.thread_lock, file_lock(self.lock_path):
+            yield
+
+    def get_cached_token(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                token_info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return token_info if isinstance(token_info, dict) and 'access_token' in token_info else None
+
+    def save_token_to_cache(self, token_info):
+        atomic_write_json(token_info, self.path)
+
+
+class SharedClientCredentials(SpotifyClientCredentials):
+    """
+    Client credentials flow with one token per host: the token is kept in memory, and
+    refreshed refresh_margin seconds before it expires by whichever run gets the cache
+    lock first; the others wait and pick up the new token from the cache.
+    """
+
+    def __init__(self, client_id, client_secret, cache_handler, refresh_margin=300, **kwargs):
+        super().__init__(client_id=client_id, client_secret=client_secret, cache_handler=cache_handler, **kwargs)
+        self.refresh_margin = refresh_margin
+        self.token_info = None
+
+    def is_token_expired(self, token_info):
+        return token_info.get('expires_at', 0) - time.time() < self.refresh_margin
+
+    def get_access_token(self, as_dict=False, check_cache=True):
+        token_info = self.token_info if check_cache else None
+        if not token_info or self.is_token_expired(token_info):
+            with self.cache_handler.lock():
+                token_info = self.cache_handler.get_cached_token() if check_cache else None
+                if not token_info or self.is_token_expired(token_info):
+                    token_info = self._add_custom_values_to_token_info(self._request_access_token())
+                    self.cache_handler.save_token_to_cache(token_info)
+            self.token_info = token_info
+        return token_info if as_dict else token_info['access_token']
+
+
+def make_session(pool_size=10):
+    """requests session with a connection pool of pool_size and spotipy's retry policy."""
+    session = requests.Session()
+    retry = Retry(total=3, connect=None, read=False, allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                  status=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_spotify(client_id, client_secret, cache_path=None, pool_size=10):
+    """
+    Process-wide Spotify client for these credentials. All API and token requests go
+    through one pooled session; the token is shared with other runs via cache_path
+    (default: token_cache_path(client_id)).
+    """
+    cache_path = cache_path or token_cache_path(client_id)
+    key = (client_id, client_secret, os.path.abspath(cache_path))
+    with _clients_lock:
+        if key not in _clients:
+            session = make_session(pool_size)
+            auth = SharedClientCredentials(client_id, client_secret, LockedTokenCache(cache_path),
+                                           requests_session=session)
+            _clients[key] = spotipy.Spotify(auth_manager=auth, requests_session=session)
+        return _clients[key]
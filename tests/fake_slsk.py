@@ -0,0 +1,146 @@
+"""
+Fake Soulseek server plus one sharing peer, for testing the native client without the
+network. Every query gets two results from the peer ('peer1'): an mp3 and an ogg of
+FakeSoulseek.size bytes. Queries containing 'missing' get no results.
+"""
+import socket
+import asyncio
+import threading
+import zlib
+
+from slsk_client import (
+    pack_message, pack_init_message, pack_string, pack_uint32, pack_uint64, read_message, MessageReader,
+    LOGIN, SET_WAIT_PORT, FILE_SEARCH, GET_PEER_ADDRESS, PEER_INIT,
+    FILE_SEARCH_RESPONSE, TRANSFER_REQUEST, TRANSFER_RESPONSE, QUEUE_UPLOAD,
+)
+
+PEER_NAME = 'peer1'
+LOCALHOST = '127.0.0.1'
+
+
+class FakeSoulseek:
+    """
+    Runs on its own event loop thread; start() returns the server address. name(query)
+    gives the shared file name of a query's results, so tests can make them collide.
+    """
+
+    def __init__(self, size=700 * 1024, name=None):
+        self.size = size
+        self.name = name or (lambda query: query)
+        self.logins = []
+        self.searches = []
+        self.uploads = []
+        self.client_ports = {}
+        self.transfers = {}
+        self.tokens = iter(range(4242, 1 << 31))
+        self.tasks = set()
+        self.loop = asyncio.new_event_loop()
+
+    def start(self):
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True).start()
+        ready.wait()
+        return LOCALHOST, self.server_port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def spawn(self, coro):
+        """Start a task and keep it referenced until it is done, so it is not garbage collected."""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.serve_client, LOCALHOST, 0))
+        peer = self.loop.run_until_complete(asyncio.start_server(self.serve_peer, LOCALHOST, 0))
+        self.server_port = server.sockets[0].getsockname()[1]
+        self.peer_port = peer.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    # Server side
+
+    async def serve_client(self, reader, writer):
+        user = None
+        while True:
+            try:
+                msg = MessageReader(await read_message(reader))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            code = msg.uint32()
+            if code == LOGIN:
+                user = msg.string()
+                self.logins.append(user)
+                writer.write(pack_message(LOGIN, bytes([1]) + pack_string('welcome') + pack_uint32(0)
+                                          + pack_string('hash') + bytes([0])))
+            elif code == SET_WAIT_PORT:
+                self.client_ports[user] = msg.uint32()
+            elif code == FILE_SEARCH:
+                token, query = msg.uint32(), msg.string()
+                self.searches.append(query)
+                if 'missing' not in query:
+                    self.spawn(self.send_results(user, token, query))
+            elif code == GET_PEER_ADDRESS:
+                username = msg.string()
+                ip = int.from_bytes(socket.inet_aton(LOCALHOST), 'big')
+                writer.write(pack_message(GET_PEER_ADDRESS, pack_string(username) + pack_uint32(ip)
+                                          + pack_uint32(self.peer_port)))
+
+    async def send_results(self, user, token, query):
+        """
+        The peer connects to the client and answers the search. Like a real peer it keeps
+        serving that connection, since the client may send its upload requests over it.
+        """
+        reader, writer = await asyncio.open_connection(LOCALHOST, self.client_ports[user])
+        writer.write(pack_init_message(PEER_INIT, pack_string(PEER_NAME) + pack_string('P') + pack_uint32(0)))
+        files = [(f"Music\\{self.name(query)}.mp3", 'mp3', {0: 320, 1: 300}),
+                 (f"Music\\{self.name(query)}.ogg", 'ogg', {0: 320})]
+        payload = pack_string(PEER_NAME) + pack_uint32(token) + pack_uint32(len(files))
+        for filename, ext, attrs in files:
+            payload += bytes([1]) + pack_string(filename) + pack_uint64(self.size) + pack_string(ext)
+            payload += pack_uint32(len(attrs)) + b''.join(pack_uint32(k) + pack_uint32(v) for k, v in attrs.items())
+        payload += bytes([1]) + pack_uint32(1000) + pack_uint32(0)
+        writer.write(pack_message(FILE_SEARCH_RESPONSE, zlib.compress(payload)))
+        await writer.drain()
+        await self.peer_loop(user, reader, writer)
+
+    # Peer side
+
+    async def serve_peer(self, reader, writer):
+        init = MessageReader(await read_message(reader))
+        init.uint8()
+        await self.peer_loop(init.string(), reader, writer)
+
+    async def peer_loop(self, user, reader, writer):
+        """Answer the messages user sends over a 'P' connection."""
+        while True:
+            try:
+                msg = MessageReader(await read_message(reader))
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            code = msg.uint32()
+            if code == QUEUE_UPLOAD:
+                filename = msg.string()
+                self.uploads.append(filename)
+                token = next(self.tokens)
+                self.transfers[token] = user
+                writer.write(pack_message(TRANSFER_REQUEST, pack_uint32(1) + pack_uint32(token)
+                                          + pack_string(filename) + pack_uint64(self.size)))
+            elif code == TRANSFER_RESPONSE:
+                token, allowed = msg.uint32(), msg.uint8()
+                if allowed:
+                    self.spawn(self.send_file(self.client_ports[self.transfers[token]], token))
+
+    async def send_file(self, client_port, token):
+        reader, writer = await asyncio.open_connection(LOCALHOST, client_port)
+        writer.write(pack_init_message(PEER_INIT, pack_string(PEER_NAME) + pack_string('F') + pack_uint32(0)))
+        writer.write(pack_uint32(token))
+        await writer.drain()
+        await reader.readexactly(8)  # offset
+        content = bytes([token % 256]) * self.size
+        for start in range(0, self.size, 64 * 1024):
+            writer.write(content[start:start + 64 * 1024])
+            await writer.drain()
+        writer.close()
@@ -0,0 +1,80 @@
+"""StreamAnalyzer on synthetic signals, and the content-hash cache of analyze_directory."""
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import audio_analysis
+from audio_analysis import StreamAnalyzer, SAMPLE_RATE, CACHE_VERSION, analyze_directory, load_cache
+from library_store import hash_file
+
+SECONDS = 10
+
+
+def analyze(signal, blocks=(12345, SAMPLE_RATE, 7)):
+    """Feed a mono signal as stereo in uneven blocks, so the carries between blocks are exercised."""
+    stereo = np.column_stack([signal, signal]).astype(np.float32)
+    analyzer = StreamAnalyzer()
+    start, n = 0, 0
+    while start < len(stereo):
+        size = blocks[n % len(blocks)]
+        analyzer.feed(stereo[start:start + size])
+        start, n = start + size, n + 1
+    return analyzer
+
+
+def tone(*freqs, amplitude=0.2, seconds=SECONDS):
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    return sum(amplitude * np.sin(2 * np.pi * f * t) for f in freqs)
+
+
+def test_loudness_of_a_sine():
+    # BS.1770: a 997 Hz sine at -20 dBFS in both channels reads -20 LUFS
+    result = analyze(tone(997, amplitude=0.1)).result()
+    assert result['loudness_lufs'] == pytest.approx(-20.0, abs=0.2)
+    assert result['replaygain_track_gain'] == pytest.approx(2.0, abs=0.2)
+    assert result['replaygain_track_peak'] == pytest.approx(0.1, abs=1e-3)
+
+
+def test_silence_has_no_loudness():
+    assert analyze(np.zeros(SAMPLE_RATE * 2)).result()['loudness_lufs'] is None
+
+
+@pytest.mark.parametrize('bpm', [93, 120, 128])
+def test_tempo_of_a_click_track(bpm):
+    rng = np.random.default_rng(0)
+    clicks = np.zeros(SAMPLE_RATE * 20)
+    for beat in np.arange(0, 20, 60 / bpm):
+        start = int(beat * SAMPLE_RATE)
+        clicks[start:start + 200] = rng.uniform(-0.8, 0.8, 200)[: len(clicks) - start]
+    assert analyze(clicks).bpm() == pytest.approx(bpm, abs=1)
+
+
+@pytest.mark.parametrize('freqs, key', [
+    ((261.63, 329.63, 392.00), 'C'),     # C E G
+    ((220.00, 277.18, 329.63), 'A'),     # A C# E
+    ((220.00, 261.63, 329.63), 'Am'),    # A C E
+])
+def test_key_of_a_triad(freqs, key):
+    assert analyze(tone(*freqs)).key() == key
+
+
+def test_cached_results_are_returned_by_content_hash(tmp_path, monkeypatch):
+    mix = tmp_path / 'mix'
+    mix.mkdir()
+    (mix / 'track.mp3').write_bytes(b'not really audio')
+    stored = {'loudness_lufs': -9.5, 'replaygain_track_gain': -8.5, 'replaygain_track_peak': 1.0, 'bpm': 124.0, 'key': 'Am'}
+    cache_path = tmp_path / '.analysis_cache.json'
+    cache_path.write_text(json.dumps({'version': CACHE_VERSION, 'results': {hash_file(str(mix / 'track.mp3')): stored}}))
+    # Nothing is decoded for a cached file
+    monkeypatch.setattr(audio_analysis, 'analyze_file', None)
+
+    assert analyze_directory(str(mix)) == {'track.mp3': stored}
+    assert load_cache(str(cache_path)) == {hash_file(str(mix / 'track.mp3')): stored}
+
+
+def test_cache_of_another_version_is_ignored(tmp_path):
+    cache_path = tmp_path / '.analysis_cache.json'
+    cache_path.write_text(json.dumps({'version': CACHE_VERSION + 1, 'results': {'abc': {}}}))
+    assert load_cache(str(cache_path)) == {}
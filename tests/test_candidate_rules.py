@@ -0,0 +1,56 @@
+"""Reject rules: whole-word phrases, re: rules, and the sections of a rules file."""
+import pytest
+
+from candidate_rules import RuleSet, parse_rules, load_rules
+
+
+def test_phrases_match_whole_words_only():
+    rules = RuleSet(['live', 'DJ  Set', 'live at'])
+    assert rules.match('Track (Live at Tresor)') in ('live', 'live at')
+    assert rules.match('Stayin Alive') is None
+    assert rules.match('Delivered') is None
+    assert rules.match('Boiler Room dj\tset 2019') == 'DJ  Set'
+    assert rules.match('') is None
+    assert len(RuleSet([])) == 0 and RuleSet([]).match('live') is None
+
+
+def test_match_returns_the_rule_that_fired():
+    rules = RuleSet(['nightcore', r're:\b(?:19|20)\d\d\s+mix\b', r're:sped\s*up'])
+    assert rules.match('Artist - Title (Nightcore)') == 'nightcore'
+    assert rules.match('Summer 2019 Mix') == r're:\b(?:19|20)\d\d\s+mix\b'
+    assert rules.match('Artist - Title SPEDUP') == r're:sped\s*up'
+    assert rules.match('Artist - Title (Original Mix)') is None
+
+
+def test_sections_comments_and_headers():
+    sections = parse_rules(['# comment', '', '[Candidates]', 'live', '  dj set  ', '[tracklist]', 'intro',
+                            '[candidates]', 're:(?P<year>\\d{4}) mix'])
+    assert sections == {'candidates': ['live', 'dj set', 're:(?P<year>\\d{4}) mix'], 'tracklist': ['intro']}
+
+
+def test_load_rules_builds_a_ruleset_per_section(tmp_path):
+    path = tmp_path / 'rules.txt'
+    path.write_text('[candidates]\nreaction\n[tracklist]\nre:^\\d+:\\d+$\n', encoding='utf-8')
+    rules = load_rules(str(path))
+    assert rules['candidates'].match('Producer reacts - REACTION') == 'reaction'
+    assert rules['tracklist'].match('12:34') == 're:^\\d+:\\d+$'
+
+
+@pytest.mark.parametrize('lines, error', [
+    (['live'], r'<rules>:1: rule outside of a \[section\]'),
+    (['[candidates]', 're:(unclosed'], r"<rules>:2: invalid regular expression '\(unclosed'"),
+    (['[candidates]', 're:(?i)live'], r"<rules>:2: invalid regular expression"),
+    (['[youtube]', 're:(?P<x>a)x', 're:(?P<x>b)y'], r"<rules>:3: group name 'x' is already used on line 2"),
+    (['[youtube]', 're:(?P<phrase>a)'], r"<rules>:2: group name 'phrase' is reserved"),
+])
+def test_invalid_rules_name_the_line(lines, error):
+    with pytest.raises(ValueError, match=error):
+        parse_rules(lines)
+
+
+def test_group_names_are_per_section():
+    sections = parse_rules(['[candidates]', 're:(?P<x>a)', '[tracklist]', 're:(?P<x>b)'])
+    assert RuleSet(sections['candidates']).match('a') == 're:(?P<x>a)'
+    assert RuleSet(sections['tracklist']).match('b') == 're:(?P<x>b)'
+    with pytest.raises(ValueError, match='one regular expression'):
+        RuleSet(['re:(?P<x>a)', 're:(?P<x>b)'])
@@ -0,0 +1,128 @@
+"""A coordinator and two workers (native backend, each against its own fake Soulseek network)."""
+import os
+import re
+import sys
+import json
+import sqlite3
+import subprocess
+
+import pytest
+
+from fake_slsk import FakeSoulseek
+from job_queue import CoordinatorClient, JobQueue
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'DJ2MP3_distributed.py')
+TOKEN = 'test-token'
+TRACKS = [f"Artist {n} - Title {n}" for n in range(1, 10)] + ['Artist 10 - missing title']
+LEASE = 2
+
+
+def distributed(*args, **kwargs):
+    return subprocess.Popen([sys.executable, SCRIPT, *args, '--token', TOKEN], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, **kwargs)
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    proc = distributed('coordinator', '--db', str(tmp_path / 'jobs.sqlite'), '--port', '0', '--lease', str(LEASE))
+    line = proc.stdout.readline()
+    port = re.search(r":(\d+) ", line).group(1)
+    yield f"http://127.0.0.1:{port}"
+    proc.kill()
+    proc.wait()
+
+
+def enqueue(tmp_path, coordinator, tracks, source):
+    (tmp_path / 'mix.txt').write_text('\n'.join(tracks) + '\n', encoding='utf-8')
+    (tmp_path / 'soulseek_credentials.txt').write_text('SOULSEEK_USER=me\nSOULSEEK_PASS=pw\n', encoding='utf-8')
+    proc = distributed('enqueue', str(tmp_path / 'mix.txt'), '--coordinator', coordinator, '--source', source)
+    return proc.communicate(timeout=30)[0]
+
+
+def soulseek_worker(tmp_path, coordinator, worker_id, server, *extra):
+    host, port = server
+    return distributed(
+        'worker', '--coordinator', coordinator, '-d', str(tmp_path / 'out'), '--worker-id', worker_id,
+        '--backend', 'native', '--slsk-server', f"{host}:{port}", '--listen-port', '0',
+        '--search-timeout', '1', '--min-size', '1K', '--pref-format', 'mp3', '--sources', 'soulseek',
+        '--batch-size', '2', '--heartbeat', '1', '--poll', '1', '--max-variants', '1', '--deadline', '0.5',
+        *extra, cwd=str(tmp_path))
+
+
+def test_every_job_finishes_once_and_expired_leases_are_requeued(coordinator, tmp_path):
+    assert 'Queued 10 of 10 tracks' in enqueue(tmp_path, coordinator, TRACKS, 'soulseek')
+
+    # A worker that leases three jobs and then disappears
+    client = CoordinatorClient(coordinator, token=TOKEN)
+    ghost = client.lease('ghost', 3, ['soulseek'])
+    assert [job['position'] for job in ghost] == [1, 2, 3]
+
+    fakes = [FakeSoulseek(size=64 * 1024) for _ in range(2)]
+    workers = []
+    try:
+        for n, fake in enumerate(fakes, 1):
+            workers.append(soulseek_worker(tmp_path, coordinator, f"w{n}", fake.start()))
+        logs = [worker.communicate(timeout=90)[0] for worker in workers]
+    finally:
+        for fake in fakes:
+            fake.stop()
+
+    # Both workers took part, and no job was completed twice
+    done = [int(re.search(r"finished (\d+) jobs", log).group(1)) for log in logs]
+    assert all(done) and sum(done) == len(TRACKS), logs
+    assert not any('already finished by another worker' in log for log in logs)
+    assert client.status()['mixes'] == {'mix': {'downloaded': 9, 'not_found': 1}}, logs
+    assert client.complete('ghost', ghost[0]['id'], 'failed', {}) is False
+
+    db = sqlite3.connect(str(tmp_path / 'jobs.sqlite'))
+    rows = db.execute("SELECT track, status, attempts, result FROM jobs ORDER BY position").fetchall()
+    assert [row[0] for row in rows] == TRACKS
+    for track, status, attempts, result in rows:
+        result = json.loads(result)
+        # The ghost's jobs went back to the queue when its lease expired
+        expected = 2 if track in [job['track'] for job in ghost] else 1
+        assert (attempts, result['attempt']) == (expected, expected), track
+        assert result['worker'] in ('w1', 'w2')
+    files = sorted(os.listdir(tmp_path / 'out' / 'mix'))
+    assert [f for f in files if f.endswith('.mp3')] == sorted(f"{t}.mp3" for t in TRACKS[:9])
+
+
+def test_soulseek_only_worker_hands_auto_misses_to_youtube(coordinator, tmp_path):
+    enqueue(tmp_path, coordinator, ['Artist 1 - Title 1', 'Artist 2 - missing title'], 'auto')
+    fake = FakeSoulseek(size=64 * 1024)
+    try:
+        log = soulseek_worker(tmp_path, coordinator, 'w1', fake.start(), '--exit-when-empty').communicate(timeout=60)[0]
+    finally:
+        fake.stop()
+    assert 'Artist 2 - missing title: not on Soulseek, queued for YouTube' in log
+    client = CoordinatorClient(coordinator, token=TOKEN)
+    assert client.status()['mixes'] == {'mix': {'downloaded': 1, 'queued': 1}}
+    assert client.lease('w2', 10, ['soulseek', 'auto']) == []
+    jobs = client.lease('w2', 10, ['youtube'])
+    assert [(j['track'], j['source'], j['attempt'], j['position']) for j in jobs] == [('Artist 2 - missing title', 'youtube', 1, 2)]
+
+
+def test_handoff_needs_the_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite'))
+    queue.enqueue('mix', ['A - 1'], 'auto')
+    job = queue.lease('w1', 1, ['auto'])[0]
+    assert queue.handoff('w2', job['id'], 'youtube', {}) is False
+    assert queue.handoff('w1', job['id'], 'youtube', {'status': 'not_found'}) is True
+    assert queue.handoff('w1', job['id'], 'youtube', {}) is False
+
+
+def test_token_is_required(coordinator):
+    with pytest.raises(RuntimeError, match='token'):
+        CoordinatorClient(coordinator, retries=1).status()
+    with pytest.raises(RuntimeError, match='token'):
+        CoordinatorClient(coordinator, retries=1, token='wrong').lease('w', 1, ['soulseek'])
+    assert CoordinatorClient(coordinator, token=TOKEN).status() == {'mixes': {}, 'workers': {}}
+
+
+def test_positions_continue_across_enqueue_batches(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite'))
+    queue.enqueue('mix', ['A - 1', 'A - 2'], start=1)
+    queue.enqueue('other', ['B - 1'], start=1)
+    queue.enqueue('mix', ['A - 3'], start=3)
+    jobs = queue.lease('w', 10, ['soulseek'])
+    assert [(j['mix'], j['position']) for j in jobs] == [('mix', 1), ('mix', 2), ('other', 1), ('mix', 3)]
@@ -0,0 +1,93 @@
+"""The bandwidth cap and disk slots shared by several processes through one state file."""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import io_scheduler
+from io_scheduler import IOScheduler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHILD = '''
+import sys, time
+sys.path.insert(0, {root!r})
+from io_scheduler import IOScheduler
+scheduler = IOScheduler({bandwidth}, {slots}, {state!r})
+{body}
+'''
+
+HOLD_SLOT = '''
+with scheduler.disk():
+    start = time.time()
+    time.sleep(0.3)
+    print(start, time.time())
+'''
+
+DOWNLOAD = '''
+start = time.time()
+for _ in range(20):
+    scheduler.wait(10 * 1024)
+print(start, time.time())
+'''
+
+
+def run_children(tmp_path, body, count, bandwidth=None, slots=None):
+    code = CHILD.format(root=ROOT, bandwidth=bandwidth, slots=slots, state=str(tmp_path / 'io.json'), body=body)
+    procs = [subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True) for _ in range(count)]
+    return [tuple(map(float, proc.communicate(timeout=30)[0].split())) for proc in procs]
+
+
+def test_disk_slots_are_shared(tmp_path):
+    spans = sorted(run_children(tmp_path, HOLD_SLOT, 3, slots=1))
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        assert start >= end
+
+
+def test_bandwidth_is_shared(tmp_path):
+    # Two processes move 200K each under a 200K/s cap that starts with a 200K burst
+    spans = run_children(tmp_path, DOWNLOAD, 2, bandwidth=200 * 1024)
+    elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+    assert elapsed > 0.8
+
+
+def test_slots_of_exited_processes_are_freed(tmp_path):
+    gone = subprocess.Popen([sys.executable, '-c', 'pass'])
+    gone.wait()
+    (tmp_path / 'io.json').write_text(json.dumps({'disk': {'seq': 1, 'held': {str(gone.pid): 1}, 'waiting': []}}))
+    scheduler = IOScheduler(disk_slots=1, state_path=str(tmp_path / 'io.json'))
+    start = time.time()
+    with scheduler.disk():
+        pass
+    assert time.time() - start < 1
+    assert json.loads((tmp_path / 'io.json').read_text())['disk']['held'] == {}
+
+
+def test_runs_without_a_cap_keep_to_themselves(tmp_path, monkeypatch):
+    monkeypatch.setattr(io_scheduler, 'STATE_PATH', str(tmp_path / 'io.json'))
+    monkeypatch.setattr(io_scheduler, '_scheduler', io_scheduler.get_scheduler())
+    scheduler = io_scheduler.configure(argparse.Namespace(bandwidth=None, disk_slots=None))
+    with scheduler.disk():
+        assert scheduler.throttle(10 ** 9) == 0.0
+    assert not (tmp_path / 'io.json').exists()
+    io_scheduler.configure(argparse.Namespace(bandwidth=None, disk_slots=1))
+    with io_scheduler.get_scheduler().disk():
+        pass
+    assert (tmp_path / 'io.json').exists()
+
+
+def test_shared_bucket_is_updated_in_batches(tmp_path, monkeypatch):
+    updates = []
+    update = io_scheduler.SharedState.update
+
+    def counted(self):
+        updates.append(1)
+        return update(self)
+
+    monkeypatch.setattr(io_scheduler.SharedState, 'update', counted)
+    scheduler = IOScheduler(1024 * 1024, state_path=str(tmp_path / 'io.json'))
+    for _ in range(1000):
+        scheduler.throttle(1024)
+    # 1000 KiB in 0.1 s (~100 KiB) batches, or one per 0.1 s on a slow machine
+    assert 5 <= len(updates) <= 20
@@ -0,0 +1,59 @@
+"""plan_mix: which tracks of a mix folder are already there, and find_cached_run."""
+import os
+import argparse
+
+import job_plan
+from job_plan import plan_mix, find_cached_run
+from run_report import RunReport
+from slsk_client import write_index
+
+TRACKS = ['Artist A - Alpha', 'Artist B - Beta', 'Artist C - Gamma', 'Artist D - Delta',
+          'Artist E - Epsilon', 'Artist F - Phi', 'Artist G - Gee']
+
+
+def test_present_tracks_are_matched_through_reports_and_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mix = tmp_path / 'downloads' / 'mix'
+    mix.mkdir(parents=True)
+    # Soulseek files keep the peer's name, YouTube files are named after the track
+    for name in ('01 alpha (320).mp3', 'b-side master.mp3', '3 - Artist C - Gamma.mp3', 'gee.mp3'):
+        (mix / name).write_bytes(b'x')
+    with RunReport(str(mix), 'mix.txt') as report:
+        report.track('Artist A - Alpha', 'downloaded', source='soulseek', path=os.path.join('downloads', 'mix', '01 alpha (320).mp3'))
+        report.track('Artist D - Delta', 'downloaded', source='soulseek', path=str(mix / 'deleted since.mp3'))
+    # DJ2MP3_youtube.py reports into the download root
+    with RunReport(str(tmp_path / 'downloads'), 'https://example.com/mix') as report:
+        report.track('Artist G - Gee', 'downloaded', source='youtube', path=str(mix / 'gee.mp3'))
+        report.track('Artist B - Beta', 'downloaded', source='youtube', path=str(tmp_path / 'other' / 'b-side master.mp3'))
+    (mix / 'list').mkdir()
+    write_index(str(mix / 'list' / '_index.sldl'), [
+        {'title': 'Artist B - Beta', 'filepath': './b-side master.mp3', 'state': 1},
+        {'title': 'Artist E - Epsilon', 'filepath': './gone.mp3', 'state': 1},
+        {'title': 'Artist F - Phi', 'state': 2, 'failurereason': 2},
+    ])
+
+    plan = plan_mix(TRACKS, str(mix), argparse.Namespace(), variants=False)
+    assert plan['present'] == 4  # Alpha and Gee by report, Beta by index, Gamma by name
+    assert plan['indexed'] == 1  # Epsilon: sldl skips it, though its file is gone
+    assert plan['pending'] == ['Artist D - Delta', 'Artist F - Phi']
+    assert plan['failed_before'] == 1
+
+
+def test_find_cached_run_closes_every_report(tmp_path, monkeypatch):
+    opened = []
+    original = job_plan.iter_records
+
+    def iter_records(paths):
+        records = original(paths)
+        opened.append(records)
+        return records
+
+    monkeypatch.setattr(job_plan, 'iter_records', iter_records)
+    for n, source in enumerate(['b', 'a', 'b']):
+        with RunReport(str(tmp_path / f"mix{n}"), source) as report:
+            report.track(f"Artist - Track {n}", 'downloaded')
+
+    output, tracks = find_cached_run(str(tmp_path), 'a')
+    assert len(opened) == 3
+    assert all(records.gi_frame is None for records in opened)
+    assert (output, tracks) == (str(tmp_path / 'mix1'), ['Artist - Track 1'])
@@ -0,0 +1,33 @@
+from query_planner import query_variants, strip_feat, strip_mix_name
+
+
+def test_title_with_mix_word_is_not_stripped():
+    variants = query_variants('Daft Punk - Da Funk Remix')
+    assert 'Daft Punk' not in variants
+    assert variants == ['Daft Punk - Da Funk Remix', 'Daft Punk Da Funk Remix']
+
+
+def test_feat_credit_is_removed_up_to_the_dash():
+    assert strip_feat('Artist feat. John Smith - Title') == 'Artist - Title'
+    assert query_variants('Artist feat. John Smith - Title')[-1] == 'Artist - Title'
+    assert 'Artist Smith - Title' not in query_variants('Artist feat. John Smith - Title')
+
+
+def test_feat_credit_is_removed_up_to_the_closing_bracket():
+    assert strip_feat('Artist - Title (ft. John Smith)') == 'Artist - Title'
+    assert strip_feat('Artist - Title [featuring John Smith & Jane Doe]') == 'Artist - Title'
+    assert strip_feat('Artist - Title (Remix feat. John Smith)') == 'Artist - Title (Remix)'
+    assert query_variants('Artist - Title (feat. John Smith) (Extended Mix)')[-1] == 'Artist - Title'
+
+
+def test_mix_suffix_is_stripped_when_it_is_not_the_title():
+    assert strip_mix_name('Artist - Title - Kink Remix').strip() == 'Artist - Title'
+    assert strip_mix_name('Artist Title - Extended Mix').strip() == 'Artist Title'
+    assert strip_mix_name('Artist - Title (Original Mix)').strip() == 'Artist - Title'
+
+
+def test_variants_never_lose_the_title():
+    for track in ('Daft Punk - Da Funk Remix', 'Artist - (Untitled)', 'Artist feat. B - Title Remix'):
+        for variant in query_variants(track)[2:]:
+            title = variant.split(' - ', 1)[1:]
+            assert title and title[0].strip(), variant
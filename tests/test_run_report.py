@@ -0,0 +1,27 @@
+import atexit
+import threading
+from unittest import mock
+
+from run_report import RunReport, iter_records
+
+
+def test_close_writes_one_end_record_across_threads(tmp_path):
+    report = RunReport(str(tmp_path), 'tracks.txt')
+    report.track('A - One', 'downloaded', source='soulseek')
+    threads = [threading.Thread(target=report.close, kwargs={'searches': n}) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.close()
+    types = [r['type'] for r in iter_records([report.path])]
+    assert types == ['run', 'track', 'end']
+
+
+def test_close_unregisters_the_exit_hook(tmp_path):
+    with mock.patch.object(atexit, 'register') as register, mock.patch.object(atexit, 'unregister') as unregister:
+        with RunReport(str(tmp_path), 'tracks.txt') as report:
+            pass
+    register.assert_called_once_with(report.close)
+    unregister.assert_called_once_with(report.close)
+    assert report.file.closed
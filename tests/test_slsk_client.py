@@ -0,0 +1,109 @@
+"""Native Soulseek client against the fake server and peer in fake_slsk.py."""
+import os
+import asyncio
+import argparse
+
+import pytest
+
+from fake_slsk import FakeSoulseek, PEER_NAME
+from sldl_utils import read_sldl_index, track_key
+from slsk_client import SoulseekClient, NativeBackend, fetch_track, rank_results, run_native, place_file
+
+SIZE = 200 * 1024
+
+
+def make_args(**kwargs):
+    args = dict(pref_format='mp3', min_bitrate=256, min_size='1K', max_size='100M', search_timeout=0.5,
+                slsk_concurrency=4, listen_port=0)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSoulseek(size=SIZE)
+    yield fake
+    fake.stop()
+
+
+async def connected(server):
+    client = SoulseekClient('me', 'secret', server=server, listen_host='127.0.0.1', listen_port=0)
+    await client.connect()
+    return client
+
+
+def test_login_search_download(fake, tmp_path):
+    server = fake.start()
+
+    async def scenario():
+        client = await connected(server)
+        try:
+            results = await client.search('Artist - Title', timeout=0.5)
+            best = rank_results(results, make_args())[0]
+            transfer = await client.download(best, str(tmp_path / 'Artist - Title.mp3'), timeout=10)
+            missing = await client.search('missing track', timeout=0.3)
+        finally:
+            await client.close()
+        return results, best, transfer, missing
+
+    results, best, transfer, missing = asyncio.run(scenario())
+    assert fake.logins == ['me']
+    assert fake.searches == ['Artist - Title', 'missing track']
+    assert {r.ext for r in results} == {'mp3', 'ogg'}
+    assert (best.username, best.filename, best.bitrate) == (PEER_NAME, 'Music\\Artist - Title.mp3', 320)
+    assert missing == []
+    assert transfer.path == str(tmp_path / 'Artist - Title.mp3')
+    assert transfer.bytes == SIZE == os.path.getsize(transfer.path)
+    assert os.listdir(tmp_path) == ['Artist - Title.mp3']
+
+
+def test_same_remote_name_gets_collision_suffix(tmp_path):
+    # Every query's results are called 'track.mp3', in a folder per query
+    fake = FakeSoulseek(size=SIZE, name=lambda query: f"{query}\\track")
+    server = fake.start()
+    (tmp_path / 'track.mp3').write_bytes(b'already here')
+
+    async def scenario():
+        client = await connected(server)
+        try:
+            semaphore = asyncio.Semaphore(4)
+            return await asyncio.gather(*(fetch_track(client, q, str(tmp_path), make_args(), semaphore)
+                                          for q in ('First - One', 'Second - Two', 'Third - Three')))
+        finally:
+            await client.close()
+
+    try:
+        rows = asyncio.run(scenario())
+    finally:
+        fake.stop()
+    assert sorted(os.listdir(tmp_path)) == ['track.mp3', 'track_1.mp3', 'track_2.mp3', 'track_3.mp3']
+    assert (tmp_path / 'track.mp3').read_bytes() == b'already here'
+    assert sorted(row['filepath'] for row in rows) == ['./track_1.mp3', './track_2.mp3', './track_3.mp3']
+    # Each query's row points at its own transfer
+    assert len({(tmp_path / row['filepath']).read_bytes() for row in rows}) == 3
+
+
+def test_place_file_never_replaces(tmp_path):
+    dest = tmp_path / 'a.mp3'
+    dest.write_bytes(b'old')
+    tmp = tmp_path / '.tmp-1'
+    tmp.write_bytes(b'new')
+    assert place_file(str(tmp), str(dest)) == str(tmp_path / 'a_1.mp3')
+    assert dest.read_bytes() == b'old'
+    assert not tmp.exists()
+
+
+def test_run_native_writes_sldl_index(fake, tmp_path):
+    host, port = fake.start()
+    list_path = tmp_path / 'search.txt'
+    list_path.write_text('"Artist - Found"\n"Artist - missing one"\n', encoding='utf-8')
+    try:
+        run_native(str(list_path), str(tmp_path), make_args(slsk_server=f"{host}:{port}"), 'me', 'secret')
+    finally:
+        if NativeBackend._instance:
+            NativeBackend._instance.shutdown()
+    index = read_sldl_index(str(tmp_path / 'search' / '_index.sldl'))
+    assert index[track_key('Artist - Found')]['state'] == '1'
+    assert index[track_key('Artist - Found')]['filepath'] == './Artist - Found.mp3'
+    assert index[track_key('Artist - missing one')]['state'] == '2'
+    assert os.path.getsize(tmp_path / 'search' / 'Artist - Found.mp3') == SIZE
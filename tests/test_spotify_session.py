@@ -0,0 +1,88 @@
+"""SharedClientCredentials: one token per host, refreshed before it expires by one caller."""
+import json
+import time
+import threading
+
+import requests
+
+from spotify_session import LockedTokenCache, SharedClientCredentials
+
+
+class TokenEndpoint(requests.Session):
+    """A session whose every POST is answered locally as a token request to Spotify."""
+
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, **kwargs):
+        with self.lock:
+            self.requests += 1
+            token = f"token-{self.requests}"
+        time.sleep(self.delay)
+        return TokenResponse({'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+
+class TokenResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return dict(self.data)
+
+
+def credentials(tmp_path, endpoint):
+    return SharedClientCredentials('id', 'secret', LockedTokenCache(str(tmp_path / '.cache-test')),
+                                   requests_session=endpoint)
+
+
+def write_cache(tmp_path, token, expires_in):
+    (tmp_path / '.cache-test').write_text(json.dumps({'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600,
+                                                      'expires_at': int(time.time()) + expires_in}))
+
+
+def test_valid_cached_token_is_reused(tmp_path):
+    write_cache(tmp_path, 'cached', 3000)
+    endpoint = TokenEndpoint()
+    auth = credentials(tmp_path, endpoint)
+    assert auth.get_access_token() == 'cached'
+    assert auth.get_access_token() == 'cached'
+    assert endpoint.requests == 0
+
+
+def test_token_is_refreshed_inside_the_margin(tmp_path):
+    write_cache(tmp_path, 'cached', 200)
+    endpoint = TokenEndpoint()
+    auth = credentials(tmp_path, endpoint)
+    assert auth.get_access_token() == 'token-1'
+    assert json.loads((tmp_path / '.cache-test').read_text())['access_token'] == 'token-1'
+    # The token held in memory is refreshed as well once it gets close to expiring
+    auth.token_info['expires_at'] = int(time.time()) + 299
+    write_cache(tmp_path, 'stale', 299)
+    assert auth.get_access_token() == 'token-2'
+    assert endpoint.requests == 2
+
+
+def test_concurrent_callers_refresh_once(tmp_path):
+    endpoint = TokenEndpoint(delay=0.2)
+    # Two runs on this host, each with its own cache handler on the same file, and two threads each
+    runs = [credentials(tmp_path, endpoint) for _ in range(2)]
+    barrier = threading.Barrier(4)
+    tokens = []
+
+    def call(auth):
+        barrier.wait()
+        tokens.append(auth.get_access_token())
+
+    threads = [threading.Thread(target=call, args=(auth,)) for auth in runs for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert endpoint.requests == 1
+    assert tokens == ['token-1'] * 4
@@ -0,0 +1,57 @@
+"""TrackRouter: Soulseek downloads that finish after a track was handed to YouTube."""
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import DJ2MP3_youtube as youtube
+import DJ2MP3_tracklist_via_soulseek_and_youtube as mixed
+from run_report import RunReport, iter_records
+from sldl_utils import track_key
+
+TRACKS = ['Artist A - Lost', 'Artist B - Both', 'Artist C - Nowhere']
+
+
+def fake_youtube(index, track, args, ydl_opts, out_dir, report, total, watchdog=None):
+    """Finds only 'Both'; the others are recorded as not found, like process_track does."""
+    if 'Both' in track:
+        path = os.path.join(out_dir, f"{index:02d} - {track}.mp3")
+        open(path, 'wb').close()
+        report.track(track, 'downloaded', source='youtube', path=path)
+        return path
+    with youtube.log_lock:
+        youtube.summary['skipped'].append((track, 'no valid match'))
+    report.track(track, 'not_found', source='youtube', reason='no valid match')
+    return None
+
+
+def test_late_soulseek_download_is_kept_when_youtube_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(youtube, 'process_track', fake_youtube)
+    monkeypatch.setattr(youtube, 'summary', {'success': [], 'skipped': []})
+    sldl_dir = tmp_path / 'list'
+    sldl_dir.mkdir()
+    for name in ('lost.mp3', 'both.mp3'):
+        (sldl_dir / name).write_bytes(b'soulseek')
+    index = {track_key('Artist A - Lost'): {'filepath': './lost.mp3', 'state': '1'},
+             track_key('Artist B - Both'): {'filepath': './both.mp3', 'state': '1'}}
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    with RunReport(str(tmp_path), 'mix.txt') as report:
+        router = mixed.TrackRouter(TRACKS, executor, argparse.Namespace(), {}, str(tmp_path), report, 0)
+        for track in TRACKS:
+            router.route(track)
+        # YouTube is done with every track before sldl reports the first two as downloaded
+        wait(router.futures)
+        router.succeeded('Artist A - Lost')
+        router.succeeded('Artist B - Both')
+        router.sldl_finished()
+        executor.shutdown(wait=True)
+        router.settle_late(index, str(sldl_dir))
+
+    assert (sldl_dir / 'lost.mp3').exists()
+    assert not (sldl_dir / 'both.mp3').exists()
+    assert router.soulseek_ok == {'Artist A - Lost'}
+    assert youtube.summary['skipped'] == [('Artist C - Nowhere', 'no valid match')]
+    records = [(r['track'], r['status'], r['source']) for r in iter_records([report.path]) if r['type'] == 'track']
+    # The Soulseek record of 'Lost' is written by main() after flattening; its YouTube failure is dropped
+    assert sorted(records) == [('Artist B - Both', 'downloaded', 'youtube'),
+                               ('Artist C - Nowhere', 'not_found', 'youtube')]
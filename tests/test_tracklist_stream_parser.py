@@ -0,0 +1,71 @@
+"""--stream-parse: same tracks as the BeautifulSoup parser with a bounded memory peak."""
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from DJ2MP3_1001tracklists_via_soulseek import (
+    fetch_1001tracklists_tracks_soup, fetch_1001tracklists_tracks_streaming,
+)
+
+TRACKS = 2000
+# Filler markup per track, as on real pages (player buttons, links, metadata)
+FILLER = '<div class="tlToogleData"><span class="badge">ID</span>' + '<i class="fa fa-play"></i>' * 10 + '</div>'
+
+
+def make_page(count=TRACKS):
+    parts = ['<html><head><title>Synthetic Mix | 1001Tracklists</title>',
+             '<script>' + 'var x = 1;\n' * 2000 + '</script></head><body>',
+             '<h1>Synthetic Mix @ Somewhere</h1>']
+    for i in range(count):
+        parts.append(f'<div class="tlpItem"><div class="bItm"><span class="trackValue">'
+                     f'Artist {i} - Title Number {i} (Extended Mix)</span></div>{FILLER}</div>')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+@pytest.fixture(scope='module')
+def page_url():
+    page = make_page()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/tracklist/synthetic.html", len(page)
+    server.shutdown()
+    server.server_close()
+
+
+def traced_peak(fn, *args):
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_stream_parser_matches_soup_with_bounded_peak(page_url):
+    url, page_size = page_url
+    (soup_tracks, soup_title), soup_peak = traced_peak(fetch_1001tracklists_tracks_soup, url, {})
+    (stream_tracks, stream_title), stream_peak = traced_peak(fetch_1001tracklists_tracks_streaming, url, {})
+
+    assert len(stream_tracks) == TRACKS
+    assert stream_tracks == soup_tracks
+    assert stream_title == soup_title == 'Synthetic Mix @ Somewhere'
+    # The soup parser holds the page and its whole element tree; the stream parser only
+    # a chunk plus the tracks found
+    assert soup_peak > 3 * page_size
+    assert stream_peak < page_size
+    assert stream_peak * 20 < soup_peak
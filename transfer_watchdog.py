@@ -0,0 +1,96 @@
+import time
+import threading
+
+
+class TransferStalled(Exception):
+    """Raised (e.g. from a yt-dlp progress hook) to abort a stalled transfer or one past the run deadline."""
+
+
+class TransferWatchdog:
+    """
+    Tracks bytes-progress per transfer. A transfer is stalled when its throughput over the
+    last stall_seconds stayed below min_rate bytes/s. Also keeps a global run deadline and
+    counts stalls, requeues and tracks skipped because of the deadline for the summary.
+    """
+
+    def __init__(self, min_rate=8 * 1024, stall_seconds=60, deadline=None):
+        self.min_rate = min_rate
+        self.stall_seconds = stall_seconds
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.transfers = {}  # key -> [window start, bytes at window start, bytes now]
+        self.lock = threading.Lock()
+        self.stats = {'stalled': 0, 'requeued': 0, 'deadline': 0}
+
+    @classmethod
+    def from_args(cls, args):
+        """Build from --stall-rate (KiB/s), --stall-timeout (s) and --deadline (min)."""
+        return cls(min_rate=args.stall_rate * 1024, stall_seconds=args.stall_timeout,
+                   deadline=args.deadline * 60 if args.deadline else None)
+
+    def progress(self, key, total_bytes):
+        """
+        Record that transfer key has received total_bytes so far.
+        Raises TransferStalled if it is stalled or the deadline has passed.
+        """
+        with self.lock:
+            self.transfers.setdefault(key, [time.monotonic(), total_bytes, total_bytes])[2] = total_bytes
+        if self.expired():
+            raise TransferStalled("run deadline reached")
+        if self.is_stalled(key):
+            raise TransferStalled(f"below {self.min_rate // 1024} KiB/s for {self.stall_seconds}s")
+
+    def is_stalled(self, key):
+        """Check the current throughput window of key; counts the stall once if it is."""
+        if not self.stall_seconds:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            entry = self.transfers.get(key)
+            if not entry or now - entry[0] < self.stall_seconds:
+                return False
+            start, start_bytes, current = entry
+            if (current - start_bytes) / (now - start) >= self.min_rate:
+                entry[0], entry[1] = now, current
+                return False
+            del self.transfers[key]
+            self.stats['stalled'] += 1
+        return True
+
+    def extend(self, seconds, key=None):
+        """
+        Leave a pause we imposed ourselves (bandwidth shaping) out of the throughput of
+        transfer key, or of every active transfer.
+        """
+        with self.lock:
+            entries = [self.transfers[key]] if key in self.transfers else [] if key else self.transfers.values()
+            for entry in entries:
+                entry[0] += seconds
+
+    def finish(self, key):
+        with self.lock:
+            self.transfers.pop(key, None)
+
+    def active(self):
+        with self.lock:
+            return list(self.transfers)
+
+    def requeued(self):
+        with self.lock:
+            self.stats['requeued'] += 1
+
+    def skipped(self, count=1):
+        """Record tracks that were given up because the deadline had passed."""
+        with self.lock:
+            self.stats['deadline'] += count
+
+    def time_left(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def summary(self):
+        text = f"{self.stats['stalled']} stalled transfers cancelled, {self.stats['requeued']} requeued"
+        if self.stats['deadline']:
+            text += f", {self.stats['deadline']} tracks left at the run deadline"
+        return text